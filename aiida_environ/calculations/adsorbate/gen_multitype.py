@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
+import numpy as np
 from aiida.engine import calcfunction
 from aiida.orm import List, StructureData
 
 from aiida_environ.utils.graph import Graph
 from aiida_environ.utils.occupancy import Occupancy
+from aiida_environ.utils.structure import StructureFactory, store_structures
 
 
 @calcfunction
@@ -42,19 +44,21 @@ def adsorbate_gen_multitype(
     # Setup based on inputs
     max_list = _gen_multitype(site_index, possible_adsorbates, adsorbate_index)
 
-    struct_list = []
-    for i, ads_configuration in enumerate(max_list):
-        new_structure = StructureData(cell=structure.cell)
-        for site in structure.sites:
-            new_structure.append_atom(position=site.position, symbols=site.kind_name)
-        for site_configuration, pos in zip(ads_configuration, adsorbate_sites):
+    factory = StructureFactory(structure)
+    sites = np.array(adsorbate_sites.get_list(), dtype=float).reshape(-1, 3)
+
+    new_structures = []
+    for ads_configuration in max_list:
+        positions = []
+        kind_names = []
+        for site_configuration, pos in zip(ads_configuration, sites):
             for sp in site_configuration:
                 if sp != 0:
-                    new_structure.append_atom(position=pos, symbols=sp)
-        new_structure.store()
-        struct_list.append(new_structure.pk)
+                    positions.append(pos)
+                    kind_names.append(sp)
+        new_structures.append(factory.build(np.reshape(positions, (-1, 3)), kind_names))
 
-    struct_list = List(list=struct_list)
+    struct_list = List(list=store_structures(new_structures))
 
     return struct_list
 
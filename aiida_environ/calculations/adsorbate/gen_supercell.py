@@ -9,6 +9,8 @@ import numpy as np
 from aiida.engine import calcfunction
 from aiida.orm import List, StructureData
 
+from aiida_environ.utils.structure import StructureFactory, store_structures
+
 
 def gen_structures_n(size: Tuple[int, int], n: int) -> Pylist:
     """Generates a list of numpy arrays, where each array is a grid representation of the adsorbate
@@ -204,45 +206,31 @@ def adsorbate_gen_supercell(parameters, structure, vacancies):
         for i in range(2, n - 1):
             inner_perms = gen_structures_n(size, i)
             perms.extend(inner_perms)
-    struct_perms = []
-    for i, x in enumerate(perms):
-        list1 = []
-        for j, y in enumerate(x):
-            list2 = []
-            for k, z in enumerate(y):
-                list2.append("H" if z == 1 else 0)
-            list1.append(list2)
-        struct_perms.append(list1)
 
     # TODO: use solution for adsorbate_multitype_gen
-    struct_list = []
+    factory = StructureFactory(structure)
+    sites = np.array(vacancies.get_list(), dtype=float).reshape(-1, 3)
+    if reflect:
+        # assume that the structure has symmetry around the provided axis, so
+        # take the position of the axis as the mean value
+        reflected = np.copy(sites)
+        reflected[:, axis - 1] = 2 * factory.get_axis_mean(axis) - sites[:, axis - 1]
+        # each adsorbate is directly followed by its reflection
+        sites = np.stack((sites, reflected), axis=1)
+    else:
+        sites = sites[:, np.newaxis, :]
+
+    new_structures = []
     added = []
-    for i, ads_configuration in enumerate(struct_perms):
-        added_ads = 0
-        new_structure = StructureData(cell=structure.cell)
-        for site in structure.sites:
-            new_structure.append_atom(position=site.position, symbols=site.kind_name)
-        for site_configuration, pos in zip(ads_configuration, vacancies):
-            for sp in site_configuration:
-                if sp != 0:
-                    added_ads += 1
-                    new_structure.append_atom(position=pos, symbols=sp)
-                    if reflect:
-                        added_ads += 1
-                        rpos = list(pos)
-                        # assume that the structure has symmetry around the provided axis, so
-                        # take the position of the axis as the mean value
-                        apos = 0.0
-                        for site in structure.sites:
-                            apos += site.position[axis - 1]
-                        apos /= len(structure.sites)
-                        rpos[axis - 1] = 2 * apos - rpos[axis - 1]
-                        new_structure.append_atom(position=tuple(rpos), symbols=sp)
-        new_structure.store()
-        struct_list.append(new_structure.pk)
-        added.append(added_ads)
-
-    struct_list = List(list=struct_list)
+    for perm in perms:
+        # every occupied grid point in a row places one adsorbate on the matching vacancy
+        rows = min(len(perm), len(sites))
+        counts = np.count_nonzero(perm[:rows], axis=1)
+        positions = np.repeat(sites[:rows], counts, axis=0).reshape(-1, 3)
+        new_structures.append(factory.build(positions, ["H"] * len(positions)))
+        added.append(len(positions))
+
+    struct_list = List(list=store_structures(new_structures))
     added = List(list=added)
 
     return {"output_structs": struct_list, "num_adsorbate": added}
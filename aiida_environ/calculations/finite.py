@@ -1,125 +1,60 @@
 # -*- coding: utf-8 -*-
+import numpy as np
 from aiida.engine import calcfunction
-from aiida.orm import Bool, Dict, List, load_node
+from aiida.orm import Bool, Dict, List
 
+from aiida_environ.utils.finite import (
+    DIFF_ORDERS,
+    finite_difference,
+    get_default_accuracy,
+    richardson_extrapolation,
+)
+from aiida_environ.utils.results import load_output_arrays, load_output_parameters
 
-def _setup(pks, dh, environ=True):
-    """Returns initial position data and initializes global variables."""
 
-    global N
-    global STEP
-    global SCALARS
-    global DERIVATIVES
-    global SECOND_DERIVATIVES
+def _setup(pks):
+    """Returns the DFT energies and total forces of the calculations, in order."""
 
-    N = len(pks)
-    STEP = dh
-    SECOND_DERIVATIVES = []
+    # the base workchains expose the `output_parameters` of their last calculation, the
+    # output_trajectory arrays have a slightly different energy, force precision
+    results = load_output_parameters(pks, ["energy", "total_force"])
 
-    # TODO would like to use base workchain output, but energy, force precision is slightly different
-    # WorkChain.outputs.output_trajectory.get_array('energy')[0]
-    # WorkChain.outputs.output_trajectory.get_array('total_force')[0]
+    return results["energy"], results["total_force"]
 
-    if environ:
 
-        calcs = [load_node(pk).called_descendants[-1] for pk in pks]
-        SCALARS = [calc.res.energy for calc in calcs]
-        DERIVATIVES = [calc.res.total_force for calc in calcs]
+def _get_step(settings):
+    """Returns the spacing between the sampled positions."""
 
-        return {"Energy": SCALARS[0], "Total force": DERIVATIVES[0]}
+    dr = sum([component**2 for component in settings["step_sizes"]]) ** 0.5
 
-    SCALARS = [load_node(pk) for pk in pks]
+    # central first-order differences are sampled with half-step increments
+    if settings["diff_type"] == "central" and settings["diff_order"] == "first":
+        return dr / 2
 
-    return SCALARS[0]
+    return dr
 
 
-def _calculate_first_order_difference(two_scalars: tuple, one_derivative: float):
-    """Returns first-order finite difference & compares to DFT force."""
+def _calculate_differences(scalars, derivatives, step, diff_type, diff_order, accuracy):
+    """Returns finite differences of the scalars & the DFT derivatives they compare to.
 
-    dE = (two_scalars[1] - two_scalars[0]) / STEP
-    return dE, abs(dE - one_derivative)
-
-
-def _calculate_second_order_difference(
-    three_scalars: tuple, two_derivatives: tuple, central: bool = False
-):
-    """Returns second-order finite difference & compares to force difference."""
-
-    d2E = (three_scalars[2] - 2 * three_scalars[1] + three_scalars[0]) / STEP ** 2
-
-    if central:
-        dF = (two_derivatives[1] - two_derivatives[0]) / (4 * STEP)
-    else:
-        dF = (two_derivatives[1] - two_derivatives[0]) / (2 * STEP)
-
-    SECOND_DERIVATIVES.append(dF)
-
-    return d2E, abs(d2E - dF)
-
-
-def _calculate_central_difference(i, order):
-    """Returns first or second order central difference derivative."""
-
-    if order == "second":
-
-        return _calculate_second_order_difference(
-            three_scalars=(SCALARS[i - 1], SCALARS[i], SCALARS[i + 1]),
-            two_derivatives=(
-                DERIVATIVES[i - 1],
-                DERIVATIVES[i + 1],
-            ),
-            central=True,
-        )
-
-    return _calculate_first_order_difference(
-        two_scalars=(SCALARS[i - 1], SCALARS[i + 1]), one_derivative=DERIVATIVES[i]
-    )
-
-
-def _calculate_forward_difference(i, order):
-    """Returns first or second order forward difference derivative."""
-
-    if order == "second":
-
-        return _calculate_second_order_difference(
-            three_scalars=(SCALARS[i], SCALARS[i + 1], SCALARS[i + 2]),
-            two_derivatives=(DERIVATIVES[i], DERIVATIVES[i + 1]),
-        )
+    First-order differences of the energy are compared to the DFT forces at the same points.
+    Second-order differences of the energy are compared to the first-order differences of
+    the DFT forces, computed with a stencil of the same type and accuracy.
+    """
 
-    return _calculate_first_order_difference(
-        two_scalars=(SCALARS[i], SCALARS[i + 1]), one_derivative=DERIVATIVES[i]
+    indices, finite_differences = finite_difference(
+        scalars, step, DIFF_ORDERS[diff_order], diff_type, accuracy
     )
 
+    if diff_order == "first":
+        return indices, finite_differences, derivatives[indices]
 
-def _calculate_backward_difference(i, order):
-    """Returns first or second order backward difference derivative."""
-
-    if order == "second":
-
-        return _calculate_second_order_difference(
-            three_scalars=(SCALARS[i - 2], SCALARS[i - 1], SCALARS[i]),
-            two_derivatives=(DERIVATIVES[i - 1], DERIVATIVES[i]),
-        )
-
-    return _calculate_first_order_difference(
-        two_scalars=(SCALARS[i - 1], SCALARS[i]), one_derivative=DERIVATIVES[i]
+    force_indices, force_differences = finite_difference(
+        derivatives, step, 1, diff_type, accuracy
     )
+    common, i, j = np.intersect1d(indices, force_indices, return_indices=True)
 
-
-def _format_results(diff_type, diff_order):
-    """Returns modified-length DFT energy and force lists."""
-
-    if diff_order == "second":
-        return SCALARS, SECOND_DERIVATIVES
-
-    if diff_type == "central":
-        return [SCALARS[i] for i in range(1, N, 2)], [
-            DERIVATIVES[i] for i in range(2, N - 1, 2)
-        ]
-    elif diff_type == "forward":
-        return SCALARS, DERIVATIVES[:-1]
-    else:
-        return SCALARS, DERIVATIVES[1:]
+    return common, finite_differences[i], force_differences[j]
 
 
 def _display_results(
@@ -145,7 +80,7 @@ def _display_results(
     # display = {
     #     "Environ": exact_derivatives,
     #     "Finite": finite_differences,
-    #     "\u0394F": deltas
+    #     "ΔF": deltas
     # }
 
 
@@ -156,6 +91,10 @@ def calculate_finite_differences(
     """
     Returns finite differences for a PK list and test settings.
 
+    All state is local to the call, so concurrent calls in the same worker are independent.
+    The stencil accuracy is read from the optional `accuracy` setting, e.g. 4 for the
+    4th-order central difference, and defaults to the simplest stencil of each type.
+
     Inputs:
         pk_list:        aiida.orm.List
         test_settings:  aiida.orm.Dict
@@ -168,65 +107,191 @@ def calculate_finite_differences(
     settings = test_settings.get_dict()
     diff_type = settings["diff_type"]
     diff_order = settings["diff_order"]
+    accuracy = settings.get("accuracy", get_default_accuracy(diff_type))
+    step = _get_step(settings)
 
-    dr = sum([component ** 2 for component in settings["step_sizes"]]) ** 0.5
-    initial = _setup(pk_list.get_list(), dr, environ.value)
-
-    finite_differences = []
-    deltas = []
+    scalars, derivatives = _setup(pk_list.get_list())
 
     # *** CALCULATE FINITE DIFFERENCES ***
 
-    for i in range(N):
+    indices, finite_differences, exact_derivatives = _calculate_differences(
+        scalars, derivatives, step, diff_type, diff_order, accuracy
+    )
+    deltas = np.abs(finite_differences - exact_derivatives)
 
-        if diff_type == "central" and 0 < i < (N - 1):
+    # *** FORMAT & RETURN RESULTS ***
 
-            if diff_order == "first" and i % 2 == 0:
-                df, delta = _calculate_central_difference(i, diff_order)
-            elif diff_order == "second":
-                df, delta = _calculate_central_difference(i, diff_order)
-            else:
-                continue
+    # FIXME aiida will not display print() lines during WorkChains
+    # TODO write DataFrame and/or plot as SinglefileData and return with key in data dict?
+    # TODO generalize display function
+    _display_results(
+        settings, exact_derivatives, finite_differences, deltas, environ.value
+    )
 
-            finite_differences.append(df)
-            deltas.append(delta)
+    data = Dict(
+        dict={
+            "Initial": {"Energy": float(scalars[0]), "Total force": float(derivatives[0])},
+            "Displacements": (indices * step).tolist(),
+            "Scalars": scalars[indices].tolist(),
+            "Exact derivatives": exact_derivatives.tolist(),
+            "Finite differences": finite_differences.tolist(),
+            "Deltas": deltas.tolist(),
+        }
+    )
 
-        elif diff_type == "forward" and i < (N - 1):
+    return data
 
-            if diff_order == "second" and i == (N - 2):
-                continue
-            else:
-                df, delta = _calculate_forward_difference(i, diff_order)
-                finite_differences.append(df)
-                deltas.append(delta)
 
-        elif diff_type == "backward" and i > 0:
+@calcfunction
+def calculate_projected_finite_differences(
+    displacements: List, test_settings: Dict
+) -> Dict:
+    """
+    Returns finite differences along several displacements & the projected DFT forces.
 
-            if diff_order == "second" and i == 1:
-                continue
-            else:
-                df, delta = _calculate_backward_difference(i, diff_order)
-                finite_differences.append(df)
-                deltas.append(delta)
+    Each displacement moves one atom along a direction from a shared reference calculation.
+    The finite differences of the energy are compared to minus the force on the displaced
+    atom projected onto the direction, read from the per-atom `forces` of the
+    `output_trajectory`, instead of the total force norm.
 
-    # *** FORMAT & RETURN RESULTS ***
+    Inputs:
+        displacements:  aiida.orm.List of dicts with the 1-based `atom`, the unit `direction`,
+                        the `step` and the `pks` of the calculations at each of the `offsets`
+                        (in units of the step, 0 is the reference)
+        test_settings:  aiida.orm.Dict
 
-    output_scalars, output_derivatives = _format_results(diff_type, diff_order)
+    Outputs:
+        data:           aiida.orm.Dict
+    """
 
-    # FIXME aiida will not display print() lines during WorkChains
-    # TODO write DataFrame and/or plot as SinglefileData and return with key in data dict?
-    # TODO generalize display function
-    _display_results(
-        settings, output_derivatives, finite_differences, deltas, environ.value
+    settings = test_settings.get_dict()
+    diff_type = settings["diff_type"]
+    diff_order = settings["diff_order"]
+    accuracy = settings.get("accuracy", get_default_accuracy(diff_type))
+
+    displacements = displacements.get_list()
+    pks = [pk for displacement in displacements for pk in displacement["pks"]]
+    energies = load_output_parameters(pks, ["energy"])["energy"]
+    forces = np.array(load_output_arrays(pks, "forces"))
+    reference = displacements[0]["offsets"].index(0)
+
+    results = []
+    start = 0
+    for displacement in displacements:
+        stop = start + len(displacement["pks"])
+        direction = np.array(displacement["direction"], dtype=float)
+        offsets = np.array(displacement["offsets"])
+        # dE/ds = -F . u for the displaced atom
+        projected = -forces[start:stop, displacement["atom"] - 1] @ direction
+        scalars = energies[start:stop]
+        start = stop
+
+        indices, finite_differences, exact_derivatives = _calculate_differences(
+            scalars, projected, displacement["step"], diff_type, diff_order, accuracy
+        )
+        deltas = np.abs(finite_differences - exact_derivatives)
+
+        results.append(
+            {
+                "Atom": displacement["atom"],
+                "Direction": direction.tolist(),
+                "Displacements": (offsets[indices] * displacement["step"]).tolist(),
+                "Scalars": scalars[indices].tolist(),
+                "Exact derivatives": exact_derivatives.tolist(),
+                "Finite differences": finite_differences.tolist(),
+                "Deltas": deltas.tolist(),
+            }
+        )
+
+    data = Dict(
+        dict={
+            "Initial": {
+                "Energy": float(energies[reference]),
+                "Forces": forces[reference].tolist(),
+            },
+            "Results": results,
+            "Max delta": max(max(result["Deltas"], default=0.0) for result in results),
+        }
     )
 
+    return data
+
+
+def get_extrapolated_derivatives(displacements):
+    """Returns Richardson-extrapolated central differences along each displacement.
+
+    Each displacement holds the `steps` of each level, halving from one level to the next,
+    and the `pks` of the calculations at minus and plus the step.
+
+    Returns:
+        (central differences of each level, extrapolations, error estimates) as arrays of
+        shape (n_displacements, n_levels), (n_displacements,) and (n_displacements,)
+    """
+
+    steps = np.array([displacement["steps"] for displacement in displacements])
+    pks = [
+        pk
+        for displacement in displacements
+        for level in displacement["pks"]
+        for pk in level
+    ]
+    energies = load_output_parameters(pks, ["energy"])["energy"]
+    energies = energies.reshape(steps.shape + (2,))
+
+    central = (energies[..., 1] - energies[..., 0]) / (2 * steps)
+    extrapolated, errors = richardson_extrapolation(central.T)
+
+    return central, extrapolated, errors
+
+
+@calcfunction
+def calculate_extrapolated_finite_differences(
+    displacements: List, test_settings: Dict
+) -> Dict:
+    """
+    Returns Richardson-extrapolated finite differences & the projected DFT forces.
+
+    Inputs:
+        displacements:  aiida.orm.List of dicts with the 1-based `atom`, the unit `direction`,
+                        the `reference` PK, the `steps` of each level and the `pks` of the
+                        calculations at minus and plus each step
+        test_settings:  aiida.orm.Dict
+
+    Outputs:
+        data:           aiida.orm.Dict
+    """
+
+    displacements = displacements.get_list()
+    reference = displacements[0]["reference"]
+    energy = load_output_parameters([reference], ["energy"])["energy"][0]
+    forces = load_output_arrays([reference], "forces")[0]
+
+    central, extrapolated, errors = get_extrapolated_derivatives(displacements)
+
+    results = []
+    for i, displacement in enumerate(displacements):
+        direction = np.array(displacement["direction"], dtype=float)
+        # dE/ds = -F . u for the displaced atom
+        exact = float(-forces[displacement["atom"] - 1] @ direction)
+        results.append(
+            {
+                "Atom": displacement["atom"],
+                "Direction": direction.tolist(),
+                "Steps": displacement["steps"],
+                "Finite differences": central[i].tolist(),
+                "Extrapolated": float(extrapolated[i]),
+                "Error estimate": float(errors[i]),
+                "Exact derivative": exact,
+                "Delta": abs(float(extrapolated[i]) - exact),
+            }
+        )
+
     data = Dict(
         dict={
-            "Initial": initial,
-            "Scalars": output_scalars,
-            "Exact derivatives": output_derivatives,
-            "Finite differences": finite_differences,
-            "Deltas": deltas,
+            "Initial": {"Energy": float(energy), "Forces": forces.tolist()},
+            "Results": results,
+            "Max delta": max(result["Delta"] for result in results),
+            "Max error estimate": max(result["Error estimate"] for result in results),
         }
     )
 
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from aiida.engine import calcfunction
+from aiida.orm import ArrayData, Dict
+
+from aiida_environ.utils.hessian import (
+    get_displacements,
+    get_partial_hessian,
+    get_vibrational_free_energy,
+    get_wavenumbers,
+)
+from aiida_environ.utils.structure import StructureFactory
+
+
+@calcfunction
+def get_partial_displacements(structure, parameters):
+    """Generate the displaced structures of a partial Hessian calculation
+
+    Args:
+        aiida.orm.StructureData: The relaxed structure
+        aiida.orm.Dict: The `active` atom indices and the displacement `distance` in angstrom
+
+    Returns:
+        aiida.orm.StructureData: `supercell_{i}`, the i-th displaced structure numbered from 1, in the order of
+            `get_displacements`
+    """
+    factory = StructureFactory(structure)
+    displacements = get_displacements(parameters["active"], parameters["distance"])
+
+    return {
+        f"supercell_{index}": factory.displace(atom, displacement)
+        for index, (atom, displacement) in enumerate(displacements, start=1)
+    }
+
+
+@calcfunction
+def calc_partial_hessian(structure, forces, parameters):
+    """Calculate the Hessian block and harmonic wavenumbers of the active atoms of a structure
+
+    Args:
+        aiida.orm.StructureData: The relaxed structure
+        aiida.orm.ArrayData: `forces`, the forces of the displaced structures, see `collect_forces`
+        aiida.orm.Dict: The `active` atom indices, the index of the `center` and the displacement `distance`
+
+    Returns:
+        aiida.orm.ArrayData: The `hessian` in eV/angstrom^2, the `active` atoms, their `distances` to the center and
+            `masses`, and the `wavenumbers` in cm^-1 with the inactive atoms frozen
+    """
+    active = np.array(parameters["active"], dtype=int)
+    positions = np.array([site.position for site in structure.sites], dtype=float)
+    masses = np.array([structure.get_kind(structure.sites[atom].kind_name).mass for atom in active])
+    hessian = get_partial_hessian(forces.get_array("forces"), active, parameters["distance"])
+
+    result = ArrayData()
+    result.set_array("hessian", hessian)
+    result.set_array("active", active)
+    result.set_array("distances", np.linalg.norm(positions[active] - positions[parameters["center"]], axis=1))
+    result.set_array("masses", masses)
+    result.set_array("wavenumbers", get_wavenumbers(hessian, masses))
+
+    return result
+
+
+def _get_free_energy(hessian, masses, temperature, cutoff, mask=None):
+    if mask is not None:
+        coordinates = np.repeat(mask, 3)
+        hessian = hessian[np.ix_(coordinates, coordinates)]
+        masses = masses[mask]
+    if len(masses) == 0:
+        return 0.0
+    return get_vibrational_free_energy(get_wavenumbers(hessian, masses), temperature, cutoff)
+
+
+@calcfunction
+def calc_vibrational_free_energy_difference(acid, base, parameters):
+    """Calculate the vibrational free energy of deprotonation from the partial Hessians of an acid and its base
+
+    The atoms outside the active regions are frozen, so their modes are assumed to cancel between the acid and the
+    base. The error of this truncation is estimated by the change of the result when the outermost `shell` of the
+    active regions is frozen as well.
+
+    Args:
+        aiida.orm.ArrayData: The partial Hessian of the acid, see `calc_partial_hessian`
+        aiida.orm.ArrayData: The partial Hessian of the base
+        aiida.orm.Dict: The `temperature` in K, the wavenumber `cutoff` in cm^-1 and the `shell` width in angstrom
+
+    Returns:
+        aiida.orm.Dict: The vibrational free energies of the acid and the base and their `delta_g_vib` (base - acid)
+            in eV, the `region_error` estimate, and the relative `hessian_asymmetry` of each Hessian, a measure of
+            the numerical noise of the forces
+    """
+    temperature = parameters["temperature"]
+    cutoff = parameters["cutoff"]
+    shell = parameters["shell"]
+
+    result = {"temperature": temperature, "units": "eV"}
+    free_energies = {}
+    inner_free_energies = {}
+    for label, node in (("acid", acid), ("base", base)):
+        hessian = node.get_array("hessian")
+        masses = node.get_array("masses")
+        distances = node.get_array("distances")
+        free_energies[label] = _get_free_energy(hessian, masses, temperature, cutoff)
+        inner_free_energies[label] = _get_free_energy(
+            hessian, masses, temperature, cutoff, distances <= distances.max() - shell
+        )
+        result[f"{label}_g_vib"] = free_energies[label]
+        result[f"{label}_active_atoms"] = len(masses)
+        result[f"{label}_hessian_asymmetry"] = float(
+            np.linalg.norm(hessian - hessian.T) / max(np.linalg.norm(hessian), 1e-12)
+        )
+
+    delta = free_energies["base"] - free_energies["acid"]
+    inner_delta = inner_free_energies["base"] - inner_free_energies["acid"]
+    result["delta_g_vib"] = delta
+    result["region_error"] = abs(delta - inner_delta)
+
+    return Dict(dict=result)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from aiida.engine import calcfunction
+from aiida.orm import Dict
+
+from aiida_environ.utils.optimize import get_best_point, get_initial_state, optimizer_step
+
+
+@calcfunction
+def initialize_solvent_parameters(parameters, settings):
+    """Set up the optimiser for the solvent parameters
+
+    Args:
+        aiida.orm.Dict: Starting values of the optimised parameters, by name
+        aiida.orm.Dict: Optimiser settings, the names of the optimised `parameters` with their `bounds` and `scales`,
+            the `method` and the `learning_rate`
+
+    Returns:
+        aiida.orm.Dict: Optimiser state with the starting parameters to evaluate first
+    """
+    names = settings["parameters"]
+    state = get_initial_state(
+        [parameters[name] for name in names],
+        [settings["bounds"][name][0] for name in names],
+        [settings["bounds"][name][1] for name in names],
+        method=settings["method"],
+        scales=[settings["scales"][name] for name in names],
+        learning_rate=settings["learning_rate"],
+    )
+    state["parameters"] = names
+
+    return Dict(dict=state)
+
+
+@calcfunction
+def update_solvent_parameters(state, partials):
+    """Take one optimiser step for the solvent parameters
+
+    Args:
+        aiida.orm.Dict: Optimiser state, with the names of the optimised `parameters`
+        aiida.orm.Dict: Mean Squared Error and partials at the current parameters (from `calc_partial`)
+
+    Returns:
+        aiida.orm.Dict: Optimiser state with the next parameters to evaluate and the best parameters so far
+    """
+    state = state.get_dict()
+    gradient = [partials[f"grad_{name}"] for name in state["parameters"]]
+    state = optimizer_step(state, partials["mse"], gradient)
+    state["best_parameters"] = dict(
+        zip(state["parameters"], get_best_point(state).tolist())
+    )
+
+    return Dict(dict=state)
+
+
+@calcfunction
+def collect_validation(**kwargs):
+    """Collect the validation errors of a stochastic solvent fit
+
+    Args:
+        aiida.orm.Dict: `parameters_{k}`, the solvent parameters of the k-th validation
+        aiida.orm.Dict: `partials_{k}`, the partials of the validation set at these parameters (from `calc_partial`)
+
+    Returns:
+        aiida.orm.Dict: The validation history and the parameters with the lowest validation Mean Squared Error
+    """
+    history = []
+    for k in sorted(int(key.split("_")[-1]) for key in kwargs if key.startswith("parameters_")):
+        history.append(
+            {
+                "parameters": kwargs[f"parameters_{k}"].get_dict(),
+                "mse": kwargs[f"partials_{k}"]["mse"],
+            }
+        )
+    best = min(history, key=lambda entry: entry["mse"])
+
+    return Dict(
+        dict={
+            "history": history,
+            "best_parameters": best["parameters"],
+            "best_mse": best["mse"],
+        }
+    )
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
+import numpy as np
 from aiida.engine import calcfunction
 from aiida.orm import Dict
-from aiida.orm.utils import load_node
+
+from aiida_environ.utils.results import load_output_parameters
 
 
 @calcfunction
@@ -15,7 +17,11 @@ def calc_partial(nstruct, delta, expt_energy, calculations):
         aiida.orm.Dict: Calculation PKs
 
     Returns:
-        aiida.orm.Dict: Mean Squared Error for alpha, partial for alpha, partial for beta, partial for gamma
+        aiida.orm.Dict: Mean Squared Error, partials for alpha, beta and gamma, and the number of structures used
+            for the Mean Squared Error (n_0) and for the alpha partial (n_1, the alpha partial is zero if n_1 is 0)
+
+    Raises:
+        ValueError: if none of the solution calculations with idx=0 completed
     """
     # Hardcoded Values
     # learning_gamma = 1e-2
@@ -24,74 +30,57 @@ def calc_partial(nstruct, delta, expt_energy, calculations):
 
     # 0 is the solvation energy for param = param0, 1 is the solvation energy for param = param0 + dparam
     n = nstruct.value
-    solvation_energy_0 = [0.0] * n
-    solvation_energy_1 = [0.0] * n
-    qm_surface = [0.0] * n
-    qm_volume = [0.0] * n
-
-    n_0 = 0  # number of successful simulations idx=0
-    n_1 = 0  # number of successful simulations idx=1
-
-    # calculate and store the solvation energy
-    for i in range(n):
-        node_vac = load_node(calculations[f"vacuum_{i}"])
-        node_sol_0 = load_node(calculations[f"solution_0_{i}"])
-        if node_sol_0.exit_status > 0:
-            # TODO consider converting to CalcJob and adding reports
-            # self.report(f'simulation {node_sol_0.pk} did not complete successfully, skipping structure...')
-            continue
-
-        # following calculations only require idx=0
-        solvation_energy_0[i] += (
-            node_sol_0.outputs.output_parameters["energy"]
-            - node_vac.outputs.output_parameters["energy"]
-        )
-        qm_surface[i] = node_sol_0.outputs.output_parameters["qm_surface"][-1]
-        qm_volume[i] = node_sol_0.outputs.output_parameters["qm_volume"][-1]
-        n_0 += 1
-
-        # finite difference simulation
-        node_sol_1 = load_node(calculations[f"solution_1_{i}"])
-        if node_sol_1.exit_status > 0:
-            # self.report(f'simulation {node_sol_1.pk} did not complete successfully, skipping structure...')
-            continue
+    vacuum = load_output_parameters(
+        [calculations[f"vacuum_{i}"] for i in range(n)], ["energy"]
+    )
+    solution_0 = load_output_parameters(
+        [calculations[f"solution_0_{i}"] for i in range(n)],
+        ["energy", "qm_surface", "qm_volume"],
+    )
+    # the solutions at alpha_0 + d alpha may be missing, e.g. not restarted from a failed solution at alpha_0
+    indices_1 = [i for i in range(n) if f"solution_1_{i}" in calculations.get_dict()]
+    loaded_1 = load_output_parameters(
+        [calculations[f"solution_1_{i}"] for i in indices_1], ["energy"]
+    )
+    solution_1 = {key: np.full(n, np.nan) for key in loaded_1}
+    for key, values in loaded_1.items():
+        solution_1[key][indices_1] = values
 
-        solvation_energy_1[i] += (
-            node_sol_1.outputs.output_parameters["energy"]
-            - node_vac.outputs.output_parameters["energy"]
-        )
-        n_1 += 1
+    # TODO consider converting to CalcJob and adding reports for the skipped structures
+    # the finite difference simulation only counts if the simulation with idx=0 completed
+    success_0 = (solution_0["exit_status"] == 0) & (vacuum["exit_status"] == 0)
+    success_1 = success_0 & (solution_1["exit_status"] == 0)
+    n_0 = int(np.count_nonzero(success_0))  # number of successful simulations idx=0
+    n_1 = int(np.count_nonzero(success_1))  # number of successful simulations idx=1
+    if n_0 == 0:
+        raise ValueError("none of the solution calculations finished successfully")
 
-    # calculate partials
-    grad_gamma = 0.0
-    grad_beta = 0.0
-    mse0 = 0.0
-    mse1 = 0.0
-    solvation_energy_expt = expt_energy.get_list()
+    # calculate the solvation energies and their errors
+    solvation_energy_expt = np.array(expt_energy.get_list(), dtype=float)
+    error_0 = solution_0["energy"] - vacuum["energy"] - solvation_energy_expt
+    error_1 = solution_1["energy"] - vacuum["energy"] - solvation_energy_expt
 
-    for i in range(n):
-        grad_gamma += (
-            (solvation_energy_0[i] - solvation_energy_expt[i])
-            * qm_surface[i]
-            * 2.0
-            / n_0
-        )
-        grad_beta += (
-            (solvation_energy_0[i] - solvation_energy_expt[i])
-            * qm_volume[i]
-            * 2.0
-            / n_0
-        )
-        mse0 += (solvation_energy_0[i] - solvation_energy_expt[i]) ** 2 / n_1
-        mse1 += (solvation_energy_1[i] - solvation_energy_expt[i]) ** 2 / n_1
+    # the MSE and the gamma/beta partials are averaged over the structures that completed with idx=0
+    mse = np.sum(error_0[success_0] ** 2) / n_0
+    grad_gamma = np.sum(2.0 * error_0[success_0] * solution_0["qm_surface"][success_0]) / n_0
+    grad_beta = np.sum(2.0 * error_0[success_0] * solution_0["qm_volume"][success_0]) / n_0
 
-    grad_alpha = (mse1 - mse0) / delta.value
+    # both MSEs of the alpha finite difference are averaged over the same structures, those that completed with
+    # idx=0 and idx=1, otherwise their difference is dominated by the change of normalisation
+    if n_1 > 0:
+        mse0 = np.sum(error_0[success_1] ** 2) / n_1
+        mse1 = np.sum(error_1[success_1] ** 2) / n_1
+        grad_alpha = (mse1 - mse0) / delta.value
+    else:
+        grad_alpha = 0.0
 
     result = {
-        "mse": mse0,
-        "grad_alpha": grad_alpha,
-        "grad_beta": grad_beta,
-        "grad_gamma": grad_gamma,
+        "mse": float(mse),
+        "grad_alpha": float(grad_alpha),
+        "grad_beta": float(grad_beta),
+        "grad_gamma": float(grad_gamma),
+        "n_0": n_0,
+        "n_1": n_1,
     }
 
     return Dict(dict=result)
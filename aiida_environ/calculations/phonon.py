@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from aiida.engine import calcfunction
+from aiida.orm import ArrayData
+from aiida.plugins import DataFactory
+
+
+@calcfunction
+def collect_forces(**trajectories):
+    """Collect the forces of the displaced supercells in a single array
+
+    Args:
+        aiida.orm.TrajectoryData: `forces_{i}`, the output trajectory (or any `ArrayData` with `forces`) of the i-th
+            displaced supercell, numbered from 1 as the supercells of phonopy, and optionally `forces_0` for the
+            pristine supercell
+
+    Returns:
+        aiida.orm.ArrayData: `forces`, the (n_displacements, nat, 3) forces of the last step of each supercell, in the
+            order of the displacements, and `residual_forces` of the pristine supercell if given
+    """
+    residual = trajectories.pop("forces_0", None)
+    keys = sorted(trajectories, key=lambda key: int(key.split("_")[-1]))
+    forces = ArrayData()
+    forces.set_array(
+        "forces",
+        np.array([trajectories[key].get_array("forces")[-1] for key in keys]),
+    )
+    if residual is not None:
+        forces.set_array("residual_forces", residual.get_array("forces")[-1])
+
+    return forces
+
+
+@calcfunction
+def generate_phonopy_data_from_forces(preprocess_data, forces):
+    """Create the phonopy data of a set of displacements from their batched forces
+
+    Args:
+        PreProcessData: The phonopy pre-processing data with the displacements
+        aiida.orm.ArrayData: `forces`, the (n_displacements, nat, 3) forces, and optionally the `residual_forces`,
+            see `collect_forces`
+
+    Returns:
+        PhonopyData: The phonopy data with the displacements and forces
+    """
+    PhonopyData = DataFactory("phonopy.phonopy")
+    phonopy_data = PhonopyData(preprocess_data=preprocess_data)
+    phonopy_data.set_forces(sets_of_forces=forces.get_array("forces"))
+    if "residual_forces" in forces.get_arraynames():
+        phonopy_data.set_residual_forces(forces=forces.get_array("residual_forces"))
+
+    return phonopy_data
+
+
+@calcfunction
+def calc_thermal_properties(phonopy_data, parameters):
+    """Calculate the force constants, frequencies and thermal properties with the phonopy API
+
+    This replaces a `PhonopyCalculation` when only the harmonic thermal properties are needed, without the queueing
+    and file staging of a calculation job.
+
+    Args:
+        PhonopyData: The phonopy data with the displacements and forces
+        aiida.orm.Dict: The phonopy tags `MESH`, `GAMMA_CENTER`, `TMIN`, `TMAX`, `TSTEP`, `CUTOFF_FREQUENCY` (THz) and
+            `FC_SYMMETRY`, with the defaults of phonopy except for a Gamma-only mesh
+
+    Returns:
+        aiida.orm.ArrayData: The `force_constants` in eV/angstrom^2, the mesh `frequencies` in THz, and the
+            `temperatures` in K with the vibrational `free_energy` (kJ/mol), `entropy` and `heat_capacity` (J/K/mol)
+    """
+    parameters = parameters.get_dict()
+    phonopy = phonopy_data.get_phonopy_instance()
+    phonopy.produce_force_constants(show_drift=False)
+    if parameters.get("FC_SYMMETRY", False):
+        phonopy.symmetrize_force_constants()
+
+    phonopy.run_mesh(
+        parameters.get("MESH", [1, 1, 1]),
+        is_gamma_center=parameters.get("GAMMA_CENTER", True),
+    )
+    phonopy.run_thermal_properties(
+        t_min=parameters.get("TMIN", 0.0),
+        t_max=parameters.get("TMAX", 1000.0),
+        t_step=parameters.get("TSTEP", 10.0),
+        cutoff_frequency=parameters.get("CUTOFF_FREQUENCY"),
+    )
+
+    result = ArrayData()
+    result.set_array("force_constants", phonopy.force_constants)
+    result.set_array("frequencies", phonopy.mesh.frequencies)
+    for key in ("temperatures", "free_energy", "entropy", "heat_capacity"):
+        result.set_array(key, np.asarray(getattr(phonopy.thermal_properties, key)))
+
+    return result
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from aiida.engine import calcfunction
+from aiida.orm import Dict
+
+from aiida_environ.utils.surrogate import propose_batch
+
+
+@calcfunction
+def propose_parameters(observations, settings):
+    """Propose the next parameters of a Bayesian search with a Gaussian-process surrogate
+
+    Args:
+        aiida.orm.Dict: Observed `points` (one list of parameter values per point) and objective `values`
+        aiida.orm.Dict: The parameter `names`, their `bounds`, the `batch_size`, `seed` and `iteration`
+
+    Returns:
+        aiida.orm.Dict: The proposed `points`, their `expected_improvement`, and the best observed parameters and
+            objective
+    """
+    names = settings["names"]
+    points = np.array(observations["points"], dtype=float)
+    values = np.array(observations["values"], dtype=float)
+    best = int(np.argmin(values))
+
+    result = {
+        "names": names,
+        "points": [],
+        "expected_improvement": [],
+        "best_parameters": dict(zip(names, points[best].tolist())),
+        "best_value": float(values[best]),
+    }
+
+    if settings["batch_size"] > 0:
+        rng = np.random.default_rng([settings["seed"], settings["iteration"]])
+        proposed, improvement = propose_batch(
+            points,
+            values,
+            [settings["bounds"][name][0] for name in names],
+            [settings["bounds"][name][1] for name in names],
+            settings["batch_size"],
+            rng,
+        )
+        result["points"] = proposed.tolist()
+        result["expected_improvement"] = improvement.tolist()
+
+    return Dict(dict=result)
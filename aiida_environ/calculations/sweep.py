@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from aiida.engine import calcfunction
+from aiida.orm import ArrayData, Dict, ProcessNode, QueryBuilder
+
+from aiida_environ.utils.results import load_output_parameters
+
+SWEEP_PARAMETERS = ("alpha", "field_factor", "field_asymmetry")
+
+
+@calcfunction
+def collect_parameter_results(calculations):
+    """Collect the results of a parameter sweep in a single table
+
+    Args:
+        aiida.orm.Dict: The `acid` and `base` lists of calculation PKs, one pair per parameter
+
+    Returns:
+        aiida.orm.ArrayData: One array per column, one row per parameter: the `alpha`, `field_factor` and
+            `field_asymmetry` of the calculations, the `acid_energy` and `base_energy` (NaN if failed), their
+            difference `energy_difference` and the `acid_exit_status` and `base_exit_status`
+    """
+    table = ArrayData()
+    for name in ("acid", "base"):
+        results = load_output_parameters(calculations[name], ["energy"])
+        success = results["exit_status"] == 0
+        table.set_array(f"{name}_energy", np.where(success, results["energy"], np.nan))
+        table.set_array(f"{name}_exit_status", results["exit_status"])
+
+    table.set_array(
+        "energy_difference", table.get_array("base_energy") - table.get_array("acid_energy")
+    )
+
+    # the swept parameters of all the acid calculations are projected from their inputs in a single query
+    qb = QueryBuilder()
+    qb.append(ProcessNode, filters={"id": {"in": list(calculations["acid"])}}, project="id", tag="process")
+    qb.append(
+        Dict,
+        with_outgoing="process",
+        edge_filters={"label": "pw__environ_parameters"},
+        project=[f"attributes.BOUNDARY.{parameter}" for parameter in SWEEP_PARAMETERS],
+    )
+    boundaries = {row[0]: row[1:] for row in qb.iterall()}
+    for i, parameter in enumerate(SWEEP_PARAMETERS):
+        table.set_array(
+            parameter,
+            np.array([boundaries[pk][i] for pk in calculations["acid"]], dtype=float),
+        )
+
+    return table
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from aiida.engine import calcfunction
+from aiida.orm import ArrayData, load_node
+
+from aiida_environ.utils.results import load_output_parameters
+from aiida_environ.utils.thermochemistry import (
+    KJ_PER_MOL_TO_EV,
+    THZ_TO_WAVENUMBER,
+    get_pka,
+    get_thermochemistry,
+    get_vibrational_modes,
+)
+
+
+def _get_wavenumbers(phonopy_data):
+    phonopy = phonopy_data.get_phonopy_instance()
+    phonopy.produce_force_constants(show_drift=False)
+    phonopy.symmetrize_force_constants()
+    phonopy.run_mesh([1, 1, 1], is_gamma_center=True)
+
+    return phonopy.mesh.frequencies.ravel() * THZ_TO_WAVENUMBER
+
+
+@calcfunction
+def calc_pka_temperature_curve(acid_phonopy_data, base_phonopy_data, acid_parameters, base_parameters, settings):
+    """Calculate the thermochemistry of an acid and its conjugate base, and the pKa, over a grid of temperatures
+
+    The Gamma frequencies are calculated once from the forces of each molecule, and every temperature is evaluated
+    in a single vectorised step. The translational and rotational contributions are assumed to cancel between the
+    acid and the base, and the free energy of the solvated proton is taken as independent of the temperature.
+
+    Args:
+        PhonopyData: The phonopy data of the acid, with the forces of its displacements
+        PhonopyData: The phonopy data of the base
+        aiida.orm.Dict: The output parameters of the acid calculation, with its total `energy` in eV
+        aiida.orm.Dict: The output parameters of the base calculation
+        aiida.orm.Dict: The `temperatures` in K, the `quasi_rrho_cutoff` in cm^-1, the number of `rigid_body_modes`
+            and the `proton_free_energy` in eV
+
+    Returns:
+        aiida.orm.ArrayData: The `temperatures`, the `{acid,base}_zero_point_energy`, `{acid,base}_enthalpy`,
+            `{acid,base}_entropy` and `{acid,base}_free_energy` of the vibrations, the `delta_free_energy` of
+            deprotonation (eV and eV/K) and the `pka` at each temperature
+    """
+    temperatures = np.asarray(settings["temperatures"], dtype=float)
+
+    result = ArrayData()
+    result.set_array("temperatures", temperatures)
+
+    free_energies = {}
+    for label, phonopy_data, parameters in (
+        ("acid", acid_phonopy_data, acid_parameters),
+        ("base", base_phonopy_data, base_parameters),
+    ):
+        wavenumbers = get_vibrational_modes(_get_wavenumbers(phonopy_data), settings["rigid_body_modes"])
+        thermochemistry = get_thermochemistry(wavenumbers, temperatures, settings["quasi_rrho_cutoff"])
+        for key, value in thermochemistry.items():
+            result.set_array(f"{label}_{key}", np.atleast_1d(value))
+        free_energies[label] = parameters["energy"] + thermochemistry["free_energy"]
+
+    delta_free_energy = free_energies["base"] - free_energies["acid"] + settings["proton_free_energy"]
+    result.set_array("delta_free_energy", delta_free_energy)
+    result.set_array("pka", get_pka(delta_free_energy, temperatures))
+
+    return result
+
+
+@calcfunction
+def collect_pka_table(calculations, settings):
+    """Collect the pKa of a set of acid and base pairs in a single table
+
+    The free energy of each species is its total energy in solution plus its vibrational free energy, and species
+    shared by several pairs are only calculated once.
+
+    Args:
+        aiida.orm.Dict: The `pairs` of acid and base labels, and for each label of the `species` the PK of its
+            solution `relax` workchain and of its `thermal_properties`, see `calc_thermal_properties`
+        aiida.orm.Dict: The `proton_free_energy` in eV
+
+    Returns:
+        aiida.orm.ArrayData: One row per pair, in the order of `pairs`: the `acid_energy` and `base_energy` and their
+            difference `delta_energy` in eV, and at each of the `temperatures` the `delta_vibrational_free_energy`
+            and `delta_free_energy` of deprotonation in eV and the `pka`. Values are NaN where a species failed
+    """
+    pairs = calculations["pairs"]
+    species = calculations["species"]
+    labels = sorted({label for pair in pairs for label in pair})
+    finished = [label for label in labels if label in species]
+
+    energies = dict.fromkeys(labels, np.nan)
+    results = load_output_parameters([species[label]["relax"] for label in finished], ["energy"])
+    for label, energy, exit_status in zip(finished, results["energy"], results["exit_status"]):
+        if exit_status == 0:
+            energies[label] = energy
+
+    temperatures = None
+    free_energies = {}
+    for label in finished:
+        thermal_properties = load_node(species[label]["thermal_properties"])
+        temperatures = thermal_properties.get_array("temperatures")
+        free_energies[label] = thermal_properties.get_array("free_energy") * KJ_PER_MOL_TO_EV
+    if temperatures is None:
+        temperatures = np.array([np.nan])
+    for label in labels:
+        free_energies.setdefault(label, np.full(len(temperatures), np.nan))
+
+    acid_energy = np.array([energies[acid] for acid, _ in pairs], dtype=float)
+    base_energy = np.array([energies[base] for _, base in pairs], dtype=float)
+    delta_vibrational = np.array([free_energies[base] - free_energies[acid] for acid, base in pairs]).reshape(
+        len(pairs), len(temperatures)
+    )
+    delta_free_energy = (base_energy - acid_energy)[:, None] + delta_vibrational + settings["proton_free_energy"]
+
+    table = ArrayData()
+    table.set_array("temperatures", temperatures)
+    table.set_array("acid_energy", acid_energy)
+    table.set_array("base_energy", base_energy)
+    table.set_array("delta_energy", base_energy - acid_energy)
+    table.set_array("delta_vibrational_free_energy", delta_vibrational)
+    table.set_array("delta_free_energy", delta_free_energy)
+    table.set_array("pka", get_pka(delta_free_energy, temperatures[None, :]))
+
+    return table
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Utilities to find previously finished processes by the content of their inputs."""
+from typing import Dict, List, Mapping, Optional
+
+from aiida.common.hashing import make_hash
+from aiida.common.links import LinkType
+from aiida.orm import Node, ProcessNode, QueryBuilder
+
+INPUT_LINK_TYPES = (LinkType.INPUT_CALC, LinkType.INPUT_WORK)
+
+
+def get_content_hash(node: Node) -> str:
+    """Returns the content hash of a node
+
+    The hash depends only on the content of the node (attributes, repository and computer), not on its PK or UUID,
+    so two structures or parameter sets that were created independently but are identical share the same hash.
+    Unstored nodes are hashed from their content, so that inputs can be compared with previous processes before they
+    are stored by the submission.
+
+    Args:
+        node (aiida.orm.Node): a stored or unstored node
+
+    Returns:
+        str: the hash stored in the `_aiida_hash` extra, or the hash it will have once stored
+    """
+    if not node.is_stored:
+        return make_hash(node.base.caching.get_objects_to_hash())
+
+    return node.base.caching.get_hash()
+
+
+def get_lookup_inputs(inputs: Mapping, namespace: str = None) -> Dict[str, Optional[Node]]:
+    """Returns the inputs of an `EnvPwBaseWorkChain` that identify an equivalent calculation
+
+    Args:
+        inputs (Mapping): the (nested) inputs of the `EnvPwBaseWorkChain`
+        namespace (str): the namespace the inputs are exposed in by the looked up process, e.g. `scf`
+
+    Returns:
+        Dict[str, aiida.orm.Node]: the code, structure, pseudopotentials, parameters and k-points keyed by their flat
+            link label, to be passed to `find_finished_process`. Optional inputs that are not set map to None, so an
+            equivalent process must not have them either
+    """
+    prefix = f"{namespace}__" if namespace else ""
+    lookup = {
+        f"{prefix}pw__{name}": inputs["pw"].get(name)
+        for name in ("code", "structure", "parameters", "environ_parameters", "external_charges", "settings")
+    }
+    for kind, pseudo in inputs["pw"].get("pseudos", {}).items():
+        lookup[f"{prefix}pw__pseudos__{kind}"] = pseudo
+    for name in ("kpoints", "kpoints_distance", "kpoints_force_parity"):
+        lookup[f"{prefix}{name}"] = inputs.get(name)
+
+    return lookup
+
+
+def find_finished_processes(
+    process_class, inputs: Mapping[str, Optional[Node]], limit: int = None
+) -> List[ProcessNode]:
+    """Returns the successful processes of a given class that were run with equivalent inputs, most recent first
+
+    Inputs are compared through their content hashes, so the lookup is robust against inputs that were recreated
+    (and thus have a different PK) with the same content. Absent inputs cannot be compared in the query, so the
+    processes are then fetched in pages of `limit` until enough of them are found.
+
+    Args:
+        process_class: the process class, e.g. `EnvPwBaseWorkChain`
+        inputs (Mapping[str, Optional[aiida.orm.Node]]): input nodes keyed by their (flat) link label, e.g.
+            `pw__structure`. Only the given inputs are compared, and a label mapped to None must not be an input of
+            the process.
+        limit (int): the maximum number of processes to return
+
+    Returns:
+        List[aiida.orm.ProcessNode]: the matching process nodes
+    """
+    absent = {link_label for link_label, node in inputs.items() if node is None}
+    qb = QueryBuilder()
+    qb.append(
+        ProcessNode,
+        tag="process",
+        filters={
+            "process_type": process_class.build_process_type(),
+            "attributes.process_state": "finished",
+            "attributes.exit_status": 0,
+        },
+        project="*",
+    )
+    for link_label, node in inputs.items():
+        if node is None:
+            continue
+        qb.append(
+            Node,
+            with_outgoing="process",
+            edge_filters={"label": link_label},
+            filters={"extras._aiida_hash": get_content_hash(node)},
+        )
+    qb.order_by({"process": {"ctime": "desc"}})
+    if limit is not None:
+        qb.limit(limit)
+
+    processes = []
+    offset = 0
+    while True:
+        page = qb.offset(offset).all(flat=True)
+        processes.extend(
+            process
+            for process in page
+            if absent.isdisjoint(process.base.links.get_incoming(link_type=INPUT_LINK_TYPES).all_link_labels())
+        )
+        if limit is None or len(processes) >= limit or len(page) < limit:
+            break
+        offset += limit
+
+    return processes[:limit]
+
+
+def find_finished_process(
+    process_class, inputs: Mapping[str, Optional[Node]]
+) -> Optional[ProcessNode]:
+    """Returns the most recent successful process of a given class that was run with equivalent inputs
+
+    See `find_finished_processes`.
+
+    Returns:
+        aiida.orm.ProcessNode: the matching process node, or None if there is none
+    """
+    result = find_finished_processes(process_class, inputs, limit=1)
+
+    return result[0] if result else None
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 from math import ceil
+from typing import List, Sequence, Tuple
+
+import numpy as np
 
 
 def get_charge_range(cmax, cinc):
@@ -9,3 +12,95 @@ def get_charge_range(cmax, cinc):
         j = i - (n // 2)
         carr[i] = cinc * j
     return carr
+
+
+def get_lower_envelope(
+    charges: Sequence[float], free_energies: np.ndarray, potentials: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Evaluates the grand potential of each structure as the lower envelope over the charges
+
+    For every structure i and potential U the grand potential is min_k (G[i, k] - q[k] * U), i.e. the Legendre
+    transform of the free energy sampled at the charges q.
+
+    Args:
+        charges (Sequence[float]): the n_charge charges
+        free_energies (np.ndarray): (n_struct, n_charge) free energies in eV
+        potentials (np.ndarray): (n_pot,) potentials in eV
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: the (n_struct, n_pot) envelope and the (n_struct, n_pot) index of the
+            charge that is active at each potential
+    """
+    charges = np.asarray(charges, dtype=float)
+    free_energies = np.asarray(free_energies, dtype=float).reshape(-1, len(charges))
+    potentials = np.asarray(potentials, dtype=float)
+
+    # (n_struct, n_charge, n_pot)
+    grand = (
+        free_energies[:, :, np.newaxis]
+        - charges[np.newaxis, :, np.newaxis] * potentials[np.newaxis, np.newaxis, :]
+    )
+    active = np.argmin(grand, axis=1)
+    envelope = np.take_along_axis(grand, active[:, np.newaxis, :], axis=1)[:, 0, :]
+
+    return envelope, active
+
+
+def get_refined_charges(
+    charges: Sequence[float],
+    free_energies: np.ndarray,
+    fermi_energies: np.ndarray,
+    num_adsorbate: Sequence[int],
+    adsorbate_energy: float,
+    min_increment: float,
+    npoints: int = 1000,
+) -> List[float]:
+    """Returns the charges to add so that the phase transitions of the surface are better resolved
+
+    The grand potential of each structure is evaluated over the potential range spanned by the Fermi energies,
+    including the adsorbate term n * (U - mu_ads). Wherever the most stable structure changes, the charges that are
+    active on both sides of the transition are bracketed by new midpoints, as long as the local spacing of the charge
+    grid is larger than `min_increment`. Regions far from any transition keep the coarse grid.
+
+    Args:
+        charges (Sequence[float]): the n_charge charges that have been computed
+        free_energies (np.ndarray): (n_struct, n_charge) free energies relative to the bulk in eV
+        fermi_energies (np.ndarray): (n_struct, n_charge) corrected Fermi energies in eV
+        num_adsorbate (Sequence[int]): the n_struct number of adsorbates of each structure
+        adsorbate_energy (float): the chemical potential of one adsorbate in eV
+        min_increment (float): the finest charge spacing
+        npoints (int): number of points of the potential grid
+
+    Returns:
+        List[float]: the sorted new charges, empty if the grid is converged
+    """
+    charges = np.asarray(charges, dtype=float)
+    order = np.argsort(charges)
+    charges = charges[order]
+    free_energies = np.asarray(free_energies, dtype=float)[:, order]
+    num_adsorbate = np.asarray(num_adsorbate, dtype=float)
+
+    potentials = np.linspace(np.min(fermi_energies), np.max(fermi_energies), npoints)
+    envelope, active = get_lower_envelope(charges, free_energies, potentials)
+    envelope += num_adsorbate[:, np.newaxis] * (
+        potentials[np.newaxis, :] - adsorbate_energy
+    )
+
+    stable = np.argmin(envelope, axis=0)
+    transitions = np.nonzero(stable[1:] != stable[:-1])[0]
+
+    new_charges = set()
+    for p in transitions:
+        for i in (stable[p], stable[p + 1]):
+            for k in (active[i, p], active[i, p + 1]):
+                for a, b in ((k - 1, k), (k, k + 1)):
+                    if a < 0 or b >= len(charges):
+                        continue
+                    if charges[b] - charges[a] < 2 * min_increment - 1e-8:
+                        continue
+                    midpoint = min_increment * round(
+                        (charges[a] + charges[b]) / (2 * min_increment)
+                    )
+                    new_charges.add(round(midpoint, 8))
+
+    return sorted(new_charges - set(np.round(charges, 8)))
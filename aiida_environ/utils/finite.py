@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Finite-difference stencils evaluated on NumPy arrays."""
+from math import factorial
+from typing import Tuple
+
+import numpy as np
+
+DIFF_TYPES = ("forward", "backward", "central")
+DIFF_ORDERS = {"first": 1, "second": 2}
+
+
+def get_default_accuracy(diff_type: str) -> int:
+    """Returns the accuracy of the simplest stencil of a given type
+
+    Args:
+        diff_type (str): 'forward', 'backward' or 'central'
+
+    Returns:
+        int: 2 for central differences, 1 otherwise
+    """
+    return 2 if diff_type == "central" else 1
+
+
+def get_stencil(
+    derivative: int, diff_type: str, accuracy: int = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the offsets and weights of a finite-difference stencil
+
+    The weights are found by requiring the stencil to be exact for polynomials up to the stencil size, so any
+    derivative and order of accuracy are supported, e.g. the 4th-order central first derivative.
+
+    Args:
+        derivative (int): the order of the derivative
+        diff_type (str): 'forward', 'backward' or 'central'
+        accuracy (int): the order of accuracy in the step size, must be even for central differences
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: the integer offsets of the points and their weights, in units of the step
+    """
+    if diff_type not in DIFF_TYPES:
+        raise ValueError(f"`diff_type` must be one of {DIFF_TYPES}, got {diff_type}")
+    if accuracy is None:
+        accuracy = get_default_accuracy(diff_type)
+    if derivative < 1 or accuracy < 1:
+        raise ValueError("`derivative` and `accuracy` must be positive")
+
+    if diff_type == "central":
+        if accuracy % 2:
+            raise ValueError("central differences require an even `accuracy`")
+        half = (derivative + 1) // 2 - 1 + accuracy // 2
+        offsets = np.arange(-half, half + 1)
+    else:
+        offsets = np.arange(derivative + accuracy)
+        if diff_type == "backward":
+            offsets = -offsets[::-1]
+
+    # sum_j w_j o_j^m = m! delta_{m,derivative}
+    vandermonde = np.vander(offsets, increasing=True).T.astype(float)
+    rhs = np.zeros(len(offsets))
+    rhs[derivative] = factorial(derivative)
+    weights = np.linalg.solve(vandermonde, rhs)
+
+    return offsets, weights
+
+
+def finite_difference(
+    values: np.ndarray,
+    step: float,
+    derivative: int = 1,
+    diff_type: str = "central",
+    accuracy: int = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Differentiates values sampled on a uniform grid along the first axis
+
+    Args:
+        values (np.ndarray): (n, ...) values at the points 0, step, ..., (n - 1) * step, the trailing dimensions (e.g.
+            force components) are differentiated independently
+        step (float): the grid spacing
+        derivative (int): the order of the derivative
+        diff_type (str): 'forward', 'backward' or 'central'
+        accuracy (int): the order of accuracy of the stencil
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: the indices of the points where the stencil fits and the derivatives there
+    """
+    values = np.asarray(values, dtype=float)
+    offsets, weights = get_stencil(derivative, diff_type, accuracy)
+
+    npoints = len(values) - (offsets[-1] - offsets[0])
+    if npoints < 1:
+        raise ValueError(
+            f"{len(offsets)} points are required for this stencil, got {len(values)}"
+        )
+
+    # (npoints, ..., len(offsets))
+    windows = np.lib.stride_tricks.sliding_window_view(values, len(offsets), axis=0)
+    derivatives = windows @ weights / step**derivative
+    indices = np.arange(npoints) - offsets[0]
+
+    return indices, derivatives
+
+
+def richardson_extrapolation(
+    values: np.ndarray, ratio: float = 2.0, order: int = 2, increment: int = 2
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Extrapolates finite differences computed with successively smaller steps to zero step
+
+    Args:
+        values (np.ndarray): (n_levels, ...) finite differences with the steps h, h / ratio, h / ratio**2, ...
+        ratio (float): the ratio between successive steps
+        order (int): the order of the leading error term, 2 for central differences
+        increment (int): the difference between the orders of successive error terms, 2 for central differences
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: the most accurate extrapolation and an estimate of its error, the difference
+            with the extrapolation of the previous level (infinite for a single level)
+    """
+    values = np.asarray(values, dtype=float)
+
+    # table[k] holds the extrapolations of order `order + k * increment` that use levels k..n
+    table = [values]
+    for k in range(1, len(values)):
+        factor = ratio ** (order + (k - 1) * increment)
+        previous = table[-1]
+        table.append(previous[1:] + (previous[1:] - previous[:-1]) / (factor - 1))
+
+    best = table[-1][-1]
+    if len(values) < 2:
+        return best, np.full_like(best, np.inf)
+
+    return best, np.abs(best - table[-2][-1])
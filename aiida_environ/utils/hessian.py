@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Partial Hessian vibrational analysis of the region of a molecule around a titratable site."""
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from aiida.orm import StructureData
+
+# sqrt(eV / angstrom^2 / amu) in cm^-1
+EV_ANGSTROM2_AMU_TO_WAVENUMBER = 521.4709
+# Boltzmann constant in eV / K
+BOLTZMANN = 8.617333262e-5
+# Planck constant times the speed of light in eV cm
+PLANCK_SPEED_OF_LIGHT = 1.239841984e-4
+
+
+def _get_positions(structure: StructureData) -> np.ndarray:
+    return np.array([site.position for site in structure.sites], dtype=float).reshape(-1, 3)
+
+
+def _get_symbols(structure: StructureData) -> List[str]:
+    return [structure.get_kind(site.kind_name).symbol for site in structure.sites]
+
+
+def find_removed_proton(acid: StructureData, base: StructureData) -> Tuple[int, int, int]:
+    """Finds the proton removed from an acid to give its conjugate base
+
+    The removed proton is the hydrogen of the acid farthest from any hydrogen of the base, so both structures must be
+    given in the same frame, e.g. the input structures before relaxation.
+
+    Args:
+        acid (aiida.orm.StructureData): the protonated structure
+        base (aiida.orm.StructureData): the deprotonated structure
+
+    Returns:
+        Tuple[int, int, int]: the index of the proton in the acid, and the index of the atom it is bonded to in the
+            acid and in the base
+    """
+    acid_positions = _get_positions(acid)
+    base_positions = _get_positions(base)
+    acid_symbols = np.array(_get_symbols(acid))
+    base_symbols = np.array(_get_symbols(base))
+
+    acid_hydrogens = np.flatnonzero(acid_symbols == "H")
+    base_hydrogens = np.flatnonzero(base_symbols == "H")
+    if len(acid_hydrogens) != len(base_hydrogens) + 1:
+        raise ValueError("the acid must have exactly one more hydrogen than the base")
+
+    if len(base_hydrogens) == 0:
+        proton = int(acid_hydrogens[0])
+    else:
+        distances = np.linalg.norm(
+            acid_positions[acid_hydrogens, None, :] - base_positions[None, base_hydrogens, :], axis=-1
+        )
+        proton = int(acid_hydrogens[np.argmax(distances.min(axis=1))])
+
+    heavy = np.flatnonzero(acid_symbols != "H")
+    if len(heavy) == 0:
+        raise ValueError("the acid has no heavy atom the proton can be bonded to")
+    acid_center = int(heavy[np.argmin(np.linalg.norm(acid_positions[heavy] - acid_positions[proton], axis=1))])
+
+    candidates = np.flatnonzero(base_symbols == acid_symbols[acid_center])
+    base_center = int(
+        candidates[np.argmin(np.linalg.norm(base_positions[candidates] - acid_positions[acid_center], axis=1))]
+    )
+
+    return proton, acid_center, base_center
+
+
+def get_active_atoms(structure: StructureData, center: int, radius: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the atoms of a molecule within a radius of a site
+
+    Args:
+        structure (aiida.orm.StructureData): the molecule
+        center (int): the index of the central site
+        radius (float): the radius in angstrom
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: the indices of the active atoms in increasing order, and their distances to
+            the central site
+    """
+    positions = _get_positions(structure)
+    distances = np.linalg.norm(positions - positions[center], axis=1)
+    active = np.flatnonzero(distances <= radius)
+
+    return active, distances[active]
+
+
+def get_displacements(active: Sequence[int], distance: float) -> List[Tuple[int, np.ndarray]]:
+    """Returns the central-difference displacements of the active atoms
+
+    Args:
+        active (Sequence[int]): the indices of the active atoms
+        distance (float): the displacement length in angstrom
+
+    Returns:
+        List[Tuple[int, np.ndarray]]: the displaced atom and cartesian displacement, ordered by atom, direction and
+            then sign (+, -), as expected by `get_partial_hessian`
+    """
+    displacements = []
+    for atom in active:
+        for direction in np.eye(3):
+            displacements.append((int(atom), distance * direction))
+            displacements.append((int(atom), -distance * direction))
+
+    return displacements
+
+
+def get_partial_hessian(forces: np.ndarray, active: Sequence[int], distance: float) -> np.ndarray:
+    """Returns the Hessian block of the active atoms from the forces of their displacements
+
+    Args:
+        forces (np.ndarray): (6 n_active, nat, 3) forces in eV/angstrom, in the order of `get_displacements`
+        active (Sequence[int]): the indices of the active atoms
+        distance (float): the displacement length in angstrom
+
+    Returns:
+        np.ndarray: the (3 n_active, 3 n_active) Hessian in eV/angstrom^2, before symmetrisation
+    """
+    forces = np.asarray(forces, dtype=float)
+    active = np.asarray(active, dtype=int)
+    if forces.shape[0] != 6 * len(active):
+        raise ValueError("expected two displacements along each direction of each active atom")
+
+    # columns are the displaced coordinates, rows the responding coordinates of the active atoms
+    difference = forces[0::2] - forces[1::2]
+    hessian = -difference[:, active, :].reshape(3 * len(active), 3 * len(active)) / (2 * distance)
+
+    return hessian.T
+
+
+def get_wavenumbers(hessian: np.ndarray, masses: Sequence[float]) -> np.ndarray:
+    """Returns the harmonic wavenumbers of a Hessian block with the rest of the molecule frozen
+
+    Args:
+        hessian (np.ndarray): the (3n, 3n) Hessian in eV/angstrom^2, symmetrised before diagonalisation
+        masses (Sequence[float]): the n atomic masses in amu
+
+    Returns:
+        np.ndarray: the 3n wavenumbers in cm^-1 in increasing order, imaginary modes as negative values
+    """
+    hessian = np.asarray(hessian, dtype=float)
+    weights = 1.0 / np.sqrt(np.repeat(np.asarray(masses, dtype=float), 3))
+    eigenvalues = np.linalg.eigvalsh(0.5 * (hessian + hessian.T) * np.outer(weights, weights))
+
+    return np.sign(eigenvalues) * np.sqrt(np.abs(eigenvalues)) * EV_ANGSTROM2_AMU_TO_WAVENUMBER
+
+
+def get_vibrational_free_energy(wavenumbers: Sequence[float], temperature: float, cutoff: float = 10.0) -> float:
+    """Returns the harmonic vibrational free energy of a set of modes
+
+    Args:
+        wavenumbers (Sequence[float]): the wavenumbers in cm^-1
+        temperature (float): the temperature in K
+        cutoff (float): modes below this wavenumber, including the imaginary ones, are skipped
+
+    Returns:
+        float: the zero point energy plus the thermal vibrational free energy, in eV
+    """
+    wavenumbers = np.asarray(wavenumbers, dtype=float)
+    energies = PLANCK_SPEED_OF_LIGHT * wavenumbers[wavenumbers >= cutoff]
+    free_energy = 0.5 * np.sum(energies)
+    if temperature > 0:
+        free_energy += BOLTZMANN * temperature * np.sum(np.log1p(-np.exp(-energies / (BOLTZMANN * temperature))))
+
+    return float(free_energy)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Bounded optimisers driven one function evaluation at a time.
+
+The optimisers are written for workflows that evaluate the objective through expensive calculations: the whole
+optimiser state is a JSON-serialisable dictionary, and each call to `optimizer_step` takes the state together with
+the objective and gradient at `state["x"]`, and returns the updated state whose `x` is the next point to evaluate.
+"""
+from typing import Dict, Sequence
+
+import numpy as np
+
+OPTIMIZERS = ("lbfgsb", "adam")
+
+
+def get_initial_state(
+    x: Sequence[float],
+    lower: Sequence[float],
+    upper: Sequence[float],
+    method: str = "lbfgsb",
+    scales: Sequence[float] = None,
+    learning_rate: float = 0.1,
+    memory: int = 5,
+) -> Dict:
+    """Returns the state of an optimiser that will first evaluate `x`
+
+    Args:
+        x (Sequence[float]): the starting point
+        lower (Sequence[float]): the lower bounds
+        upper (Sequence[float]): the upper bounds
+        method (str): 'lbfgsb' for a projected L-BFGS with backtracking, or 'adam'
+        scales (Sequence[float]): typical size of the change of each variable, the optimiser works in units of it
+        learning_rate (float): the size of the first step (or of every step for adam) in scaled units
+        memory (int): the number of corrections kept by L-BFGS
+
+    Returns:
+        dict: the optimiser state
+    """
+    if method not in OPTIMIZERS:
+        raise ValueError(f"`method` must be one of {OPTIMIZERS}, got {method}")
+
+    n = len(x)
+    if scales is None:
+        scales = [1.0] * n
+    if not len(lower) == len(upper) == len(scales) == n:
+        raise ValueError("`x`, `lower`, `upper` and `scales` must have the same length")
+    if np.any(np.asarray(lower) > np.asarray(upper)):
+        raise ValueError("`lower` must not be larger than `upper`")
+
+    x = np.clip(np.asarray(x, dtype=float), lower, upper)
+
+    return {
+        "method": method,
+        "x": x.tolist(),
+        "lower": [float(value) for value in lower],
+        "upper": [float(value) for value in upper],
+        "scales": [float(value) for value in scales],
+        "learning_rate": learning_rate,
+        "memory": memory,
+        "iteration": 0,
+        "best_x": None,
+        "best_f": None,
+        "best_g": None,
+        "step": 1.0,
+        "s": [],
+        "y": [],
+        "m": [0.0] * n,
+        "v": [0.0] * n,
+        "history": [],
+        "projected_gradient": None,
+    }
+
+
+def _get_projected_gradient(x, g, lower, upper):
+    """Returns the step of a unit projected gradient descent, zero at a bounded minimum"""
+    return np.clip(x - g, lower, upper) - x
+
+
+def _get_lbfgs_direction(g, s_list, y_list, learning_rate):
+    """Returns -H g with the two-loop recursion, a scaled steepest descent without corrections"""
+    if not s_list:
+        norm = np.linalg.norm(g)
+        return -g * (learning_rate / norm if norm > 0 else 0.0)
+
+    q = g.copy()
+    alphas = []
+    for s, y in zip(reversed(s_list), reversed(y_list)):
+        rho = 1.0 / (y @ s)
+        alpha = rho * (s @ q)
+        q -= alpha * y
+        alphas.append((rho, alpha))
+
+    s, y = s_list[-1], y_list[-1]
+    r = q * (s @ y) / (y @ y)
+    for (s, y), (rho, alpha) in zip(zip(s_list, y_list), reversed(alphas)):
+        beta = rho * (y @ r)
+        r += s * (alpha - beta)
+
+    return -r
+
+
+def _lbfgsb_step(state, x, f, g, lower, upper):
+    best_x = None if state["best_x"] is None else np.array(state["best_x"])
+    best_g = None if state["best_g"] is None else np.array(state["best_g"])
+    s_list = [np.array(s) for s in state["s"]]
+    y_list = [np.array(y) for y in state["y"]]
+
+    if best_x is None:
+        accepted = True
+    else:
+        # Armijo condition from the best point along the step that was taken
+        accepted = f <= state["best_f"] + 1e-4 * (best_g @ (x - best_x))
+
+    if accepted:
+        if best_x is not None:
+            s, y = x - best_x, g - best_g
+            if s @ y > 1e-12:
+                s_list = (s_list + [s])[-state["memory"] :]
+                y_list = (y_list + [y])[-state["memory"] :]
+        best_x, best_g = x, g
+        state["best_f"] = f
+        state["step"] = 1.0
+    else:
+        state["step"] /= 2
+
+    # the bounded variables that the gradient pushes outwards are kept fixed
+    free = _get_projected_gradient(best_x, best_g, lower, upper) != 0.0
+    direction = np.zeros_like(best_x)
+    if np.any(free):
+        direction[free] = _get_lbfgs_direction(
+            best_g[free],
+            [s[free] for s in s_list],
+            [y[free] for y in y_list],
+            state["learning_rate"],
+        )
+        if direction @ best_g >= 0.0:
+            s_list, y_list = [], []
+            direction[free] = _get_lbfgs_direction(
+                best_g[free], [], [], state["learning_rate"]
+            )
+
+    state["best_x"] = best_x.tolist()
+    state["best_g"] = best_g.tolist()
+    state["s"] = [s.tolist() for s in s_list]
+    state["y"] = [y.tolist() for y in y_list]
+
+    return np.clip(best_x + state["step"] * direction, lower, upper)
+
+
+def _adam_step(state, x, f, g, lower, upper, beta1=0.9, beta2=0.999, epsilon=1e-8):
+    if state["best_f"] is None or f < state["best_f"]:
+        state["best_x"], state["best_f"], state["best_g"] = x.tolist(), f, g.tolist()
+
+    t = state["iteration"]
+    m = beta1 * np.array(state["m"]) + (1 - beta1) * g
+    v = beta2 * np.array(state["v"]) + (1 - beta2) * g**2
+    state["m"], state["v"] = m.tolist(), v.tolist()
+
+    m_hat = m / (1 - beta1**t)
+    v_hat = v / (1 - beta2**t)
+
+    return np.clip(x - state["learning_rate"] * m_hat / (np.sqrt(v_hat) + epsilon), lower, upper)
+
+
+def optimizer_step(state: Dict, f: float, gradient: Sequence[float]) -> Dict:
+    """Returns the optimiser state updated with the objective and gradient at `state["x"]`
+
+    Args:
+        state (dict): the optimiser state, see `get_initial_state`
+        f (float): the objective at `state["x"]`
+        gradient (Sequence[float]): the gradient at `state["x"]`
+
+    Returns:
+        dict: the new state, `x` is the next point to evaluate, `best_x` and `best_f` the best point so far and
+            `projected_gradient` the norm of the projected gradient there, in scaled units
+    """
+    state = dict(state)
+    scales = np.array(state["scales"])
+    lower = np.array(state["lower"]) / scales
+    upper = np.array(state["upper"]) / scales
+    x = np.array(state["x"]) / scales
+    g = np.array(gradient, dtype=float) * scales
+
+    # the best point and the corrections are stored in scaled units
+    state["iteration"] += 1
+    state["history"] = state["history"] + [{"x": state["x"], "f": f}]
+
+    if state["method"] == "adam":
+        x_next = _adam_step(state, x, f, g, lower, upper)
+    else:
+        x_next = _lbfgsb_step(state, x, f, g, lower, upper)
+
+    best_x = np.array(state["best_x"])
+    state["projected_gradient"] = float(
+        np.linalg.norm(
+            _get_projected_gradient(best_x, np.array(state["best_g"]), lower, upper)
+        )
+    )
+    state["x"] = (x_next * scales).tolist()
+
+    return state
+
+
+def get_best_point(state: Dict) -> np.ndarray:
+    """Returns the best point found so far, in the original units"""
+    return np.array(state["best_x"]) * np.array(state["scales"])
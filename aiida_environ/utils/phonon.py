@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Utilities to plan the finite-displacement calculations of phonopy."""
+from typing import Dict, Mapping, Tuple
+
+from aiida.orm import StructureData
+from aiida.plugins import DataFactory
+
+from aiida_environ.utils.cache import get_content_hash
+
+
+def get_preprocess_data(
+    structure: StructureData,
+    symprec: float = 1e-3,
+    is_symmetry: bool = True,
+    displacement_generator: dict = None,
+):
+    """Returns the phonopy pre-processing data of a molecule, with symmetry-reduced displacements
+
+    Relaxed molecules are only symmetric within the accuracy of the relaxation, so `symprec` should be looser than
+    the default of phonopy for the point group to be found, e.g. 1e-3 turns the 18 displacements of water into 6.
+
+    Args:
+        structure (StructureData): the structure, used as its own supercell
+        symprec (float): the symmetry tolerance
+        is_symmetry (bool): whether to reduce the displacements by symmetry
+        displacement_generator (dict): the arguments of `set_displacements`, e.g. `distance` or `is_plusminus`
+
+    Returns:
+        PreProcessData: the pre-processing data, unstored
+    """
+    PreProcessData = DataFactory("phonopy.preprocess")
+    identity = [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+    preprocess_data = PreProcessData(
+        structure=structure,
+        supercell_matrix=identity,
+        primitive_matrix=identity,
+        symprec=symprec,
+        is_symmetry=is_symmetry,
+    )
+    preprocess_data.set_displacements(**(displacement_generator or {}))
+
+    return preprocess_data
+
+
+def plan_displacements(
+    supercells: Mapping[str, Mapping[str, StructureData]]
+) -> Tuple[Dict[str, StructureData], Dict[str, Dict[str, str]]]:
+    """Deduplicates the displaced supercells of several structures
+
+    Supercells are identified by their content hash, so a displacement that appears for several structures (e.g. the
+    same molecule given twice, or relaxed to the same geometry) is only calculated once.
+
+    Args:
+        supercells (Mapping[str, Mapping[str, StructureData]]): the stored displaced supercells of each structure,
+            keyed by the structure label and then by the supercell key, e.g. `supercell_1`
+
+    Returns:
+        Tuple[Dict[str, StructureData], Dict[str, Dict[str, str]]]: the unique supercells keyed by their hash, and for
+            each structure label the hash of each of its supercells
+    """
+    unique = {}
+    mapping = {}
+    for label, label_supercells in supercells.items():
+        mapping[label] = {}
+        for key, supercell in label_supercells.items():
+            content_hash = get_content_hash(supercell)
+            unique.setdefault(content_hash, supercell)
+            mapping[label][key] = content_hash
+
+    return unique, mapping
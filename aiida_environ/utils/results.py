@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""Utilities to load the results of many processes with a constant number of queries."""
+from typing import Dict, List, Sequence, Union
+
+import numpy as np
+from aiida import orm
+
+
+def _get_identifier_filters(identifiers: Sequence[Union[int, str]]) -> dict:
+    pks = [identifier for identifier in identifiers if not isinstance(identifier, str)]
+    uuids = [identifier for identifier in identifiers if isinstance(identifier, str)]
+    filters = []
+    if pks:
+        filters.append({"id": {"in": [int(pk) for pk in set(pks)]}})
+    if uuids:
+        filters.append({"uuid": {"in": list(set(uuids))}})
+
+    return {"or": filters}
+
+
+def _to_float(value) -> float:
+    if value is None:
+        return np.nan
+    if isinstance(value, (list, tuple)):
+        return _to_float(value[-1]) if value else np.nan
+    return float(value)
+
+
+def load_output_parameters(
+    identifiers: Sequence[Union[int, str]],
+    keys: Sequence[str],
+    link_label: str = "output_parameters",
+) -> Dict[str, np.ndarray]:
+    """Loads the output parameters of a set of processes
+
+    The exit status of the processes and the requested attributes of their output `Dict` are fetched with two
+    queries, independently of the number of processes, instead of loading each node.
+
+    Args:
+        identifiers (Sequence[Union[int, str]]): the PKs or UUIDs of the processes, may contain duplicates
+        keys (Sequence[str]): the keys of the output `Dict` to load, values stored as lists (one per SCF step, e.g.
+            `qm_surface`) are reduced to their final value
+        link_label (str): the link label of the output `Dict`
+
+    Returns:
+        Dict[str, np.ndarray]: a float array for each key, plus `exit_status`, aligned with `identifiers`. Values are
+            NaN where the key or the output is missing, or where the process has not terminated (`exit_status`)
+
+    Raises:
+        ValueError: if one of the processes does not exist
+    """
+    identifiers = list(identifiers)
+    results = {key: np.full(len(identifiers), np.nan) for key in keys}
+    results["exit_status"] = np.full(len(identifiers), np.nan)
+    if not identifiers:
+        return results
+
+    filters = _get_identifier_filters(identifiers)
+
+    qb = orm.QueryBuilder()
+    qb.append(
+        orm.ProcessNode,
+        filters=filters,
+        project=["id", "uuid", "attributes.exit_status"],
+    )
+    exit_status = {}
+    index = {}
+    for pk, uuid, status in qb.iterall():
+        exit_status[pk] = _to_float(status)
+        index[pk] = index[uuid] = pk
+
+    missing = [identifier for identifier in identifiers if identifier not in index]
+    if missing:
+        raise ValueError(f"no processes found for identifiers {missing}")
+
+    qb = orm.QueryBuilder()
+    qb.append(orm.ProcessNode, filters=filters, project="id", tag="process")
+    qb.append(
+        orm.Dict,
+        with_incoming="process",
+        edge_filters={"label": link_label},
+        project=[f"attributes.{key}" for key in keys],
+    )
+    outputs = {row[0]: row[1:] for row in qb.iterall()}
+
+    for i, identifier in enumerate(identifiers):
+        pk = index[identifier]
+        results["exit_status"][i] = exit_status[pk]
+        for key, value in zip(keys, outputs.get(pk, [None] * len(keys))):
+            results[key][i] = _to_float(value)
+
+    return results
+
+
+def load_output_arrays(
+    identifiers: Sequence[Union[int, str]],
+    name: str,
+    link_label: str = "output_trajectory",
+    frame: int = -1,
+) -> List[np.ndarray]:
+    """Loads one array of an output `ArrayData` (e.g. the `forces` of the `output_trajectory`) of a set of processes
+
+    The output nodes are found with a single query, the array content is then read from the repository of each node.
+
+    Args:
+        identifiers (Sequence[Union[int, str]]): the PKs or UUIDs of the processes
+        name (str): the name of the array
+        link_label (str): the link label of the output `ArrayData`
+        frame (int): the index along the first axis to return, e.g. the last step of a trajectory, None for the
+            full array
+
+    Returns:
+        List[np.ndarray]: the arrays, aligned with `identifiers`
+
+    Raises:
+        ValueError: if one of the processes does not have the output
+    """
+    identifiers = list(identifiers)
+    if not identifiers:
+        return []
+
+    qb = orm.QueryBuilder()
+    qb.append(
+        orm.ProcessNode,
+        filters=_get_identifier_filters(identifiers),
+        project=["id", "uuid"],
+        tag="process",
+    )
+    qb.append(
+        orm.ArrayData,
+        with_incoming="process",
+        edge_filters={"label": link_label},
+        project="*",
+    )
+    outputs = {}
+    for pk, uuid, node in qb.iterall():
+        outputs[pk] = outputs[uuid] = node
+
+    missing = [identifier for identifier in identifiers if identifier not in outputs]
+    if missing:
+        raise ValueError(f"no `{link_label}` found for processes {missing}")
+
+    arrays = {}
+    for node in outputs.values():
+        if node.pk not in arrays:
+            array = node.get_array(name)
+            arrays[node.pk] = array if frame is None else array[frame]
+
+    return [arrays[outputs[identifier].pk] for identifier in identifiers]
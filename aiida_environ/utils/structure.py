@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Utilities to build many `StructureData` nodes that decorate a common host structure, and to compare structures."""
+from typing import List, Sequence
+
+import numpy as np
+from aiida.manage import get_manager
+from aiida.orm import StructureData
+from aiida.orm.nodes.data.structure import Kind
+
+
+class StructureFactory:
+    """Builds `StructureData` objects by appending sites to a fixed host structure
+
+    The host cell, kinds and sites are read once on construction. Each new structure is then created with a single
+    assignment of the raw `kinds` and `sites` attributes, instead of one `append_atom` call (and one kind comparison)
+    per atom.
+
+    Args:
+        structure (aiida.orm.StructureData): the host structure
+    """
+
+    def __init__(self, structure: StructureData):
+        self.cell = structure.cell
+        self.pbc = structure.pbc
+        self.kinds = structure.base.attributes.get("kinds", [])
+        self.sites = structure.base.attributes.get("sites", [])
+        self.positions = np.array(
+            [site["position"] for site in self.sites], dtype=float
+        ).reshape(-1, 3)
+        self._kind_names = [kind["name"] for kind in self.kinds]
+        self._new_kinds = {}
+
+    def get_axis_mean(self, axis: int) -> float:
+        """Returns the mean position of the host sites along an axis
+
+        Args:
+            axis (int): the axis index, starting from 1
+
+        Returns:
+            float: mean coordinate in angstrom
+        """
+        return float(np.mean(self.positions[:, axis - 1]))
+
+    def _get_kind(self, name: str) -> dict:
+        if name not in self._new_kinds:
+            self._new_kinds[name] = Kind(symbols=name, name=name).get_raw()
+        return self._new_kinds[name]
+
+    def build(self, positions: np.ndarray, kind_names: Sequence[str]) -> StructureData:
+        """Returns a new (unstored) structure made of the host plus the given sites
+
+        Args:
+            positions (np.ndarray): (n, 3) array of cartesian positions of the new sites
+            kind_names (Sequence[str]): the n kind names of the new sites, new kinds are created from the chemical
+                symbol of the same name
+
+        Returns:
+            aiida.orm.StructureData: the decorated structure
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        if len(positions) != len(kind_names):
+            raise ValueError("`positions` and `kind_names` must have the same length")
+
+        kinds = list(self.kinds)
+        for name in dict.fromkeys(kind_names):
+            if name not in self._kind_names:
+                kinds.append(self._get_kind(name))
+
+        sites = self.sites + [
+            {"position": tuple(position), "kind_name": name}
+            for position, name in zip(positions.tolist(), kind_names)
+        ]
+
+        structure = StructureData(cell=self.cell, pbc=self.pbc)
+        structure.base.attributes.set("kinds", kinds)
+        structure.base.attributes.set("sites", sites)
+
+        return structure
+
+
+    def displace(self, index: int, displacement: Sequence[float]) -> StructureData:
+        """Returns a new (unstored) copy of the host structure with one site displaced
+
+        Args:
+            index (int): the index of the site, starting from 0
+            displacement (Sequence[float]): the cartesian displacement in angstrom
+
+        Returns:
+            aiida.orm.StructureData: the displaced structure
+        """
+        sites = list(self.sites)
+        position = self.positions[index] + np.asarray(displacement, dtype=float)
+        sites[index] = dict(sites[index], position=tuple(position.tolist()))
+
+        structure = StructureData(cell=self.cell, pbc=self.pbc)
+        structure.base.attributes.set("kinds", self.kinds)
+        structure.base.attributes.set("sites", sites)
+
+        return structure
+
+
+def store_structures(structures: Sequence[StructureData]) -> List[int]:
+    """Stores a set of structures in a single database transaction
+
+    Args:
+        structures (Sequence[aiida.orm.StructureData]): the unstored structures
+
+    Returns:
+        List[int]: the PK values of the stored structures, in input order
+    """
+    with get_manager().get_profile_storage().transaction():
+        for structure in structures:
+            structure.store()
+
+    return [structure.pk for structure in structures]
+
+
+def structures_match(
+    first: StructureData, second: StructureData, tolerance: float = 1e-4
+) -> bool:
+    """Returns whether two structures have the same cell, sites and kinds within a tolerance
+
+    The sites are compared in order, e.g. to recognise a structure relaxed again to the same geometry.
+
+    Args:
+        first (aiida.orm.StructureData): the first structure
+        second (aiida.orm.StructureData): the second structure
+        tolerance (float): the largest allowed difference of the cell vectors and site positions, in angstrom
+
+    Returns:
+        bool: True if the structures match
+    """
+    if [site.kind_name for site in first.sites] != [site.kind_name for site in second.sites]:
+        return False
+    if [kind.get_raw() for kind in first.kinds] != [kind.get_raw() for kind in second.kinds]:
+        return False
+    if not np.allclose(first.cell, second.cell, rtol=0.0, atol=tolerance):
+        return False
+
+    first_positions = np.array([site.position for site in first.sites]).reshape(-1, 3)
+    second_positions = np.array([site.position for site in second.sites]).reshape(-1, 3)
+
+    return bool(np.all(np.linalg.norm(first_positions - second_positions, axis=1) <= tolerance))
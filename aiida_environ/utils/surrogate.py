@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Gaussian-process surrogate and expected-improvement proposals for expensive bounded searches."""
+from math import erf
+from typing import Sequence, Tuple
+
+import numpy as np
+
+_erf = np.vectorize(erf)
+
+
+def latin_hypercube(
+    n: int, lower: Sequence[float], upper: Sequence[float], rng: np.random.Generator
+) -> np.ndarray:
+    """Returns a Latin hypercube sample of a box
+
+    Args:
+        n (int): the number of points
+        lower (Sequence[float]): the lower bounds
+        upper (Sequence[float]): the upper bounds
+        rng (np.random.Generator): the random number generator
+
+    Returns:
+        np.ndarray: (n, d) points, each dimension has exactly one point in each of n equal intervals
+    """
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    unit = (rng.random((n, len(lower))) + np.arange(n)[:, None]) / n
+    for column in unit.T:
+        rng.shuffle(column)
+
+    return lower + unit * (upper - lower)
+
+
+class GaussianProcess:
+    """Gaussian-process regression with a squared exponential kernel
+
+    The targets are standardised, and the isotropic length scale is chosen among `length_scales` by maximising the
+    log marginal likelihood, unless it is given to `fit`.
+    """
+
+    def __init__(
+        self,
+        length_scales: Sequence[float] = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0),
+        noise: float = 1e-6,
+    ):
+        self.length_scales = length_scales
+        self.noise = noise
+
+    def _kernel(self, a, b):
+        distances = np.sum((a[:, None, :] - b[None, :, :]) ** 2, axis=-1)
+        return np.exp(-0.5 * distances / self.length_scale**2)
+
+    def _factorise(self):
+        kernel = self._kernel(self.x, self.x) + self.noise * np.eye(len(self.x))
+        self._cholesky = np.linalg.cholesky(kernel)
+        self._weights = np.linalg.solve(
+            self._cholesky.T, np.linalg.solve(self._cholesky, self._y)
+        )
+
+    def _log_likelihood(self):
+        return (
+            -0.5 * self._y @ self._weights
+            - np.sum(np.log(np.diag(self._cholesky)))
+            - 0.5 * len(self.x) * np.log(2 * np.pi)
+        )
+
+    def fit(self, x: np.ndarray, y: np.ndarray, length_scale: float = None):
+        """Conditions the surrogate on observations
+
+        Args:
+            x (np.ndarray): (n, d) observed points
+            y (np.ndarray): (n,) observed values
+            length_scale (float): the kernel length scale, chosen by maximum likelihood if None
+
+        Returns:
+            GaussianProcess: the fitted surrogate
+        """
+        self.x = np.atleast_2d(np.asarray(x, dtype=float))
+        y = np.asarray(y, dtype=float)
+        self.y_mean = y.mean()
+        self.y_std = y.std() if y.std() > 0 else 1.0
+        self._y = (y - self.y_mean) / self.y_std
+
+        if length_scale is not None:
+            self.length_scale = length_scale
+            self._factorise()
+            return self
+
+        best = None
+        for candidate in self.length_scales:
+            self.length_scale = candidate
+            try:
+                self._factorise()
+            except np.linalg.LinAlgError:
+                continue
+            likelihood = self._log_likelihood()
+            if best is None or likelihood > best[0]:
+                best = (likelihood, candidate)
+
+        if best is None:
+            raise ValueError("the kernel matrix is singular for all the length scales")
+
+        self.length_scale = best[1]
+        self._factorise()
+
+        return self
+
+    def predict(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the posterior mean and standard deviation at a set of points"""
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        kernel = self._kernel(x, self.x)
+        mean = kernel @ self._weights
+        v = np.linalg.solve(self._cholesky, kernel.T)
+        variance = np.clip(1.0 - np.sum(v**2, axis=0), 0.0, None)
+
+        return self.y_mean + self.y_std * mean, self.y_std * np.sqrt(variance)
+
+
+def expected_improvement(mean: np.ndarray, std: np.ndarray, best: float) -> np.ndarray:
+    """Returns the expected improvement below `best` of a Gaussian prediction (minimisation)"""
+    mean = np.asarray(mean, dtype=float)
+    std = np.asarray(std, dtype=float)
+    improvement = best - mean
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(std > 0, improvement / std, 0.0)
+    cdf = 0.5 * (1 + _erf(z / np.sqrt(2)))
+    pdf = np.exp(-0.5 * z**2) / np.sqrt(2 * np.pi)
+
+    return np.where(std > 0, improvement * cdf + std * pdf, np.maximum(improvement, 0.0))
+
+
+def propose_batch(
+    x: np.ndarray,
+    y: np.ndarray,
+    lower: Sequence[float],
+    upper: Sequence[float],
+    batch_size: int,
+    rng: np.random.Generator,
+    ncandidates: int = 2000,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Proposes the next points of a minimisation by maximising the expected improvement of a Gaussian process
+
+    A batch is built with the kriging believer heuristic: each proposed point is added to the observations with its
+    predicted value before the next one is chosen, so the points of a batch do not collapse onto the same optimum.
+
+    Args:
+        x (np.ndarray): (n, d) observed points
+        y (np.ndarray): (n,) observed values
+        lower (Sequence[float]): the lower bounds of the search box
+        upper (Sequence[float]): the upper bounds of the search box
+        batch_size (int): the number of points to propose
+        rng (np.random.Generator): the random number generator for the candidate points
+        ncandidates (int): the number of random candidates the expected improvement is maximised over
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: the (batch_size, d) proposed points and their expected improvement when they
+            were chosen, in the units of `y`
+    """
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    width = np.where(upper > lower, upper - lower, 1.0)
+
+    # the surrogate works in the unit cube
+    x = (np.atleast_2d(np.asarray(x, dtype=float)) - lower) / width
+    y = np.asarray(y, dtype=float)
+    candidates = rng.random((ncandidates, len(lower)))
+
+    model = GaussianProcess().fit(x, y)
+    length_scale = model.length_scale
+    best = y.min()
+
+    points = []
+    improvements = []
+    for _ in range(batch_size):
+        ei = expected_improvement(*model.predict(candidates), best)
+        i = int(np.argmax(ei))
+        points.append(candidates[i])
+        improvements.append(float(ei[i]))
+
+        believed, _ = model.predict(candidates[i])
+        x = np.vstack([x, candidates[i]])
+        y = np.append(y, believed)
+        candidates = np.delete(candidates, i, axis=0)
+        model = GaussianProcess(noise=model.noise).fit(x, y, length_scale=length_scale)
+
+    return lower + np.array(points) * width, np.array(improvements)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Vibrational thermochemistry of molecules over a grid of temperatures, with quasi-RRHO corrections."""
+from typing import Dict, Sequence
+
+import numpy as np
+
+from aiida_environ.utils.hessian import BOLTZMANN, PLANCK_SPEED_OF_LIGHT
+
+# THz in cm^-1
+THZ_TO_WAVENUMBER = 33.35641
+# average molecular moment of inertia of the free rotors, in kg m^2 (Grimme, Chem. Eur. J. 18, 9955 (2012))
+AVERAGE_MOMENT_OF_INERTIA = 1e-44
+# SI constants of the free rotor entropy
+PLANCK_SI = 6.62607015e-34
+BOLTZMANN_SI = 1.380649e-23
+SPEED_OF_LIGHT_CM = 2.99792458e10
+# kJ/mol in eV
+KJ_PER_MOL_TO_EV = 1.0 / 96.485332
+
+
+def get_vibrational_modes(wavenumbers: Sequence[float], rigid_body_modes: int = 6) -> np.ndarray:
+    """Returns the vibrational modes of a molecule, without its translations and rotations
+
+    Args:
+        wavenumbers (Sequence[float]): all the wavenumbers in cm^-1, imaginary modes as negative values
+        rigid_body_modes (int): the number of translations and rotations, the modes closest to zero
+
+    Returns:
+        np.ndarray: the remaining wavenumbers in increasing order, possibly with imaginary modes left
+    """
+    wavenumbers = np.asarray(wavenumbers, dtype=float).ravel()
+    vibrations = np.argsort(np.abs(wavenumbers))[rigid_body_modes:]
+
+    return np.sort(wavenumbers[vibrations])
+
+
+def get_thermochemistry(
+    wavenumbers: Sequence[float], temperatures: Sequence[float], quasi_rrho_cutoff: float = 100.0
+) -> Dict[str, np.ndarray]:
+    """Returns the vibrational thermochemistry of a set of modes at each temperature
+
+    Modes softer than the quasi-RRHO cutoff are interpolated towards free rotors: Grimme's correction for the entropy
+    and Head-Gordon's for the enthalpy, both with the damping function 1 / (1 + (cutoff / wavenumber)^4). Imaginary
+    modes are left out.
+
+    Args:
+        wavenumbers (Sequence[float]): the vibrational wavenumbers in cm^-1
+        temperatures (Sequence[float]): the temperatures in K, all positive
+        quasi_rrho_cutoff (float): the cutoff wavenumber of the damping in cm^-1, 0 for the harmonic approximation
+
+    Returns:
+        Dict[str, np.ndarray]: the `zero_point_energy` (eV), and the `enthalpy` (eV, including the zero point energy),
+            `entropy` (eV/K) and `free_energy` (eV) at each temperature
+    """
+    wavenumbers = np.asarray(wavenumbers, dtype=float).ravel()
+    wavenumbers = wavenumbers[wavenumbers > 0][:, None]
+    temperatures = np.asarray(temperatures, dtype=float).ravel()[None, :]
+
+    energies = PLANCK_SPEED_OF_LIGHT * wavenumbers
+    x = energies / (BOLTZMANN * temperatures)
+    zero_point = 0.5 * energies
+    harmonic_enthalpy = zero_point + energies / np.expm1(x)
+    harmonic_entropy = BOLTZMANN * (x / np.expm1(x) - np.log(-np.expm1(-x)))
+
+    # free rotor with the moment of inertia of the mode, damped to the average molecular moment of inertia
+    moment = PLANCK_SI / (8 * np.pi**2 * SPEED_OF_LIGHT_CM * wavenumbers)
+    reduced_moment = moment * AVERAGE_MOMENT_OF_INERTIA / (moment + AVERAGE_MOMENT_OF_INERTIA)
+    rotor_entropy = BOLTZMANN * (
+        0.5 + 0.5 * np.log(8 * np.pi**3 * reduced_moment * BOLTZMANN_SI * temperatures / PLANCK_SI**2)
+    )
+    rotor_enthalpy = 0.5 * BOLTZMANN * temperatures
+
+    weights = 1.0 / (1.0 + (quasi_rrho_cutoff / wavenumbers) ** 4)
+    enthalpy = np.sum(weights * harmonic_enthalpy + (1 - weights) * rotor_enthalpy, axis=0)
+    entropy = np.sum(weights * harmonic_entropy + (1 - weights) * rotor_entropy, axis=0)
+
+    return {
+        "zero_point_energy": np.sum(zero_point),
+        "enthalpy": enthalpy,
+        "entropy": entropy,
+        "free_energy": enthalpy - temperatures.ravel() * entropy,
+    }
+
+
+def get_pka(delta_free_energy: Sequence[float], temperatures: Sequence[float]) -> np.ndarray:
+    """Returns the pKa of a deprotonation free energy in eV at each temperature"""
+    temperatures = np.asarray(temperatures, dtype=float)
+
+    return np.asarray(delta_free_energy, dtype=float) / (np.log(10) * BOLTZMANN * temperatures)
@@ -5,13 +5,24 @@ Workchain to perform relaxations and phonon calculations on conjugate acid base
 from aiida import orm
 from aiida.common import AttributeDict
 from aiida.common.lang import type_check
-from aiida.engine import ToContext, WorkChain
+from aiida.engine import ToContext, WorkChain, if_
 from aiida.plugins import WorkflowFactory
 from aiida_quantumespresso.common.types import RelaxType
 from aiida_quantumespresso.workflows.protocols.utils import ProtocolMixin
 from aiida.orm import StructureData
+import numpy as np
 
-EnvRelaxPhononWorkChain = WorkflowFactory("aiida.pka.env_relax_phonon")
+from aiida_environ.calculations.thermochemistry import calc_pka_temperature_curve
+
+EnvRelaxPhononWorkChain = WorkflowFactory("environ.pka.env_relax_phonon")
+
+def validate_temperatures(value, _):
+    """Validate the temperatures of the thermochemistry."""
+    temperatures = value.get_list()
+    if not temperatures:
+        return 'The `temperatures` must not be empty.'
+    if any(temperature <= 0 for temperature in temperatures):
+        return 'The `temperatures` must all be positive.'
 
 class AcidBaseWorkChain(WorkChain, ProtocolMixin):
     """
@@ -55,12 +66,57 @@ class AcidBaseWorkChain(WorkChain, ProtocolMixin):
                   'will be cleaned at the end of execution.')
         )
 
+        spec.input(
+            'run_parallel',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(True),
+            help=('If `True`, the acid and base `EnvRelaxPhononWorkChain` are submitted together, '
+                  'otherwise the base is submitted once the acid has finished.')
+        )
+        spec.input_namespace(
+            'thermochemistry',
+            help=('Settings of the thermochemistry of the acid and the base, and of the pKa, over a grid '
+                  'of temperatures.')
+        )
+        spec.input(
+            'thermochemistry.temperatures',
+            valid_type=orm.List,
+            default=lambda: orm.List(list=np.arange(273.15, 373.16, 5.0).tolist()),
+            validator=validate_temperatures,
+            help='Temperatures in K of the thermochemistry and pKa curves.'
+        )
+        spec.input(
+            'thermochemistry.quasi_rrho_cutoff',
+            valid_type=orm.Float,
+            default=lambda: orm.Float(100.0),
+            help=('Wavenumber in cm^-1 below which the modes are interpolated towards free rotors, '
+                  '0 for the harmonic approximation.')
+        )
+        spec.input(
+            'thermochemistry.rigid_body_modes',
+            valid_type=orm.Int,
+            default=lambda: orm.Int(6),
+            help='Number of translations and rotations of the molecules, left out of the vibrations.'
+        )
+        spec.input(
+            'thermochemistry.proton_free_energy',
+            valid_type=orm.Float,
+            default=lambda: orm.Float(-11.72),
+            help=('Free energy in eV of the solvated proton, including the standard state correction, '
+                  'the default is -270.3 kcal/mol.')
+        )
+
         spec.outline(
             cls.setup,
-            cls.run_acid,
-            cls.check_acid,
-            cls.run_base,
-            cls.check_base,
+            if_(cls.should_run_parallel)(
+                cls.run_acid_base,
+                cls.check_acid_base,
+            ).else_(
+                cls.run_acid,
+                cls.check_acid,
+                cls.run_base,
+                cls.check_base,
+            ),
             cls.results,
         )
 
@@ -83,6 +139,13 @@ class AcidBaseWorkChain(WorkChain, ProtocolMixin):
             EnvRelaxPhononWorkChain,
             namespace='base',
         )
+        spec.output(
+            'thermochemistry',
+            valid_type=orm.ArrayData,
+            required=False,
+            help=('Zero point energy, enthalpy, entropy and free energy of the acid and the base, and the pKa, '
+                  'at each temperature.')
+        )
 
     @classmethod
     def get_builder_from_protocol(
@@ -146,6 +209,9 @@ class AcidBaseWorkChain(WorkChain, ProtocolMixin):
             clean_phonon_workdir=clean_phonon_workdir,
             **kwargs
         )
+        for inputs in (acid_inputs, base_inputs):
+            inputs.pop('clean_workdir', None)
+            inputs.pop('clean_phonon_workdir', None)
         builder.acid = acid_inputs
         builder.base = base_inputs
         builder.clean_workdir = orm.Bool(clean_workdir)
@@ -158,6 +224,24 @@ class AcidBaseWorkChain(WorkChain, ProtocolMixin):
         self.ctx.base_failed = True
         return
 
+    def should_run_parallel(self):
+        return self.inputs.run_parallel
+
+    def run_acid_base(self):
+        """Submit the acid and base calculations at once."""
+        self.report('Running acid and base calculations in parallel')
+        self.run_acid()
+        self.run_base()
+        return
+
+    def check_acid_base(self):
+        """
+        Inspect output of acid and base simulations.
+        """
+        acid_exit_code = self.check_acid()
+        base_exit_code = self.check_base()
+        return acid_exit_code or base_exit_code
+
     def run_acid(self):
         inputs = AttributeDict(
             self.exposed_inputs(
@@ -225,6 +309,26 @@ class AcidBaseWorkChain(WorkChain, ProtocolMixin):
         return
 
     def results(self):
+        """
+        Calculate the thermochemistry of the acid and the base, and the pKa, at all the temperatures.
+        """
+        acid = self.ctx.acid.outputs.environ
+        base = self.ctx.base.outputs.environ
+        settings = orm.Dict(dict={
+            'temperatures': self.inputs.thermochemistry.temperatures.get_list(),
+            'quasi_rrho_cutoff': self.inputs.thermochemistry.quasi_rrho_cutoff.value,
+            'rigid_body_modes': self.inputs.thermochemistry.rigid_body_modes.value,
+            'proton_free_energy': self.inputs.thermochemistry.proton_free_energy.value,
+        })
+        thermochemistry = calc_pka_temperature_curve(
+            acid.phonon.phonopy_data,
+            base.phonon.phonopy_data,
+            acid.solution.output_parameters,
+            base.solution.output_parameters,
+            settings,
+        )
+        self.out('thermochemistry', thermochemistry)
+        self.report('thermochemistry and pKa calculated at all temperatures')
         return
 
     def on_terminated(self):
@@ -12,6 +12,10 @@ from aiida_quantumespresso.workflows.protocols.utils import ProtocolMixin
 from aiida.orm import load_group, load_code, StructureData, ArrayData, to_aiida_type
 import numpy as np
 
+from aiida_environ.calculations.surrogate import propose_parameters
+from aiida_environ.calculations.sweep import collect_parameter_results
+from aiida_environ.utils.surrogate import latin_hypercube
+
 AcidBaseWorkChain = WorkflowFactory("environ.pka.acid_base")
 EnvPwRelaxWorkChain = WorkflowFactory("environ.pw.relax")
 EnvPwBaseWorkChain = WorkflowFactory("environ.pw.base")
@@ -20,6 +24,14 @@ class AcidBaseParameterSweepWorkChain(WorkChain, ProtocolMixin):
     """
         WorkChain to perform Relaxations and Phonon calculations on conjugate acid base pairs followed by a parameter
         sweep
+
+        With `parameter_batch_size`, the parameters are run in batches of concurrent acid and base calculations
+        instead of one at a time.
+
+        With `bayesian_parameters`, `alpha`, `field_factor` and `field_asymmetry` are instead searched by Bayesian
+        optimisation: a Gaussian-process surrogate of the squared deviation of the base minus acid energy from a
+        target proposes batches of parameters by expected improvement, until it falls below `ei_tolerance` or
+        `max_evaluations` parameters have been run.
     """
 
     @classmethod
@@ -69,6 +81,16 @@ class AcidBaseParameterSweepWorkChain(WorkChain, ProtocolMixin):
             default=lambda: orm.Bool(True),
             help='If `True`, runs the acid and base calculations simultaneously for each test parameter'
         )
+
+        spec.input(
+            "parameter_batch_size",
+            valid_type=orm.Int,
+            required=False,
+            help='If given, the acid and base calculations of this many parameters are run at once, 0 runs all the '
+                 'parameters at once. Each batch waits for all of its calculations to finish before the next one is '
+                 'submitted, so a slow calculation holds back the whole batch. The results are only given as the '
+                 '`results_table`'
+        )
         
         spec.input(
             "parameter_relax",
@@ -98,20 +120,43 @@ class AcidBaseParameterSweepWorkChain(WorkChain, ProtocolMixin):
             serializer=to_aiida_type,
             help='The maximum number of iterations each Parameter workchain will restart the process to finish successfully'
         )
+        spec.input(
+            "bayesian_parameters",
+            valid_type=orm.Dict,
+            required=False,
+            help='If given, the parameters are searched with Bayesian optimisation instead of a sweep. Requires the '
+                 '`target_energy` (eV) of the base minus the acid, the squared deviation from it is minimised. '
+                 'Optional: `bounds` of `alpha`, `field_factor` and `field_asymmetry`, `n_initial`, `batch_size`, '
+                 '`max_evaluations`, `ei_tolerance` (eV^2) and `seed`'
+        )
 
         spec.outline(
             cls.setup,
             cls.acid_base_relax_phonon,
             cls.inspect_acid_base_relax_phonon,
-            while_(cls.has_remaining_parameters)(
-                if_(cls.should_run_acid_base_parameter_parallel)(
-                    cls.run_acid_base_parameter_parallel,
-                ).else_(
-                    cls.run_parameter_acid,
-                    cls.run_parameter_base,
+            if_(cls.should_run_bayesian)(
+                cls.setup_bayesian,
+                while_(cls.has_remaining_parameters)(
+                    cls.run_parameter_batch,
+                    cls.inspect_parameter_batch,
+                    cls.propose_parameter_batch,
+                ),
+            ).elif_(cls.should_run_parameter_batches)(
+                while_(cls.has_remaining_parameters)(
+                    cls.run_parameter_batch,
+                    cls.inspect_parameter_batch,
+                ),
+            ).else_(
+                while_(cls.has_remaining_parameters)(
+                    if_(cls.should_run_acid_base_parameter_parallel)(
+                        cls.run_acid_base_parameter_parallel,
+                    ).else_(
+                        cls.run_parameter_acid,
+                        cls.run_parameter_base,
+                    ),
+                    cls.inspect_parameter_results,
+
                 ),
-                cls.inspect_parameter_results,
-                
             ),
             cls.gather_results,
         )
@@ -134,6 +179,20 @@ class AcidBaseParameterSweepWorkChain(WorkChain, ProtocolMixin):
             help="Results for each set of parameters for base",
         )
 
+        spec.output(
+            "results_table",
+            valid_type=ArrayData,
+            required=False,
+            help="The parameters and the acid and base energies of all the tested parameters, one row per parameter",
+        )
+
+        spec.output(
+            "bayesian.results",
+            valid_type=orm.Dict,
+            required=False,
+            help="The best parameters found by the Bayesian optimisation and its last proposal",
+        )
+
         spec.exit_code(
             400, 'ERROR_RELAX_PHONON_FAILED',
             message='Acid/Base relaxation or phonon calculation failed',
@@ -142,6 +201,10 @@ class AcidBaseParameterSweepWorkChain(WorkChain, ProtocolMixin):
             401, 'ERROR_PARAMETER_SUB_PROCESS_FAILED',
             message='Parameter sweep calculation failed with parameter_fail_hard set to True',
         )
+        spec.exit_code(
+            402, 'ERROR_INVALID_BAYESIAN_PARAMETERS',
+            message='The `bayesian_parameters` do not define a `target_energy`',
+        )
 
     @classmethod
     def get_builder_from_protocol(
@@ -179,8 +242,8 @@ class AcidBaseParameterSweepWorkChain(WorkChain, ProtocolMixin):
 
     def setup(self):
         """Set up context variables for the workchain"""
-        self.ctx.acid_parameters = list(self.inputs["parameters"].values())
-        self.ctx.base_parameters = list(self.inputs["parameters"].values())
+        self.ctx.acid_parameters = [parameters.get_dict() for parameters in self.inputs["parameters"].values()]
+        self.ctx.base_parameters = [parameters.get_dict() for parameters in self.inputs["parameters"].values()]
         self.ctx.acid_parameter_results = {}
         self.ctx.base_parameter_results = {}
         self.ctx.run_count_parameters = 0 
@@ -226,8 +289,8 @@ class AcidBaseParameterSweepWorkChain(WorkChain, ProtocolMixin):
     def run_parameter_acid(self):
         from aiida_quantumespresso.workflows.protocols.utils import recursive_merge
         acid_inputs = AttributeDict(self.exposed_inputs(AcidBaseWorkChain)).acid
-        base_inputs = acid_inputs.base
-        environ_parameters = acid_inputs.solution.environ_parameters.get_dict()
+        base_inputs = acid_inputs.solution.base
+        environ_parameters = base_inputs.pw.environ_parameters.get_dict()
         environ_parameters['ENVIRON']['environ_restart'] = True
         base_inputs.pw.environ_parameters = environ_parameters
         parameters = base_inputs.pw.parameters.get_dict()
@@ -242,11 +305,12 @@ class AcidBaseParameterSweepWorkChain(WorkChain, ProtocolMixin):
         parameters['ELECTRONS']['startingpot'] = 'file'
         parameters['ELECTRONS']['startingwfc'] = 'file'
         base_inputs.pw.parameters = parameters
-        base_inputs.pw.parent_folder = self.ctx.acid_base_relax_phonon.outputs.acid.solution.scf.remote_folder
+        base_inputs.pw.parent_folder = self.ctx.acid_base_relax_phonon.outputs.acid.environ.solution.remote_folder
 
-        test_parameters = self.ctx.acid_parameters.pop(0).get_dict()
+        test_parameters = self.ctx.acid_parameters.pop(0)
         base_inputs.pw = recursive_merge(base_inputs.pw, test_parameters)
-        base_inputs['pw']['structure'] = self.ctx.acid_base_relax_phonon.outputs.acid.solution.scf.output_structure
+        base_inputs.pw.environ_parameters = orm.Dict(base_inputs.pw.environ_parameters)
+        base_inputs['pw']['structure'] = self.ctx.acid_base_relax_phonon.outputs.acid.environ.solution.output_structure
         base_inputs.clean_workdir = self.inputs.clean_workdir or self.inputs.clean_parameter_workdir 
         if 'parallelization' in self.inputs.parameter:
             base_inputs.pw.parallelization = self.inputs.parameter.parallelization
@@ -262,8 +326,8 @@ class AcidBaseParameterSweepWorkChain(WorkChain, ProtocolMixin):
     def run_parameter_base(self):
         from aiida_quantumespresso.workflows.protocols.utils import recursive_merge
         acid_inputs = AttributeDict(self.exposed_inputs(AcidBaseWorkChain)).base
-        base_inputs = acid_inputs.base
-        environ_parameters = acid_inputs.solution.environ_parameters.get_dict()
+        base_inputs = acid_inputs.solution.base
+        environ_parameters = base_inputs.pw.environ_parameters.get_dict()
         environ_parameters['ENVIRON']['environ_restart'] = True
         base_inputs.pw.environ_parameters = environ_parameters
         parameters = base_inputs.pw.parameters.get_dict()
@@ -279,11 +343,12 @@ class AcidBaseParameterSweepWorkChain(WorkChain, ProtocolMixin):
         parameters['ELECTRONS']['startingpot'] = 'file'
         parameters['ELECTRONS']['startingwfc'] = 'file'
         base_inputs.pw.parameters = parameters
-        base_inputs.pw.parent_folder = self.ctx.acid_base_relax_phonon.outputs.base.solution.scf.remote_folder
+        base_inputs.pw.parent_folder = self.ctx.acid_base_relax_phonon.outputs.base.environ.solution.remote_folder
 
-        test_parameters = self.ctx.base_parameters.pop(0).get_dict()
+        test_parameters = self.ctx.base_parameters.pop(0)
         base_inputs.pw = recursive_merge(base_inputs.pw, test_parameters)
-        base_inputs['pw']['structure'] = self.ctx.acid_base_relax_phonon.outputs.base.solution.scf.output_structure
+        base_inputs.pw.environ_parameters = orm.Dict(base_inputs.pw.environ_parameters)
+        base_inputs['pw']['structure'] = self.ctx.acid_base_relax_phonon.outputs.base.environ.solution.output_structure
         base_inputs.clean_workdir = self.inputs.clean_workdir or self.inputs.clean_parameter_workdir 
         if 'parallelization' in self.inputs.parameter:
             base_inputs.pw.parallelization = self.inputs.parameter.parallelization
@@ -299,7 +364,13 @@ class AcidBaseParameterSweepWorkChain(WorkChain, ProtocolMixin):
 
     def inspect_parameter_results(self):
         """Verify that the tested parameter finished successfully for both the acid and base calculations."""
-        last_parameter_acid = self.ctx.acid_subprocesses[-1]
+        if not self._record_parameter_results(self.ctx.acid_subprocesses[-1], self.ctx.base_subprocesses[-1]):
+            if self.inputs.parameter_fail_hard.value:
+                return self.exit_codes.ERROR_PARAMETER_SUB_PROCESS_FAILED
+        return
+
+    def _record_parameter_results(self, last_parameter_acid, last_parameter_base):
+        """Store the parameters and energies of an acid and base calculation, return whether both succeeded."""
         acid_pk = last_parameter_acid.pk
         acid_uuid = last_parameter_acid.uuid
         acid_inputs = last_parameter_acid.inputs.pw.environ_parameters.get_dict()
@@ -321,7 +392,6 @@ class AcidBaseParameterSweepWorkChain(WorkChain, ProtocolMixin):
                 "energy": last_parameter_acid.outputs.output_parameters.get_dict()['energy'],
             })
 
-        last_parameter_base = self.ctx.base_subprocesses[-1]
         base_pk = last_parameter_base.pk
         base_uuid = last_parameter_base.uuid
         base_inputs = last_parameter_base.inputs.pw.environ_parameters.get_dict()
@@ -343,14 +413,128 @@ class AcidBaseParameterSweepWorkChain(WorkChain, ProtocolMixin):
                 "energy": last_parameter_base.outputs.output_parameters.get_dict()['energy'],
             })
 
-        if not last_parameter_acid.is_finished_ok or not last_parameter_base.is_finished_ok:
-            if self.inputs.parameter_fail_hard.value:
-                return self.exit_codes.ERROR_PARAMETER_SUB_PROCESS_FAILED
         self.ctx.run_count_parameters += 1
+        return last_parameter_acid.is_finished_ok and last_parameter_base.is_finished_ok
+
+    def should_run_bayesian(self):
+        return 'bayesian_parameters' in self.inputs
+
+    def setup_bayesian(self):
+        """Set the defaults of the Bayesian optimisation and queue the initial design."""
+        settings = self.inputs.bayesian_parameters.get_dict()
+        if 'target_energy' not in settings:
+            return self.exit_codes.ERROR_INVALID_BAYESIAN_PARAMETERS
+        settings.setdefault('bounds', {})
+        settings['bounds'].setdefault('alpha', [1.0, 1.4])
+        settings['bounds'].setdefault('field_factor', [0.0, 0.2])
+        settings['bounds'].setdefault('field_asymmetry', [-0.5, 0.5])
+        settings.setdefault('n_initial', 6)
+        settings.setdefault('batch_size', 2)
+        settings.setdefault('max_evaluations', 30)
+        settings.setdefault('ei_tolerance', 1e-4)
+        settings.setdefault('seed', 0)
+        settings['names'] = ['alpha', 'field_factor', 'field_asymmetry']
+        self.ctx.bayesian_parameters = settings
+        self.ctx.bayesian_iteration = 0
+
+        # the swept parameters, if any, are part of the initial design, the rest is a Latin hypercube
+        n_initial = settings['n_initial'] - len(self.ctx.acid_parameters)
+        if n_initial > 0:
+            rng = np.random.default_rng(settings['seed'])
+            points = latin_hypercube(
+                n_initial,
+                [settings['bounds'][name][0] for name in settings['names']],
+                [settings['bounds'][name][1] for name in settings['names']],
+                rng,
+            )
+            self._queue_parameters(points)
+        self.report(f'Bayesian optimisation: {len(self.ctx.acid_parameters)} initial parameters')
+        return
+
+    def _queue_parameters(self, points):
+        """Add parameter points to the acid and base queues, as dictionaries that become nodes as calculation inputs."""
+        for point in points:
+            boundary = dict(zip(self.ctx.bayesian_parameters['names'], [float(value) for value in point]))
+            self.ctx.acid_parameters.append({'environ_parameters': {'BOUNDARY': dict(boundary)}})
+            self.ctx.base_parameters.append({'environ_parameters': {'BOUNDARY': dict(boundary)}})
+
+    def should_run_parameter_batches(self):
+        return 'parameter_batch_size' in self.inputs
+
+    def run_parameter_batch(self):
+        """Run the acid and base calculations of the next batch of queued parameters at once."""
+        self.ctx.batch_size = len(self.ctx.acid_parameters)
+        if not self.should_run_bayesian() and self.inputs.parameter_batch_size.value > 0:
+            self.ctx.batch_size = min(self.ctx.batch_size, self.inputs.parameter_batch_size.value)
+        self.report(f'Running {self.ctx.batch_size} parameters in parallel')
+        for _ in range(self.ctx.batch_size):
+            self.run_parameter_acid()
+            self.run_parameter_base()
+
+    def inspect_parameter_batch(self):
+        """Verify the acid and base calculations of the last batch of parameters."""
+        failed = False
+        for k in range(self.ctx.batch_size, 0, -1):
+            if not self._record_parameter_results(self.ctx.acid_subprocesses[-k], self.ctx.base_subprocesses[-k]):
+                failed = True
+        if failed and self.inputs.parameter_fail_hard.value:
+            return self.exit_codes.ERROR_PARAMETER_SUB_PROCESS_FAILED
+        return
+
+    def propose_parameter_batch(self):
+        """Fit the surrogate to the objective of all the parameters so far and queue the next batch."""
+        settings = self.ctx.bayesian_parameters
+        failed = np.finfo(np.float64).max
+        points = []
+        values = []
+        for key, acid in self.ctx.acid_parameter_results.items():
+            base = self.ctx.base_parameter_results[key]
+            if acid['energy'] == failed or base['energy'] == failed:
+                continue
+            points.append([acid[name] for name in settings['names']])
+            values.append((base['energy'] - acid['energy'] - settings['target_energy']) ** 2)
+
+        if not points:
+            self.report('No successful parameters to fit the surrogate, stopping the Bayesian optimisation')
+            return
+
+        self.ctx.bayesian_iteration += 1
+        remaining = settings['max_evaluations'] - self.ctx.run_count_parameters
+        proposal = propose_parameters(
+            orm.Dict({'points': points, 'values': values}),
+            orm.Dict({
+                'names': settings['names'],
+                'bounds': settings['bounds'],
+                'batch_size': max(0, min(settings['batch_size'], remaining)),
+                'seed': settings['seed'],
+                'iteration': self.ctx.bayesian_iteration,
+            }),
+        )
+        self.ctx.proposal = proposal
+        self.report(
+            f"Bayesian iteration {self.ctx.bayesian_iteration}: best parameters {proposal['best_parameters']} "
+            f"with squared deviation {proposal['best_value']:.3e} eV^2"
+        )
+
+        if not proposal['points']:
+            self.report('Reached the maximum number of evaluations')
+            return
+        if max(proposal['expected_improvement']) < settings['ei_tolerance']:
+            self.report('Expected improvement below tolerance, Bayesian optimisation converged')
+            return
+        self._queue_parameters(proposal['points'])
         return
 
     def gather_results(self):
-        self.out('acid.results', self.ctx.acid_parameter_results)
-        self.out('base.results', self.ctx.base_parameter_results)
+        if 'acid_subprocesses' in self.ctx:
+            self.out('results_table', collect_parameter_results(orm.Dict({
+                'acid': [node.pk for node in self.ctx.acid_subprocesses],
+                'base': [node.pk for node in self.ctx.base_subprocesses],
+            })))
+        if self.should_run_bayesian() or not self.should_run_parameter_batches():
+            self.out('acid.results', self.ctx.acid_parameter_results)
+            self.out('base.results', self.ctx.base_parameter_results)
+        if 'proposal' in self.ctx:
+            self.out('bayesian.results', self.ctx.proposal)
         self.report(f"AcidBaseParameterSweepWorkChain finished")
         return
\ No newline at end of file
@@ -19,6 +19,14 @@ from aiida.plugins import CalculationFactory, DataFactory, WorkflowFactory
 from aiida_quantumespresso.calculations.functions.create_kpoints_from_distance import create_kpoints_from_distance
 from aiida_quantumespresso.workflows.protocols.utils import ProtocolMixin
 
+from aiida_environ.calculations.phonon import (
+    calc_thermal_properties,
+    collect_forces,
+    generate_phonopy_data_from_forces,
+)
+from aiida_environ.utils.cache import find_finished_processes, get_lookup_inputs
+from aiida_environ.utils.structure import structures_match
+
 #from aiida_vibroscopy.calculations.spectra_utils import get_supercells_for_hubbard
 #from aiida_vibroscopy.common.properties import PhononProperty
 #from aiida_vibroscopy.utils.validation import validate_matrix, validate_tot_magnetization
@@ -96,6 +104,29 @@ class EnvPhononWorkChain(WorkChain, ProtocolMixin):
             'symmetry.is_symmetry', valid_type=orm.Bool, default=lambda:orm.Bool(True),
             help='Whether using or not the space group symmetries.',
         )
+        spec.input_namespace(
+            'cache',
+            help='Namespace for the reuse of the forces of previous phonon calculations.',
+        )
+        spec.input(
+            'cache.enabled', valid_type=orm.Bool, default=lambda: orm.Bool(False),
+            help=(
+                'Whether to reuse the forces of a previous successful `EnvPhononWorkChain` with the same DFT, Environ '
+                'and displacement settings on a matching structure. The settings are compared by content, including '
+                'the `scf.pw.environ_parameters`, so only runs with identical Environ settings are reused.'
+            ),
+        )
+        spec.input(
+            'cache.tolerance', valid_type=orm.Float, default=lambda: orm.Float(1e-4),
+            help='Largest difference of the cell vectors and positions, in angstrom, for two structures to match.',
+        )
+        spec.input(
+            'cache.max_candidates', valid_type=orm.Int, default=lambda: orm.Int(20),
+            help=(
+                'Largest number of previous runs with the same settings, most recent first, whose structures are '
+                'compared with the structure of this run.'
+            ),
+        )
         spec.input(
             'displacement_generator', valid_type=orm.Dict, required=False,
             help=(
@@ -123,6 +154,13 @@ class EnvPhononWorkChain(WorkChain, ProtocolMixin):
             },
             exclude=['phonopy_data', 'force_constants'],
         )
+        spec.input(
+            'thermal_parameters', valid_type=orm.Dict, required=False,
+            help=(
+                'Phonopy tags (`MESH`, `GAMMA_CENTER`, `TMIN`, `TMAX`, `TSTEP`, `CUTOFF_FREQUENCY`, `FC_SYMMETRY`) of '
+                'thermal properties calculated in process with the phonopy API, instead of a `PhonopyCalculation`.'
+            ),
+        )
         spec.input_namespace(
             'settings',
             help='Options for how to run the workflow.',
@@ -138,13 +176,18 @@ class EnvPhononWorkChain(WorkChain, ProtocolMixin):
 
         spec.outline(
             cls.setup,
-            cls.set_reference_kpoints,
-            cls.run_base_supercell,
-            cls.inspect_base_supercell,
-            cls.run_forces,
-            cls.inspect_all_runs,
-            cls.set_phonopy_data,
-            if_(cls.should_run_phonopy)(
+            cls.find_cached_forces,
+            if_(cls.should_run_forces)(
+              cls.set_reference_kpoints,
+              cls.run_base_supercell,
+              cls.inspect_base_supercell,
+              cls.run_forces,
+              cls.inspect_all_runs,
+              cls.set_phonopy_data,
+            ),
+            if_(cls.should_run_thermal_properties)(
+              cls.run_thermal_properties,
+            ).elif_(cls.should_run_phonopy)(
               cls.run_phonopy,
               cls.inspect_phonopy,
             ),
@@ -154,9 +197,12 @@ class EnvPhononWorkChain(WorkChain, ProtocolMixin):
             'supercells', valid_type=orm.StructureData, dynamic=True, required=False,
             help='The supercells with displacements.'
         )
-        spec.output_namespace(
-            'supercells_forces', valid_type=(orm.ArrayData, orm.TrajectoryData), required=True,
-            help='The forces acting on the atoms of each supercell.'
+        spec.output(
+            'supercells_forces', valid_type=orm.ArrayData, required=True,
+            help=(
+                'The forces acting on the atoms of all the supercells with displacements as a single '
+                '(n_displacements, nat, 3) `forces` array, and the `residual_forces` of the pristine supercell.'
+            ),
         )
         spec.output(
             'phonopy_data', valid_type=PhonopyData, required=True,
@@ -165,6 +211,13 @@ class EnvPhononWorkChain(WorkChain, ProtocolMixin):
                 ' to use in the post-processing calculation.'
             ),
         )
+        spec.output(
+            'thermal_properties', valid_type=orm.ArrayData, required=False,
+            help=(
+                'The force constants, frequencies and thermal properties over a range of temperatures calculated in '
+                'process, see `calc_thermal_properties`.'
+            ),
+        )
         spec.expose_outputs(PhonopyCalculation, namespace='output_phonopy', namespace_options={'required': False})
 
         spec.exit_code(
@@ -323,6 +376,39 @@ class EnvPhononWorkChain(WorkChain, ProtocolMixin):
         # if self.ctx.plus_hubbard:
         #     self.ctx.supercell = get_supercell_hubbard_structure(self.inputs.scf.pw.structure, self.ctx.supercell)
 
+    def find_cached_forces(self):
+        """Look for a previous phonon calculation with the same settings on a matching structure."""
+        self.ctx.cached = None
+        if not self.inputs.cache.enabled:
+            return
+
+        lookup = get_lookup_inputs(self.inputs.scf, namespace='scf')
+        lookup.pop('scf__pw__structure')
+        for input_ in ['supercell_matrix', 'primitive_matrix', 'displacement_generator']:
+            lookup[input_] = self.inputs.get(input_)
+        for input_ in ['symprec', 'is_symmetry', 'distinguish_kinds']:
+            lookup[f'symmetry__{input_}'] = self.inputs['symmetry'][input_]
+
+        structure = self.inputs.scf.pw.structure
+        tolerance = self.inputs.cache.tolerance.value
+        candidates = find_finished_processes(EnvPhononWorkChain, lookup, limit=self.inputs.cache.max_candidates.value)
+        for node in candidates:
+            if structures_match(node.inputs.scf.pw.structure, structure, tolerance):
+                self.ctx.cached = node
+                break
+
+        if self.ctx.cached is None:
+            return
+
+        self.report(f'reusing the forces of EnvPhononWorkChain<{self.ctx.cached.pk}>')
+        self.ctx.phonopy_data = self.ctx.cached.outputs.phonopy_data
+        self.out('supercells_forces', self.ctx.cached.outputs.supercells_forces)
+        self.out('phonopy_data', self.ctx.phonopy_data)
+
+    def should_run_forces(self):
+        """Return whether the forces of the displaced supercells have to be calculated."""
+        return self.ctx.cached is None
+
     def set_reference_kpoints(self):
         """Set the reference kpoints for the all PwBaseWorkChains."""
         try:
@@ -446,14 +532,14 @@ class EnvPhononWorkChain(WorkChain, ProtocolMixin):
             time.sleep(self.inputs.settings.sleep_submission_time)
 
     def inspect_all_runs(self):
-        """Inspect all previous workchains."""
+        """Inspect all previous workchains and collect their forces in a single array."""
         failed_runs = []
+        trajectories = {}
 
         for label, workchain in self.ctx.items():
             if label.startswith(self._RUN_PREFIX):
                 if workchain.is_finished_ok:
-                    forces = workchain.outputs.output_trajectory
-                    self.out(f"supercells_forces.forces_{label.split('_')[-1]}", forces)
+                    trajectories[f"forces_{label.split('_')[-1]}"] = workchain.outputs.output_trajectory
                 else:
                     self.report(
                         f'EnvPwBaseWorkChain with <PK={workchain.pk}> failed '
@@ -465,13 +551,23 @@ class EnvPhononWorkChain(WorkChain, ProtocolMixin):
             self.report('one or more workchains did not finish successfully')
             return self.exit_codes.ERROR_SUB_PROCESS_FAILED
 
+        self.ctx.forces = collect_forces(**trajectories)
+        self.out('supercells_forces', self.ctx.forces)
+
     def set_phonopy_data(self):
         """Set the `PhonopyData` in context for force constants calculation."""
-        kwargs = {'forces_index': orm.Int(-1), **self.outputs['supercells_forces']}
-
-        self.ctx.phonopy_data = self.ctx.preprocess_data.calcfunctions.generate_phonopy_data(**kwargs)
+        self.ctx.phonopy_data = generate_phonopy_data_from_forces(self.ctx.preprocess_data, self.ctx.forces)
         self.out('phonopy_data', self.ctx.phonopy_data)
 
+    def should_run_thermal_properties(self):
+        """Return whether to calculate the thermal properties in process."""
+        return 'thermal_parameters' in self.inputs
+
+    def run_thermal_properties(self):
+        """Calculate the force constants and thermal properties with the phonopy API."""
+        self.out('thermal_properties', calc_thermal_properties(self.ctx.phonopy_data, self.inputs.thermal_parameters))
+        self.report('calculated the thermal properties in process')
+
     def should_run_phonopy(self):
         """Return whether to run a PhonopyCalculation."""
         return 'phonopy' in self.inputs
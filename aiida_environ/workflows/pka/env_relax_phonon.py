@@ -6,7 +6,7 @@ coupled with the Quantum ESPRESSO pw.x.
 from aiida import orm # type: ignore
 from aiida.common import AttributeDict
 from aiida.common.lang import type_check
-from aiida.engine import ToContext, WorkChain
+from aiida.engine import ToContext, WorkChain, if_
 from aiida.plugins import WorkflowFactory
 from aiida_quantumespresso.common.types import RelaxType
 from aiida_quantumespresso.workflows.protocols.utils import ProtocolMixin
@@ -46,16 +46,38 @@ class EnvRelaxPhononWorkChain(WorkChain, ProtocolMixin):
         #        'the main relax loop in solution.'
         #    ),
         #)
+        spec.input(
+            'structure',
+            valid_type=StructureData,
+            help='The structure relaxed in vacuum and in solution.'
+        )
+        spec.expose_inputs(
+            PwRelaxWorkChain,
+            namespace='vacuum',
+            exclude=(
+                'clean_workdir',
+                'structure',
+                'parent_folder'
+            ),
+            namespace_options={
+                'help': (
+                    'Inputs for the `PwRelaxWorkChain` of the relaxation '
+                    'in vacuum.'
+                )
+            }
+        )
         spec.expose_inputs(
             PwRelaxWorkChain,
+            namespace='solution',
             exclude=(
-                'base',
-                'base_final_scf'
+                'clean_workdir',
+                'structure',
+                'parent_folder'
             ),
             namespace_options={
                 'help': (
-                    'Inputs for the `PwRelaxWorkChain` that are shared in '
-                    'both vacuum and solution calculations.'
+                    'Inputs for the `PwRelaxWorkChain` of the relaxation '
+                    'in solution.'
                 )
             }
         )
@@ -68,6 +90,7 @@ class EnvRelaxPhononWorkChain(WorkChain, ProtocolMixin):
                 'supercell_matrix',
                 'displacement_generator',
                 'phonopy',
+                'thermal_parameters',
                 'settings',
                 'clean_workdir'
             ),
@@ -101,6 +124,26 @@ class EnvRelaxPhononWorkChain(WorkChain, ProtocolMixin):
                 'be cleaned at the end of execution.'
             )
         )
+        spec.input(
+            'relax_mode',
+            valid_type=orm.Str,
+            default=lambda: orm.Str('auto'),
+            help=(
+                'How the solution relaxation is run: `parallel` starts it from the input structure together '
+                'with the vacuum relaxation, `restart` starts it from the relaxed vacuum structure and '
+                'converged density, and `auto` chooses with `parallel_relax_max_atoms`.'
+            )
+        )
+        spec.input(
+            'parallel_relax_max_atoms',
+            valid_type=orm.Int,
+            default=lambda: orm.Int(20),
+            help=(
+                'Largest number of atoms for which `auto` runs the relaxations in parallel. Larger molecules '
+                'are restarted from vacuum, where the warm start saves more than the wall time of running '
+                'both at once.'
+            )
+        )
         spec.input(
             'clean_phonon_workdir',
             valid_type=orm.Bool,
@@ -114,11 +157,16 @@ class EnvRelaxPhononWorkChain(WorkChain, ProtocolMixin):
         spec.outline(
             cls.setup,
 
-            cls.run_vacuum,
-            cls.check_vacuum,
+            if_(cls.should_relax_in_parallel)(
+                cls.run_vacuum_solution,
+                cls.check_vacuum_solution,
+            ).else_(
+                cls.run_vacuum,
+                cls.check_vacuum,
 
-            cls.run_solution,
-            cls.check_solution,
+                cls.run_solution,
+                cls.check_solution,
+            ),
 
             cls.run_environ_phonon,
             cls.check_environ_phonon,
@@ -154,6 +202,11 @@ class EnvRelaxPhononWorkChain(WorkChain, ProtocolMixin):
             'ERROR_ENVIRON_PHONON_CALCULATION_FAILED',
             message='The solution phonon PhononWorkChain failed '
         )
+        spec.exit_code(
+            406,
+            'ERROR_INVALID_RELAX_MODE',
+            message='the `relax_mode` is not one of `auto`, `parallel` or `restart`'
+        )
 
 
         #TODO add options for separately controlling the resources used 
@@ -243,10 +296,9 @@ class EnvRelaxPhononWorkChain(WorkChain, ProtocolMixin):
             **kwargs,
             clean_workdir=orm.Bool(True),
         )
-        vacuum["base"]["pw"].pop("structure", None)
-        vacuum.pop("clean_workdir", None)
-        solution["base"]["pw"].pop("structure", None)
-        solution.pop("clean_workdir", None)
+        for relax in (vacuum, solution):
+            relax.pop("structure", None)
+            relax.pop("clean_workdir", None)
 
         # Declare the environ.in file input
         environ_input = {
@@ -271,39 +323,75 @@ class EnvRelaxPhononWorkChain(WorkChain, ProtocolMixin):
         }
 
         solution['base']['pw']['environ_parameters'] = orm.Dict(dict=environ_input)
-        phonopy_solution['scf']['environ_parameters'] = orm.Dict(dict=environ_input)
         environ_input['ENVIRON']['env_static_permittivity'] = 1.0
         environ_input['ENVIRON']['env_pressure'] = 0.0
         environ_input['ENVIRON']['env_surface_tension'] = 0.0
         environ_input['ELECTROSTATIC']['solver'] = 'direct'
         vacuum['base']['pw']['environ_parameters'] = orm.Dict(dict=environ_input)
 
-        builder.code = code
-        builder.phonopy_code = phonopy_code
         builder.vacuum = vacuum
         builder.solution = solution
-        builder.phonopy_solution = phonopy_solution
+        if 'phonopy' in phonopy_solution:
+            builder.phonon.phonopy = phonopy_solution.phonopy
+        builder.phonon.settings = phonopy_solution.settings
         builder.structure = structure
         builder.clean_workdir = orm.Bool(clean_workdir)
         builder.clean_phonon_workdir = orm.Bool(clean_phonon_workdir)
-        builder.pseudo_family = orm.Str(pseudo_family)
         return builder
 
     def setup(self):
         """Input validation and context setup."""
-        self.ctx.pwrelax_input = AttributeDict(
-            self.exposed_inputs(
-                PwRelaxWorkChain,
-            )
-        )
+        self.ctx.current_structure = self.inputs.structure
+
+        relax_mode = self.inputs.relax_mode.value
+        if relax_mode not in ('auto', 'parallel', 'restart'):
+            return self.exit_codes.ERROR_INVALID_RELAX_MODE
+        if relax_mode == 'auto':
+            natoms = len(self.inputs.structure.sites)
+            if natoms <= self.inputs.parallel_relax_max_atoms.value:
+                relax_mode = 'parallel'
+            else:
+                relax_mode = 'restart'
+            self.report(f'relaxing {natoms} atoms in `{relax_mode}` mode')
+        self.ctx.relax_mode = relax_mode
+        return
+
+    def _get_relax_inputs(self, environment, parent_folder=None):
+        """
+        Return the relaxation inputs of an environment, starting from the current structure
+        and optionally restarting from the density of `parent_folder`.
+        """
+        inputs = AttributeDict(self.exposed_inputs(PwRelaxWorkChain, namespace=environment))
+        inputs.structure = self.ctx.current_structure
+        inputs.clean_workdir = self.inputs.clean_workdir
+        if parent_folder is not None:
+            inputs.parent_folder = parent_folder
+        return inputs
+
+    def should_relax_in_parallel(self):
+        return self.ctx.relax_mode == 'parallel'
+
+    def run_vacuum_solution(self):
+        """
+        Run the vacuum and solution relaxations at once, both from the input structure.
+        """
+        self.run_vacuum()
+        self.run_solution()
         return
 
+    def check_vacuum_solution(self):
+        """
+        Inspect output of vacuum and solution simulations.
+        """
+        vacuum_exit_code = self.check_vacuum()
+        solution_exit_code = self.check_solution()
+        return vacuum_exit_code or solution_exit_code
+
     def run_vacuum(self):
         """
         Run vacuum environment relaxation.
         """
-        inputs = self.ctx.pwrelax_input
-        inputs.base.pw.environ_parameters = self.inputs.vacuum.environ_parameters
+        inputs = self._get_relax_inputs('vacuum')
 
         # inputs.metadata.call_link_label = f'vacuum_scf'
         self.ctx.vacuum_scf = inputs
@@ -334,13 +422,14 @@ class EnvRelaxPhononWorkChain(WorkChain, ProtocolMixin):
                 self.exposed_outputs(
                     self.ctx.vacuum.scf, 
                     PwRelaxWorkChain, 
-                    namespace='vacuum.scf', 
+                    namespace='environ.vacuum', 
                     agglomerate=False
                 )
             )
         
-        self.ctx.current_structure = workchain.output.output_structure
-        self.ctx.vacuum_structure = workchain.output.output_structure
+        self.ctx.vacuum_structure = workchain.outputs.output_structure
+        if self.ctx.relax_mode == 'restart':
+            self.ctx.current_structure = workchain.outputs.output_structure
 
         return
 
@@ -348,9 +437,10 @@ class EnvRelaxPhononWorkChain(WorkChain, ProtocolMixin):
         """
         Run solution environment simulations for all structures.
         """
-        inputs = self.ctx.pwrelax_input
-        inputs.base.pw.environ_parameters = self.inputs.solution.environ_parameters
-        inputs.base.pw.structure = self.ctx.current_structure
+        parent_folder = None
+        if self.ctx.relax_mode == 'restart':
+            parent_folder = self.ctx.vacuum.scf.outputs.remote_folder
+        inputs = self._get_relax_inputs('solution', parent_folder)
 
         # inputs.metadata.call_link_label = f'CALL'
         self.ctx.solution_scf = inputs
@@ -376,7 +466,7 @@ class EnvRelaxPhononWorkChain(WorkChain, ProtocolMixin):
             return self.exit_codes.ERROR_ENVIRON_SOLUTION_CALCULATION_FAILED
         else:
             self.report('Solution optimization finished')
-            self.out_many(self.exposed_outputs(self.ctx.solution.scf, PwRelaxWorkChain, namespace='solution.scf', agglomerate=False))
+            self.out_many(self.exposed_outputs(self.ctx.solution.scf, PwRelaxWorkChain, namespace='environ.solution', agglomerate=False))
 
         return
 
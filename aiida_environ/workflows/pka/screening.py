@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Workchain to screen the pKa of many conjugate acid base pairs
+"""
+from aiida import orm
+from aiida.common import AttributeDict
+from aiida.common.links import LinkType
+from aiida.engine import WorkChain, append_, while_
+from aiida_quantumespresso.common.types import RelaxType
+from aiida_quantumespresso.workflows.protocols.utils import ProtocolMixin
+from aiida.orm import StructureData
+
+from aiida_environ.calculations.thermochemistry import collect_pka_table
+from aiida_environ.utils.cache import get_content_hash
+from aiida_environ.workflows.pw.pka import pKaWorkChain, validate_inputs
+
+
+def validate_pka(inputs, ctx):
+    """Validate the `pka` namespace, the species are always run in solution only and post-processed in process."""
+    return validate_inputs({**inputs, 'solution_only': orm.Bool(True), 'phonopy_in_process': orm.Bool(True)}, ctx)
+
+
+class pKaScreeningWorkChain(WorkChain, ProtocolMixin):
+    """
+    Workchain to screen the pKa of a library of conjugate acid base pairs
+
+    Identical species, e.g. a conjugate base shared by several pairs, are only calculated once. The unique species
+    are run by `pKaWorkChain` in batches of at most `batch_size`, one batch at a time, so the number of concurrent
+    calculations is bounded for the whole screening. The results are collected in a single pKa table.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        """Define the process specification."""
+        # yapf: disable
+        super().define(spec)
+
+        spec.expose_inputs(
+            pKaWorkChain,
+            namespace='pka',
+            exclude=(
+                'vacuum', 'structures', 'partial_hessian', 'solution_only', 'phonopy_in_process', 'clean_workdir'
+            ),
+            namespace_options={
+                'validator': validate_pka,
+                'help': ('Inputs for the `pKaWorkChain` shared by all the species, which are only calculated in '
+                         'solution since the pKa table only needs the solution free energies.')
+            }
+        )
+        spec.input_namespace(
+            'structures',
+            valid_type=StructureData,
+            dynamic=True,
+            help='Structures of the acids and bases, by label.'
+        )
+        spec.input(
+            'pairs',
+            valid_type=orm.List,
+            help='Pairs of acid and base labels in `structures`, one row of the pKa table each.'
+        )
+        spec.input(
+            'batch_size',
+            valid_type=orm.Int,
+            default=lambda: orm.Int(10),
+            help='Largest number of species calculated at the same time, 0 calculates all of them at once.'
+        )
+        spec.input(
+            'proton_free_energy',
+            valid_type=orm.Float,
+            default=lambda: orm.Float(-11.72),
+            help=('Free energy in eV of the solvated proton, including the standard state correction, '
+                  'the default is -270.3 kcal/mol.')
+        )
+        spec.input(
+            'clean_workdir',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help=('If `True`, work directories of all called calculation '
+                  'will be cleaned at the end of execution.')
+        )
+
+        spec.outline(
+            cls.setup,
+            while_(cls.has_remaining_species)(
+                cls.run_batch,
+                cls.inspect_batch,
+            ),
+            cls.results,
+        )
+
+        spec.output(
+            'pka_table',
+            valid_type=orm.ArrayData,
+            help='Energies, free energies of deprotonation and pKa of all the pairs, see `collect_pka_table`.'
+        )
+
+        spec.exit_code(
+            401,
+            'ERROR_INVALID_PAIRS',
+            message='the pairs are not valid: {message}'
+        )
+        spec.exit_code(
+            402,
+            'ERROR_ALL_BATCHES_FAILED',
+            message='no species was calculated successfully'
+        )
+
+    @classmethod
+    def get_builder_from_protocol(
+            cls,
+            code: orm.Code,
+            structures: dict,
+            pairs: list,
+            protocol: orm.Dict = None,
+            overrides: orm.Dict = None,
+            relax_type=RelaxType.POSITIONS,
+            pseudo_family='SSSP/1.1/PBE/precision',
+            clean_workdir: bool = False,
+            **kwargs,
+    ):
+        """
+        Return a builder prepopulated with inputs selected according to the chosen protocol.
+
+        The protocol is resolved once, for the first structure, and shared by all the species.
+
+        :param code: the ``Code`` instance configured for the ``quantumespresso.pw`` plugin.
+        :param structures: the ``StructureData`` of the acids and bases, by label.
+        :param pairs: the pairs of acid and base labels.
+        :param protocol: protocol to use, if not specified, the default will be used.
+        :param overrides: optional dictionary of inputs to override the defaults of the protocol.
+        :param relax_type: the relax type to use: should be a value of the enum ``common.types.RelaxType``.
+        :param kwargs: additional keyword arguments that will be passed to the ``get_builder_from_protocol`` of all the
+            sub processes that are called by this workchain.
+        :return: a process builder instance with all inputs defined ready for launch.
+        """
+        pka = pKaWorkChain.get_builder_from_protocol(
+            code=code,
+            phonopy_code=None,
+            structures=structures,
+            protocol=protocol,
+            overrides=overrides,
+            relax_type=relax_type,
+            pseudo_family=pseudo_family,
+            clean_workdir=clean_workdir,
+            **kwargs
+        )
+        for name in ('vacuum', 'structures', 'phonopy_code', 'clean_workdir'):
+            pka.pop(name, None)
+
+        builder = cls.get_builder()
+        builder.pka = pka
+        builder.structures = structures
+        builder.pairs = orm.List(list=[list(pair) for pair in pairs])
+        builder.clean_workdir = orm.Bool(clean_workdir)
+        return builder
+
+    def setup(self):
+        """Input validation, and deduplication of the species."""
+        pairs = self.inputs.pairs.get_list()
+        for pair in pairs:
+            if len(pair) != 2:
+                return self.exit_codes.ERROR_INVALID_PAIRS.format(message=f'{pair} is not an acid and a base')
+            for label in pair:
+                if label not in self.inputs.structures:
+                    return self.exit_codes.ERROR_INVALID_PAIRS.format(message=f'`{label}` is not in `structures`')
+
+        # every label points to the first label with the same structure
+        representatives = {}
+        self.ctx.representatives = {}
+        for label in dict.fromkeys(label for pair in pairs for label in pair):
+            content_hash = get_content_hash(self.inputs.structures[label])
+            self.ctx.representatives[label] = representatives.setdefault(content_hash, label)
+
+        self.ctx.remaining = list(dict.fromkeys(self.ctx.representatives.values()))
+        self.ctx.calculations = {}
+        self.report(
+            f'{len(pairs)} pairs with {len(self.ctx.representatives)} species, '
+            f'{len(self.ctx.remaining)} of which are unique'
+        )
+        return
+
+    def has_remaining_species(self):
+        """Check if there are any species left to calculate."""
+        return len(self.ctx.remaining) > 0
+
+    def run_batch(self):
+        """Run the next batch of species in a single `pKaWorkChain`."""
+        batch_size = self.inputs.batch_size.value or len(self.ctx.remaining)
+        batch = self.ctx.remaining[:batch_size]
+        self.ctx.remaining = self.ctx.remaining[len(batch):]
+
+        inputs = AttributeDict(self.exposed_inputs(pKaWorkChain, namespace='pka'))
+        inputs.structures = {label: self.inputs.structures[label] for label in batch}
+        inputs.solution_only = orm.Bool(True)
+        inputs.phonopy_in_process = orm.Bool(True)
+        inputs.clean_workdir = self.inputs.clean_workdir
+        inputs.metadata.call_link_label = f'batch_{len(self.ctx.get("batches", []))}'
+
+        future = self.submit(pKaWorkChain, **inputs)
+        self.report(f'submitting `pKaWorkChain` <PK={future.pk}> for {len(batch)} species.')
+        self.to_context(batches=append_(future))
+        return
+
+    def inspect_batch(self):
+        """Record the solution relaxation and thermal properties of each species of the last batch."""
+        workchain = self.ctx.batches[-1]
+
+        if not workchain.is_finished_ok:
+            self.report(
+                f'`pKaWorkChain` with <PK={workchain.pk}> failed with exit status {workchain.exit_status}, '
+                'its species are left out of the table'
+            )
+            return
+
+        called = {
+            link.link_label: link.node
+            for link in workchain.base.links.get_outgoing(link_type=LinkType.CALL_WORK).all()
+        }
+        for label in workchain.inputs.structures:
+            self.ctx.calculations[label] = {
+                'relax': called[f'solution_{label}'].pk,
+                'thermal_properties': workchain.outputs.thermal_properties.solution[label].pk,
+            }
+        return
+
+    def results(self):
+        """Collect the pKa of all the pairs in a single table."""
+        if not self.ctx.calculations:
+            return self.exit_codes.ERROR_ALL_BATCHES_FAILED
+
+        species = {
+            label: self.ctx.calculations[representative]
+            for label, representative in self.ctx.representatives.items()
+            if representative in self.ctx.calculations
+        }
+        calculations = orm.Dict(dict={'pairs': self.inputs.pairs.get_list(), 'species': species})
+        settings = orm.Dict(dict={'proton_free_energy': self.inputs.proton_free_energy.value})
+
+        self.out('pka_table', collect_pka_table(calculations, settings))
+        return
@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
 import random
 
-from aiida.engine import WorkChain
+import numpy as np
+from aiida.engine import ToContext, WorkChain, append_, if_, while_
 from aiida.orm import Dict, List, StructureData
 
-from aiida_environ.calculations.finite import calculate_finite_differences
+from aiida_environ.calculations.finite import (
+    calculate_extrapolated_finite_differences,
+    calculate_finite_differences,
+    calculate_projected_finite_differences,
+    get_extrapolated_derivatives,
+)
+from aiida_environ.utils.finite import DIFF_ORDERS, get_default_accuracy, get_stencil
+from aiida_environ.utils.results import load_output_arrays, load_output_parameters
+from aiida_environ.utils.structure import StructureFactory
 
 from aiida_environ.workflows.pw.base import EnvPwBaseWorkChain
 
@@ -39,6 +48,20 @@ class EnvPwForceTestWorkChain(WorkChain):
 
     Outputs:
     results:                    aiida.orm.Dict
+
+    The unperturbed structure is run first. Unless `warm_start` is False, the perturbed
+    calculations restart from its converged density, wavefunctions and Environ quantities.
+
+    With `force_mode` set to 'projected', several atoms (`atoms_to_perturb`) are displaced along
+    several `directions` by multiples of `step_size` in one batch, all restarting from the same
+    reference. The finite differences are compared to the per-atom forces projected onto each
+    direction.
+
+    With `force_mode` set to 'adaptive', the same atoms and directions are displaced by plus and
+    minus a step that is halved at each level, and the central differences are extrapolated to
+    zero step with Richardson extrapolation. The first step is chosen so that the SCF noise, the
+    `energy_accuracy` of the reference, stays below `force_tolerance`, and no further levels are
+    launched once the error estimate is below `force_tolerance`.
     """
 
     types = ("forward", "backward", "central")  # finite difference type tuple
@@ -68,8 +91,32 @@ class EnvPwForceTestWorkChain(WorkChain):
 
         spec.outline(
             cls.setup,
-            cls.run_test,
-            cls.get_results,
+            if_(cls.should_project)(
+                cls.run_reference,
+                cls.run_displacements,
+                cls.get_projected_results,
+            ).elif_(cls.should_adapt)(
+                cls.run_reference,
+                cls.setup_adaptive,
+                while_(cls.should_run_level)(
+                    cls.run_level,
+                ),
+                cls.get_extrapolated_results,
+            ).else_(
+                cls.run_reference,
+                cls.run_test,
+                cls.get_results,
+            ),
+        )
+        spec.exit_code(
+            300,
+            "ERROR_REFERENCE_FAILED",
+            message="the reference calculation did not finish successfully",
+        )
+        spec.exit_code(
+            301,
+            "ERROR_PERTURBED_FAILED",
+            message="one of the perturbed calculations did not finish successfully",
         )
 
     def setup(self):
@@ -85,6 +132,26 @@ class EnvPwForceTestWorkChain(WorkChain):
         settings_dict.setdefault("atom_to_perturb", wild)
         settings_dict.setdefault("n_steps", 5)
         settings_dict.setdefault("step_sizes", [0.1, 0.0, 0.0])
+        settings_dict.setdefault(
+            "accuracy", get_default_accuracy(settings_dict["diff_type"])
+        )
+        settings_dict.setdefault("force_mode", "total")
+        settings_dict.setdefault("warm_start", True)
+        if settings_dict["force_mode"] == "adaptive":
+            settings_dict.setdefault("force_tolerance", 1e-3)
+            settings_dict.setdefault("max_levels", 4)
+            settings_dict.setdefault("step_size", 0.04)
+        if settings_dict["force_mode"] in ("projected", "adaptive"):
+            settings_dict.setdefault(
+                "atoms_to_perturb", [settings_dict["atom_to_perturb"]]
+            )
+            settings_dict.setdefault(
+                "directions", [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]
+            )
+            settings_dict.setdefault(
+                "step_size",
+                sum([dh**2 for dh in settings_dict["step_sizes"]]) ** 0.5,
+            )
 
         # validate inputs
         self._validate_diff_type()
@@ -92,46 +159,243 @@ class EnvPwForceTestWorkChain(WorkChain):
         self._validate_atom_to_perturb(natoms)
         self._validate_n_steps(settings_dict["n_steps"])
         self._validate_step_sizes()
+        self._validate_projection(settings_dict, natoms)
+        self._validate_accuracy(settings_dict)
 
         self.inputs.test_settings = Dict(dict=settings_dict)
+        self.ctx.settings = settings_dict
+
+    def should_project(self):
+        """Returns whether to compare with the projected per-atom forces."""
+
+        return self.ctx.settings["force_mode"] == "projected"
+
+    def should_adapt(self):
+        """Returns whether to choose the steps adaptively and extrapolate."""
+
+        return self.ctx.settings["force_mode"] == "adaptive"
+
+    def setup_adaptive(self):
+        """Chooses the first step and the smallest useful step from the SCF noise of the reference."""
+
+        if not self.ctx.reference.is_finished_ok:
+            return self.exit_codes.ERROR_REFERENCE_FAILED
+
+        settings = self.ctx.settings
+        reference = self.ctx.reference.pk
+        noise = load_output_parameters([reference], ["energy_accuracy"])["energy_accuracy"][0]
+        if np.isnan(noise):
+            noise = load_output_arrays([reference], "scf_accuracy")[0]
+        noise = abs(float(noise))
+
+        # below this step the noise error of a central difference, noise / step, exceeds half the tolerance
+        self.ctx.min_step = 2 * noise / settings["force_tolerance"]
+        step = max(settings["step_size"], 4 * self.ctx.min_step)
+        self.report(
+            f"SCF noise = {noise:.2e} eV, first step = {step:.4f}, smallest step = {self.ctx.min_step:.4f}"
+        )
+
+        self.ctx.displacements = []
+        for atom in settings["atoms_to_perturb"]:
+            for direction in settings["directions"]:
+                unit = np.array(direction, dtype=float)
+                unit /= np.linalg.norm(unit)
+                self.ctx.displacements.append(
+                    {
+                        "atom": atom,
+                        "direction": unit.tolist(),
+                        "reference": reference,
+                        "steps": [],
+                        "pks": [],
+                    }
+                )
+        self.ctx.step = step
+
+    def should_run_level(self):
+        """Returns whether to launch a further level of smaller steps."""
+
+        levels = len(self.ctx.displacements[0]["steps"])
+        if levels < 2:
+            return True
+
+        for workchain in self.ctx.perturbed:
+            if not workchain.is_finished_ok:
+                self.report(f"EnvPwBaseWorkChain<{workchain.pk}> failed")
+                return False
+
+        _, _, errors = get_extrapolated_derivatives(self.ctx.displacements)
+        error = float(np.max(errors))
+        self.report(f"level {levels}: step = {self.ctx.displacements[0]['steps'][-1]:.4f}, error estimate = {error:.2e}")
+
+        if error < self.ctx.settings["force_tolerance"]:
+            self.report("error estimate converged")
+            return False
+        if levels >= self.ctx.settings["max_levels"]:
+            self.report("reached the maximum number of levels")
+            return False
+        if self.ctx.step < self.ctx.min_step:
+            self.report("next step is dominated by the SCF noise")
+            return False
+
+        return True
+
+    def run_level(self):
+        """Launches the calculations at plus and minus the current step for every displacement."""
+
+        step = self.ctx.step
+        factory = StructureFactory(self.inputs.structure)
+
+        for displacement in self.ctx.displacements:
+            unit = np.array(displacement["direction"])
+            pks = []
+            for sign in (-1, 1):
+                inputs = self._get_base_inputs(
+                    f"Perturbed structure | Atom {displacement['atom']} d{unit.round(3).tolist()} = {sign * step:.4f}"
+                )
+                inputs["pw"]["structure"] = factory.displace(
+                    displacement["atom"] - 1, sign * step * unit
+                )
+                if self.ctx.settings["warm_start"]:
+                    self._set_restart(inputs, self.ctx.reference)
+                running = self.submit(EnvPwBaseWorkChain, **inputs)
+                pks.append(running.pk)
+                self.to_context(perturbed=append_(running))
+            displacement["steps"].append(step)
+            displacement["pks"].append(pks)
+
+        self.ctx.step = step / 2
+
+    def get_extrapolated_results(self):
+        """Extrapolates the finite differences and compares them to the projected forces."""
+
+        for workchain in self.ctx.perturbed:
+            if not workchain.is_finished_ok:
+                return self.exit_codes.ERROR_PERTURBED_FAILED
+
+        results = calculate_extrapolated_finite_differences(
+            List(list=self.ctx.displacements), Dict(dict=self.ctx.settings)
+        )
+
+        self.out("results", results)
+
+    def run_reference(self):
+        """Runs the calculation of the unperturbed structure, the reference of all perturbed calculations."""
+
+        inputs = self._get_base_inputs("Initial structure")
+        inputs["pw"]["structure"] = self.inputs.structure
+        inputs["metadata"]["call_link_label"] = "reference"
+        running = self.submit(EnvPwBaseWorkChain, **inputs)
+        self.report(f"launching reference EnvPwBaseWorkChain<{running.pk}>")
+
+        return ToContext(reference=running)
+
+    def run_displacements(self):
+        """Runs the displaced calculations of all atoms and directions, restarting from the reference."""
+
+        if not self.ctx.reference.is_finished_ok:
+            return self.exit_codes.ERROR_REFERENCE_FAILED
+
+        settings = self.ctx.settings
+        step = settings["step_size"]
+        n = settings["n_steps"]
+        factory = StructureFactory(self.inputs.structure)
+
+        if settings["diff_type"] == "central":
+            offsets = list(range(-n, n + 1))
+        elif settings["diff_type"] == "forward":
+            offsets = list(range(n + 1))
+        else:
+            offsets = list(range(-n, 1))
+
+        self.ctx.displacements = []
+        for atom in settings["atoms_to_perturb"]:
+            for direction in settings["directions"]:
+                unit = np.array(direction, dtype=float)
+                unit /= np.linalg.norm(unit)
+                pks = []
+                for offset in offsets:
+                    if offset == 0:
+                        pks.append(self.ctx.reference.pk)
+                        continue
+                    inputs = self._get_base_inputs(
+                        f"Perturbed structure | Atom {atom} d{unit.round(3).tolist()} = {offset * step:.2f}"
+                    )
+                    inputs["pw"]["structure"] = factory.displace(
+                        atom - 1, offset * step * unit
+                    )
+                    if settings["warm_start"]:
+                        self._set_restart(inputs, self.ctx.reference)
+                    running = self.submit(EnvPwBaseWorkChain, **inputs)
+                    pks.append(running.pk)
+                    self.to_context(displaced=append_(running))
+
+                self.ctx.displacements.append(
+                    {
+                        "atom": atom,
+                        "direction": unit.tolist(),
+                        "step": step,
+                        "offsets": offsets,
+                        "pks": pks,
+                    }
+                )
+
+        self.report(
+            f"launched {len(offsets) - 1} displaced calculations for each of {len(self.ctx.displacements)} displacements"
+        )
+
+    def get_projected_results(self):
+        """Calculates finite differences along each displacement and compares them to the projected forces."""
+
+        results = calculate_projected_finite_differences(
+            List(list=self.ctx.displacements), Dict(dict=self.ctx.settings)
+        )
+
+        self.out("results", results)
+
+    @staticmethod
+    def _set_restart(inputs: dict, reference):
+        """Starts a calculation from the converged density, wavefunctions and Environ quantities of the reference."""
+
+        parameters = inputs["pw"]["parameters"].get_dict()
+        parameters.setdefault("ELECTRONS", {})["startingpot"] = "file"
+        parameters["ELECTRONS"]["startingwfc"] = "file"
+        inputs["pw"]["parameters"] = Dict(dict=parameters)
+
+        environ_parameters = inputs["pw"]["environ_parameters"].get_dict()
+        environ_parameters.setdefault("ENVIRON", {})["environ_restart"] = True
+        inputs["pw"]["environ_parameters"] = Dict(dict=environ_parameters)
+
+        inputs["pw"]["parent_folder"] = reference.outputs.remote_folder
 
     def run_test(self):
-        """Calculates energy and total force for selected atom at initial position and perturbed positions."""
+        """Calculates energy and total force for selected atom at perturbed positions."""
+
+        if not self.ctx.reference.is_finished_ok:
+            return self.exit_codes.ERROR_REFERENCE_FAILED
 
         # local variable block
-        diff_order = self.inputs.test_settings["diff_order"]
-        diff_type = self.inputs.test_settings["diff_type"]
-        steps = self.inputs.test_settings["step_sizes"]
+        diff_order = self.ctx.settings["diff_order"]
+        diff_type = self.ctx.settings["diff_type"]
+        steps = self.ctx.settings["step_sizes"]
         n = (
-            self.inputs.test_settings["n_steps"] + 1
+            self.ctx.settings["n_steps"] + 1
         )  # initial position + n-perturbations
-        prefix = f"atom{self.atom}"
-
-        # context variable block
-        self.ctx.cell = self.inputs.structure.cell
-        self.ctx.edge = self.inputs.structure.cell_lengths[self.atom]
-        self.ctx.sites = self.inputs.structure.sites
-        self.ctx.initial_position = self.ctx.sites[self.atom].position
 
         # central difference requires half-step increments
         if diff_type == "central" and diff_order == "first":
             n *= 2
-            step = sum([(dh / 2) ** 2 for dh in steps]) ** 0.5
-        else:
-            step = sum([dh**2 for dh in steps]) ** 0.5
-
-        # submit calculations
-        for i in range(n):
-            chain_name = f"{prefix}.{self.ctx.axstr}.{i}"
-            inputs = self._prepare_inputs(i, i * step)
+            steps = [dh / 2 for dh in steps]
+        step = sum([dh**2 for dh in steps]) ** 0.5
+
+        # submit calculations, the initial position is the reference
+        self.ctx.environ_chain_list = [self.ctx.reference.pk]
+        for i in range(1, n):
+            inputs = self._prepare_inputs(i, i * step, steps)
+            if self.ctx.settings["warm_start"]:
+                self._set_restart(inputs, self.ctx.reference)
             env_chain = self.submit(EnvPwBaseWorkChain, **inputs)
-            self.to_context(**{chain_name: env_chain})
-
-        # collect the WorkChains
-        self.ctx.environ_chain_list = []
-        for k in range(n):
-            name = f"{prefix}.{self.ctx.axstr}.{k}"
-            self.ctx.environ_chain_list.append(self.ctx[name].pk)
+            self.ctx.environ_chain_list.append(env_chain.pk)
+            self.to_context(perturbed=append_(env_chain))
 
     def get_results(self):
 
@@ -145,12 +409,12 @@ class EnvPwForceTestWorkChain(WorkChain):
         """
 
         results = calculate_finite_differences(
-            List(list=self.ctx.environ_chain_list), self.inputs.test_settings
+            List(list=self.ctx.environ_chain_list), Dict(dict=self.ctx.settings)
         )
 
         self.out("results", results)
 
-    def _prepare_inputs(self, i: int, dr: float) -> dict:
+    def _prepare_inputs(self, i: int, dr: float, steps: list) -> dict:
         """Returns dictionary of inputs ready for Process submission."""
 
         if i == 0:
@@ -158,7 +422,21 @@ class EnvPwForceTestWorkChain(WorkChain):
         else:
             which = "Perturbed"
 
-        inputs = {
+        inputs = self._get_base_inputs(
+            f"{which} structure | Atom {self.ctx.atom+1} d{self.ctx.axstr} = {dr:.2f}"
+        )
+
+        if i == 0:
+            inputs["pw"]["structure"] = self.inputs.structure
+        else:
+            inputs["pw"]["structure"] = self._perturb_atom(i=i, steps=steps)
+
+        return inputs
+
+    def _get_base_inputs(self, description: str) -> dict:
+        """Returns dictionary of inputs shared by all calculations, without the structure."""
+
+        return {
             "pw": {
                 "code": self.inputs.base.pw.code,
                 "pseudos": self.inputs.base.pw.pseudos,
@@ -171,59 +449,33 @@ class EnvPwForceTestWorkChain(WorkChain):
                 },
             },
             "metadata": {
-                "description": f"{which} structure | Atom {self.atom+1} d{self.ctx.axstr} = {dr:.2f}",
+                "description": description,
             },
             "kpoints": self.inputs.base.kpoints,
         }
 
-        if i == 0:
-            inputs["pw"]["structure"] = self.inputs.structure
-        else:
-            inputs["pw"]["structure"] = self._perturb_atom(
-                i=i, steps=self.inputs.test_settings["step_sizes"]
-            )
-
-        return inputs
-
     def _perturb_atom(self, i: int, steps: list) -> StructureData:
         """Returns StructureData with updated position."""
 
-        new_position = [0.0, 0.0, 0.0]
+        structure = self.inputs.structure
+        displacement = [i * dh for dh in steps]
 
         # update position tuple
         for j in range(3):
 
             if steps[j] != 0.0:
 
-                new_position[j] = self.ctx.initial_position[j] + i * steps[j]
+                edge = structure.cell_lengths[j]
+                new_position = structure.sites[self.ctx.atom].position[j] + displacement[j]
 
-                if (self.ctx.edge - new_position[j]) > 0.001:
+                if (edge - new_position) > 0.001:
                     continue
                 else:
                     raise Exception(
                         "\nNew atom_to_perturb position appears to be outside cell bounds. Stopping."
                     )
 
-            else:
-                new_position[j] = self.ctx.initial_position[j]
-
-        new_structure = StructureData(cell=self.ctx.cell)  # NEW STRUCTURE HAS
-
-        # TODO index existing StructureData for one-to-one Site replacement? or use array?
-        for k in range(len(self.ctx.sites)):
-
-            if k == self.atom:
-                new_structure.append_atom(
-                    position=new_position, symbols=self.ctx.sites[k].kind_name
-                )
-
-            else:
-                new_structure.append_atom(
-                    position=self.ctx.sites[k].position,
-                    symbols=self.ctx.sites[k].kind_name,
-                )
-
-        return new_structure
+        return StructureFactory(structure).displace(self.ctx.atom, displacement)
 
     def _validate_diff_type(self):
         """Validate finite difference type input."""
@@ -298,7 +550,29 @@ class EnvPwForceTestWorkChain(WorkChain):
                 "\nAtom index must be greater than zero and less than number of atoms."
             )
 
-        self.atom = atom - 1
+        self.ctx.atom = atom - 1
+
+    def _validate_projection(self, settings, nat):
+        """Validates the atoms and directions of the projected force mode."""
+
+        if settings["force_mode"] not in ("total", "projected", "adaptive"):
+            raise Exception("\nforce_mode must be 'total', 'projected' or 'adaptive'")
+
+        if settings["force_mode"] == "adaptive" and settings["max_levels"] < 2:
+            raise Exception("\nmax_levels must be at least 2 to extrapolate")
+
+        if settings["force_mode"] == "total":
+            return
+
+        for atom in settings["atoms_to_perturb"]:
+            if not isinstance(atom, int) or atom < 1 or atom > nat:
+                raise Exception(
+                    "\nAtom indices must be greater than zero and less than number of atoms."
+                )
+
+        for direction in settings["directions"]:
+            if len(direction) != 3 or not any(direction):
+                raise Exception("\nDirections must be non-zero vectors of 3 floats")
 
     def _validate_n_steps(self, n):
         """Validates total number of steps input."""
@@ -313,3 +587,36 @@ class EnvPwForceTestWorkChain(WorkChain):
             raise Exception(
                 "\nMininum 2 steps required for second-order forward/backward finite differences."
             )
+
+    def _validate_accuracy(self, settings):
+        """Validates the stencil accuracy against the number of sampled positions."""
+
+        # the adaptive mode always uses central differences at plus and minus each step
+        if settings.get("force_mode") == "adaptive":
+            return
+
+        accuracy = settings["accuracy"]
+
+        # type validation
+        if not isinstance(accuracy, int):
+            raise Exception("\naccuracy must be an int")
+
+        try:
+            offsets, _ = get_stencil(
+                DIFF_ORDERS[settings["diff_order"]], settings["diff_type"], accuracy
+            )
+        except ValueError as exception:
+            raise Exception(f"\n{exception}")
+
+        # central first-order differences are sampled with half-step increments, or
+        # symmetrically around the reference for projected forces
+        n = settings["n_steps"] + 1
+        if settings.get("force_mode") == "projected":
+            if settings["diff_type"] == "central":
+                n = 2 * settings["n_steps"] + 1
+        elif settings["diff_type"] == "central" and settings["diff_order"] == "first":
+            n *= 2
+        if len(offsets) > n:
+            raise Exception(
+                f"\n{len(offsets)} positions are required for a stencil of accuracy {accuracy}, increase n_steps."
+            )
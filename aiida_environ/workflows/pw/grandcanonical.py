@@ -1,11 +1,10 @@
 import numpy as np
 from aiida.common import AttributeDict
-from aiida.engine import WorkChain, append_
-from aiida.orm import Dict, List, StructureData
+from aiida.engine import WorkChain, append_, while_
+from aiida.orm import ArrayData, Dict, List, StructureData
 from aiida.orm.nodes.data.upf import get_pseudos_from_structure
 from aiida.orm.utils import load_node
 from aiida.plugins import WorkflowFactory
-from aiida_quantumespresso.utils.mapping import prepare_process_inputs
 
 from aiida_environ.calculations.adsorbate.gen_supercell import (
     adsorbate_gen_supercell,
@@ -13,13 +12,36 @@ from aiida_environ.calculations.adsorbate.gen_supercell import (
 )
 from aiida_environ.calculations.adsorbate.post_supercell import adsorbate_post_supercell
 from aiida_environ.data.charge import EnvironChargeData
-from aiida_environ.utils.charge import get_charge_range
+from aiida_environ.utils.cache import find_finished_process, get_lookup_inputs
+from aiida_environ.utils.charge import get_charge_range, get_refined_charges
+from aiida_environ.utils.results import load_output_parameters
 from aiida_environ.utils.vector import get_struct_bounds
 
 EnvPwBaseWorkChain = WorkflowFactory("environ.pw.base")
 PwBaseWorkChain = WorkflowFactory("quantumespresso.pw.base")
 
 
+def _make_run(label, details, structure_pk, charge=None, charged=False, environ=True):
+    """Returns the description of a single calculation in the grand canonical matrix
+
+    Args:
+        label (str): the call link label
+        details (list): the keys under which the PK is stored in the calculation details
+        structure_pk (int): the PK of the structure
+        charge (int): the index of the charge in the charge range, None if uncharged
+        charged (bool): whether the charge is also applied to the system (`tot_charge`)
+        environ (bool): whether to run an `EnvPwBaseWorkChain` or a plain `PwBaseWorkChain`
+    """
+    return {
+        "label": label,
+        "details": details,
+        "structure": structure_pk,
+        "charge": charge,
+        "charged": charged,
+        "environ": environ,
+    }
+
+
 class AdsorbateGrandCanonical(WorkChain):
     @classmethod
     def define(cls, spec):
@@ -37,8 +59,28 @@ class AdsorbateGrandCanonical(WorkChain):
         spec.outline(
             cls.setup,
             cls.selection,
+            cls.plan,
             cls.simulate,
-            # cls.postprocessing
+            while_(cls.should_refine)(
+                cls.plan,
+                cls.simulate,
+            ),
+            cls.postprocessing,
+        )
+        spec.output(
+            "surface_energies",
+            valid_type=ArrayData,
+            help="surface energies of every coverage on a common potential grid",
+        )
+        spec.exit_code(
+            300,
+            "ERROR_SUB_PROCESS_FAILED",
+            message="one of the calculations did not finish successfully",
+        )
+        spec.exit_code(
+            400,
+            "ERROR_COST_BUDGET_EXCEEDED",
+            message="the estimated cost of the calculations exceeds the `cost_budget`",
         )
 
     def setup(self):
@@ -54,8 +96,24 @@ class AdsorbateGrandCanonical(WorkChain):
         calculation_parameters.setdefault("cell_shape_x", 2)
         calculation_parameters.setdefault("cell_shape_y", 2)
         calculation_parameters.setdefault("reflect_vacancies", True)
+        calculation_parameters.setdefault("reuse_calculations", True)
+        calculation_parameters.setdefault("adaptive_charges", False)
+        calculation_parameters.setdefault(
+            "charge_coarse_increment", calculation_parameters["charge_max"] / 2
+        )
+        calculation_parameters.setdefault("adaptive_max_iterations", 4)
         self.ctx.calculation_parameters = Dict(dict=calculation_parameters)
 
+        charge_max = calculation_parameters["charge_max"]
+        if calculation_parameters["adaptive_charges"]:
+            charge_inc = calculation_parameters["charge_coarse_increment"]
+        else:
+            charge_inc = calculation_parameters["charge_increment"]
+        self.ctx.charge_range = []
+        self.ctx.new_charges = get_charge_range(charge_max, charge_inc)
+        self.ctx.iteration = 0
+        self.ctx.cost = 0.0
+
         # TODO: check sanity of inputs
 
     def selection(self):
@@ -68,122 +126,225 @@ class AdsorbateGrandCanonical(WorkChain):
         self.ctx.num_adsorbate = d["num_adsorbate"]
         self.report(f"struct_list written: {self.ctx.struct_list}")
         self.report(f"num_adsorbate written: {self.ctx.num_adsorbate}")
+        self.ctx.adsorbate_structure = gen_hydrogen()
 
-    def simulate(self):
-        distance = self.ctx.calculation_parameters["charge_distance"]
-        axis = self.ctx.calculation_parameters["system_axis"]
-        charge_max = self.ctx.calculation_parameters["charge_max"]
-        charge_inc = self.ctx.calculation_parameters["charge_increment"]
-        charge_spread = self.ctx.calculation_parameters["charge_spread"]
-        charge_range = get_charge_range(charge_max, charge_inc)
+    def plan(self):
+        """Build the calculation matrix, find reusable calculations and check the cost budget
 
-        # TODO: maybe do this at setup and change the cell if it's too big?
-        cpos1, cpos2 = get_struct_bounds(self.inputs.mono_structure, axis)
-        # change by 5 angstrom
-        cpos1 -= distance
-        cpos2 += distance
-        npcpos1 = np.zeros(3)
-        npcpos2 = np.zeros(3)
-        npcpos1[axis - 1] = cpos1
-        npcpos2[axis - 1] = cpos2
-
-        nsims = (len(charge_range) * (len(self.ctx.struct_list) + 1)) + 1
-        self.report(f"number of simulations to run = {nsims}")
-
-        for i, charge_amt in enumerate(charge_range):
-
-            self.ctx.calculation_details[charge_amt] = {}
-
-            # loop over charges
-            charges = EnvironChargeData()
-            # get position of charge
-            charges.append_charge(
-                -charge_amt / 2, tuple(npcpos1), charge_spread, 2, axis
-            )
-            charges.append_charge(
-                -charge_amt / 2, tuple(npcpos2), charge_spread, 2, axis
-            )
+        The cost of a calculation is estimated in units of one monolayer calculation, assuming a cubic scaling with
+        the number of atoms. Calculations with identical structure, parameters, external charges, code and k-points
+        that already finished successfully are reused instead of being submitted again.
+        """
+        start = len(self.ctx.charge_range)
+        self.ctx.charge_range.extend(self.ctx.new_charges)
 
+        runs = []
+        for i, charge_amt in enumerate(self.ctx.new_charges, start):
             for j, structure_pk in enumerate(self.ctx.struct_list):
                 # regular monolayer simulation with adsorbate/charge
-                inputs = AttributeDict(
-                    self.exposed_inputs(EnvPwBaseWorkChain, namespace="base")
+                runs.append(
+                    _make_run(f"s{j}_c{i}", [charge_amt, structure_pk], structure_pk, i, True)
                 )
-                inputs.pw.parameters = inputs.pw.parameters.get_dict()
-                structure = load_node(structure_pk)
-                self.report(f"{structure}")
-                inputs.pw.structure = structure
-                inputs.pw.parameters["SYSTEM"]["tot_charge"] = charge_amt
-                inputs.pw.parameters["ELECTRONS"]["mixing_mode"] = "local-TF"
-                inputs.pw.external_charges = charges
-                inputs.pw.pseudos = get_pseudos_from_structure(structure, "SSSPe")
-                inputs.metadata.call_link_label = f"s{j}_c{i}"
-                inputs = prepare_process_inputs(EnvPwBaseWorkChain, inputs)
-                running = self.submit(EnvPwBaseWorkChain, **inputs)
-                self.report(f"<s{j}_c{i}> launching EnvPwBaseWorkChain<{running.pk}>")
-                self.ctx.calculation_details[charge_amt][structure_pk] = running.pk
-                self.to_context(workchains=append_(running))
-
             # base monolayer simulation
-            inputs = AttributeDict(
-                self.exposed_inputs(EnvPwBaseWorkChain, namespace="base")
+            runs.append(
+                _make_run(f"smono_c{i}", [charge_amt, "mono"], self.inputs.mono_structure.pk, i)
+            )
+        if start == 0:
+            # bulk simulation
+            runs.append(
+                _make_run("sbulk", ["bulk"], self.inputs.bulk_structure.pk, environ=False)
             )
-            structure = self.inputs.mono_structure
-            self.report(f"{structure}")
-            inputs.pw.structure = structure
-            inputs.pw.external_charges = charges
-            inputs.pw.pseudos = get_pseudos_from_structure(structure, "SSSPe")
-            inputs.metadata.call_link_label = f"smono_c{i}"
-            inputs = prepare_process_inputs(EnvPwBaseWorkChain, inputs)
-            running = self.submit(EnvPwBaseWorkChain, **inputs)
-            self.report(f"<smono_c{i}> launching EnvPwBaseWorkChain<{running.pk}>")
-            self.ctx.calculation_details[charge_amt]["mono"] = running.pk
+            # hydrogen simulation
+            runs.append(
+                _make_run("sads_neutral", ["adsorbate"], self.ctx.adsorbate_structure.pk, environ=False)
+            )
+
+        reference_nat = len(self.inputs.mono_structure.sites)
+        reuse = self.ctx.calculation_parameters["reuse_calculations"]
+        total_cost = 0.0
+        cost = 0.0
+
+        self.ctx.runs = []
+        for run in runs:
+            process_class, inputs = self._get_run_inputs(run)
+            run_cost = (len(inputs.pw.structure.sites) / reference_nat) ** 3
+            total_cost += run_cost
+
+            if reuse:
+                node = find_finished_process(process_class, get_lookup_inputs(inputs))
+                if node is not None:
+                    self.report(f"<{run['label']}> reusing {process_class.__name__}<{node.pk}>")
+                    self._set_calculation_details(run["details"], node.pk)
+                    continue
+
+            cost += run_cost
+            self.ctx.runs.append(run)
+
+        self.ctx.cost += cost
+        self.report(
+            f"number of simulations to run = {len(self.ctx.runs)} of {len(runs)}, "
+            f"estimated cost = {cost:.1f} of {total_cost:.1f} monolayer calculations"
+        )
+
+        budget = self.ctx.calculation_parameters.get("cost_budget", None)
+        if budget is not None and self.ctx.cost > budget:
+            self.report(f"estimated cost exceeds the cost budget of {budget}")
+            return self.exit_codes.ERROR_COST_BUDGET_EXCEEDED
+
+    def simulate(self):
+        for run in self.ctx.runs:
+            process_class, inputs = self._get_run_inputs(run)
+            running = self.submit(process_class, **inputs)
+            self.report(f"<{run['label']}> launching {process_class.__name__}<{running.pk}>")
+            self._set_calculation_details(run["details"], running.pk)
             self.to_context(workchains=append_(running))
 
-        # bulk simulation
-        inputs = AttributeDict(
-            self.exposed_inputs(EnvPwBaseWorkChain, namespace="base")
+        self.report(f"calc_details written: {self.ctx.calculation_details}")
+
+    def should_refine(self):
+        """Adds charges near the phase transitions of the surface, if the adaptive charge grid is enabled
+
+        The free energies of the finished calculations are compared over the potential range they span, and new charges
+        are only added around the potentials at which the most stable coverage changes.
+        """
+        if not self.ctx.calculation_parameters["adaptive_charges"]:
+            return False
+
+        if self.ctx.iteration >= self.ctx.calculation_parameters["adaptive_max_iterations"]:
+            self.report("reached the maximum number of charge grid refinements")
+            return False
+
+        for workchain in self.ctx.workchains:
+            if not workchain.is_finished_ok:
+                self.report(f"{workchain.process_label}<{workchain.pk}> failed, cannot refine the charge grid")
+                return False
+
+        # the bulk reference is the same for all the structures, so it does not affect the phase transitions
+        calculations = np.array(self._get_calculation_table())
+        outputs = load_output_parameters(
+            [self.ctx.calculation_details["adsorbate"]] + calculations.ravel().tolist(),
+            ["energy", "fermi_energy", "fermi_energy_correction"],
         )
-        structure = self.inputs.bulk_structure
-        self.report(f"{structure}")
-        inputs.pw.structure = structure
-        inputs.pw.pseudos = get_pseudos_from_structure(structure, "SSSPe")
-        inputs.metadata.call_link_label = "sbulk"
-        inputs.pw.metadata.options.parser_name = "quantumespresso.pw"
-        delattr(inputs.pw.metadata.options, "debug_filename")
-        delattr(inputs.pw, "environ_parameters")
-        inputs = prepare_process_inputs(PwBaseWorkChain, inputs)
-        running = self.submit(PwBaseWorkChain, **inputs)
-        self.report(f"<sbulk> launching PwBaseWorkChain<{running.pk}>")
-        self.ctx.calculation_details["bulk"] = running.pk
-        self.to_context(workchains=append_(running))
+        # TODO: this needs to be generalized for any adsorbate..
+        adsorbate_energy = outputs["energy"][0] / 2
+        free_energies = outputs["energy"][1:].reshape(calculations.shape)
+        fermi_energies = outputs["fermi_energy"][1:] + np.nan_to_num(
+            outputs["fermi_energy_correction"][1:]
+        )
+        fermi_energies = fermi_energies.reshape(calculations.shape)
 
-        # hydrogen simulation
+        self.ctx.new_charges = get_refined_charges(
+            self.ctx.charge_range,
+            free_energies,
+            fermi_energies,
+            [0] + list(self.ctx.num_adsorbate),
+            adsorbate_energy,
+            self.ctx.calculation_parameters["charge_increment"],
+        )
+        self.ctx.iteration += 1
+
+        if not self.ctx.new_charges:
+            self.report("charge grid converged around the phase transitions")
+            return False
+
+        self.report(f"refining the charge grid with charges: {self.ctx.new_charges}")
+        return True
+
+    def _get_calculation_table(self):
+        """Returns the PKs of the charged calculations, one row per structure with the bare monolayer first"""
+        keys = ["mono"] + list(self.ctx.struct_list)
+        return [
+            [self.ctx.calculation_details[charge_amt][key] for charge_amt in self.ctx.charge_range]
+            for key in keys
+        ]
+
+    def _get_run_inputs(self, run):
+        """Returns the process class and the inputs for a planned calculation"""
         inputs = AttributeDict(
             self.exposed_inputs(EnvPwBaseWorkChain, namespace="base")
         )
-        structure = gen_hydrogen()
-        self.report(f"{structure}")
-        inputs.pw.pseudos = get_pseudos_from_structure(structure, "SSSPe")
+        structure = load_node(run["structure"])
         inputs.pw.structure = structure
-        inputs.metadata.call_link_label = "sads_neutral"
+        inputs.pw.pseudos = self._get_pseudos(structure)
+        inputs.metadata.call_link_label = run["label"]
+
+        # the charge dependent inputs are created for each calculation, equivalent calculations are found by their
+        # content and the submission stores them
+        if run["charge"] is not None:
+            inputs.pw.external_charges = self._get_external_charges(self.ctx.charge_range[run["charge"]])
+        if run["charged"]:
+            parameters = self.inputs.base.pw.parameters.get_dict()
+            parameters["SYSTEM"]["tot_charge"] = self.ctx.charge_range[run["charge"]]
+            parameters["ELECTRONS"]["mixing_mode"] = "local-TF"
+            inputs.pw.parameters = Dict(dict=parameters)
+        if run["environ"]:
+            return EnvPwBaseWorkChain, inputs
+
         inputs.pw.metadata.options.parser_name = "quantumespresso.pw"
-        inputs = prepare_process_inputs(PwBaseWorkChain, inputs)
         delattr(inputs.pw.metadata.options, "debug_filename")
         delattr(inputs.pw, "environ_parameters")
-        running = self.submit(PwBaseWorkChain, **inputs)
-        self.report(f"<sads_neutral> launching PwBaseWorkChain<{running.pk}>")
-        self.ctx.calculation_details["adsorbate"] = running.pk
-        self.to_context(workchains=append_(running))
 
-        self.report(f"calc_details written: {self.ctx.calculation_details}")
+        return PwBaseWorkChain, inputs
+
+    def _get_external_charges(self, charge_amt):
+        """Returns the planar charges that compensate a charge, at `charge_distance` on each side of the monolayer"""
+        distance = self.ctx.calculation_parameters["charge_distance"]
+        axis = self.ctx.calculation_parameters["system_axis"]
+        charge_spread = self.ctx.calculation_parameters["charge_spread"]
+
+        # TODO: maybe do this at setup and change the cell if it's too big?
+        cpos1, cpos2 = get_struct_bounds(self.inputs.mono_structure, axis)
+        # change by 5 angstrom
+        cpos1 -= distance
+        cpos2 += distance
+        npcpos1 = np.zeros(3)
+        npcpos2 = np.zeros(3)
+        npcpos1[axis - 1] = cpos1
+        npcpos2[axis - 1] = cpos2
+
+        charges = EnvironChargeData()
+        charges.append_charge(
+            -charge_amt / 2, tuple(npcpos1), charge_spread, 2, axis
+        )
+        charges.append_charge(
+            -charge_amt / 2, tuple(npcpos2), charge_spread, 2, axis
+        )
+        return charges
+
+    def _get_pseudos(self, structure):
+        """Returns the pseudos for a structure, the lookup is done once per set of kinds"""
+        if not hasattr(self, "_pseudos"):
+            self._pseudos = {}
+        kinds = tuple(sorted((kind.name, kind.symbol) for kind in structure.kinds))
+        if kinds not in self._pseudos:
+            self._pseudos[kinds] = get_pseudos_from_structure(structure, "SSSPe")
+        return self._pseudos[kinds]
+
+    def _set_calculation_details(self, details, pk):
+        calculation_details = self.ctx.calculation_details
+        for key in details[:-1]:
+            calculation_details = calculation_details.setdefault(key, {})
+        calculation_details[details[-1]] = pk
 
     def postprocessing(self):
-        adsorbate_post_supercell(
-            self.inputs.mono_struct,
-            self.inputs.bulk_struct,
+        for workchain in self.ctx.get("workchains", []):
+            if not workchain.is_finished_ok:
+                self.report(f"{workchain.process_label}<{workchain.pk}> failed with exit status {workchain.exit_status}")
+                return self.exit_codes.ERROR_SUB_PROCESS_FAILED
+
+        c_details = Dict(
+            dict={
+                "bulk": self.ctx.calculation_details["bulk"],
+                "adsorbate": self.ctx.calculation_details["adsorbate"],
+                "charges": self.ctx.charge_range,
+                "calculations": self._get_calculation_table(),
+            }
+        )
+        results = adsorbate_post_supercell(
+            self.inputs.mono_structure,
+            self.inputs.bulk_structure,
             self.ctx.calculation_parameters,
-            self.ctx.calculation_details,
-            self.ctx.struct_list,
+            c_details,
             self.ctx.num_adsorbate,
         )
+        self.out("surface_energies", results["surface_energies"])
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from aiida.common import AttributeDict
+from aiida.engine import ToContext, WorkChain, append_, while_
+from aiida.orm import Dict, List, Str, load_node
+from aiida_quantumespresso.workflows.protocols.utils import recursive_merge
+
+from aiida_environ.calculations.optimize import (
+    collect_validation,
+    initialize_solvent_parameters,
+    update_solvent_parameters,
+)
+from aiida_environ.utils.optimize import OPTIMIZERS
+from aiida_environ.workflows.pw.parameterization import ParameterizationWorkChain
+
+# where each solvent parameter lives in the Environ input
+PARAMETER_KEYS = {
+    "alpha": ("BOUNDARY", "alpha"),
+    "beta": ("ENVIRON", "env_pressure"),
+    "gamma": ("ENVIRON", "env_surface_tension"),
+}
+
+
+def _get_default_optimizer_parameters() -> Dict:
+    """Returns the default optimiser settings"""
+    return Dict(
+        dict={
+            "method": "lbfgsb",
+            "parameters": ["alpha", "beta", "gamma"],
+            "bounds": {
+                "alpha": [1.0, 1.5],
+                "beta": [-1.0, 1.0],
+                "gamma": [0.0, 100.0],
+            },
+            "scales": {"alpha": 0.05, "beta": 0.1, "gamma": 5.0},
+            "learning_rate": 0.5,
+            "max_iterations": 20,
+            "mse_tolerance": 1e-4,
+            "gradient_tolerance": 1e-3,
+            "batch_size": 0,
+            "validation_fraction": 0.0,
+            "validation_interval": 1,
+            "seed": 0,
+        }
+    )
+
+
+class SolventOptimizationWorkChain(WorkChain):
+    """WorkChain that fits the parameters of a solvent by iterating `ParameterizationWorkChain`.
+
+    Each iteration computes the mean squared error of the solvation energies and its partials with respect to the
+    optimised parameters (`alpha`, `beta` and/or `gamma`), then a bounded optimiser (L-BFGS-B or Adam) chooses the
+    next parameters. The loop stops once the change of the mean squared error or the projected gradient is below
+    its tolerance, or after `max_iterations`.
+
+    The solution calculations of an iteration start from the converged densities of the previous iteration, and the
+    vacuum calculations, which do not depend on the solvent parameters, run once per solute. The optimiser state is
+    the output of a calcfunction at each iteration, so the fit can be resumed from any iteration by passing its state
+    as the `optimizer_state` input.
+
+    For large sets of solutes, a `batch_size` fits on a random subset of the training solutes at each iteration
+    (stochastic gradients, which require the 'adam' method), and a `validation_fraction` of the solutes is held out.
+    The mean squared error of the held-out solutes is evaluated every `validation_interval` iterations, alongside the
+    training batch, and the parameters with the lowest validation error are given in the `validation` output.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        super().define(spec)
+        spec.expose_inputs(
+            ParameterizationWorkChain,
+            namespace="parameterization",
+            namespace_options={"help": "Inputs for the `ParameterizationWorkChain`."},
+            exclude=("parent_calculations", "vacuum_calculations"),
+        )
+        spec.input(
+            "optimizer_parameters",
+            valid_type=Dict,
+            default=lambda: _get_default_optimizer_parameters(),
+            help="The optimiser settings, missing keys take the default values",
+        )
+        spec.input(
+            "optimizer_state",
+            valid_type=Dict,
+            required=False,
+            help="The `optimizer_state` of a previous run to resume from",
+        )
+        spec.outline(
+            cls.setup,
+            while_(cls.should_run_iteration)(
+                cls.run_iteration,
+                cls.inspect_iteration,
+            ),
+            cls.results,
+        )
+        spec.output(
+            "optimizer_state",
+            valid_type=Dict,
+            help="The final optimiser state, `best_parameters` holds the fitted parameters",
+        )
+        spec.output("partials", valid_type=Dict, required=False)
+        spec.output(
+            "validation",
+            valid_type=Dict,
+            required=False,
+            help="The validation errors along the fit and the parameters with the lowest one",
+        )
+        spec.exit_code(
+            300,
+            "ERROR_INVALID_INPUT",
+            message="the optimiser settings or the starting parameters are invalid",
+        )
+        spec.exit_code(
+            400,
+            "ERROR_SUB_PROCESS_FAILED",
+            message="the `ParameterizationWorkChain` of an iteration failed",
+        )
+
+    def setup(self):
+        settings = _get_default_optimizer_parameters().get_dict()
+        settings.update(self.inputs.optimizer_parameters.get_dict())
+        self.ctx.settings = settings
+        self.ctx.iteration = 0
+        self.ctx.converged = False
+        self.ctx.vacuum_calculations = {}
+        self.ctx.solution_calculations = {}
+        self.ctx.validation_parameters = []
+
+        nstruct = len(self.inputs.parameterization.structure_pks)
+        batch_size = settings["batch_size"]
+        if batch_size and settings["method"] != "adam":
+            self.report("mini-batch fits require the 'adam' method")
+            return self.exit_codes.ERROR_INVALID_INPUT
+
+        # the split only depends on the seed, so it is the same when resuming
+        permutation = np.random.default_rng(settings["seed"]).permutation(nstruct)
+        nvalidation = int(round(settings["validation_fraction"] * nstruct))
+        self.ctx.validation_indices = sorted(permutation[:nvalidation].tolist())
+        self.ctx.training_indices = sorted(permutation[nvalidation:].tolist())
+        if not self.ctx.training_indices:
+            self.report("no solutes are left for training")
+            return self.exit_codes.ERROR_INVALID_INPUT
+
+        if "optimizer_state" in self.inputs:
+            self.ctx.state = self.inputs.optimizer_state
+            self.report(
+                f"resuming from iteration {self.ctx.state['iteration']} of Dict<{self.ctx.state.pk}>"
+            )
+            return
+
+        names = settings["parameters"]
+        if settings["method"] not in OPTIMIZERS or not set(names) <= set(PARAMETER_KEYS):
+            self.report(f"invalid optimiser settings: {settings}")
+            return self.exit_codes.ERROR_INVALID_INPUT
+
+        environ_parameters = self._get_solution_parameters()
+        try:
+            parameters = {
+                name: environ_parameters[PARAMETER_KEYS[name][0]][PARAMETER_KEYS[name][1]]
+                for name in names
+            }
+        except KeyError as exception:
+            self.report(f"missing starting value for {exception}")
+            return self.exit_codes.ERROR_INVALID_INPUT
+
+        self.ctx.state = initialize_solvent_parameters(Dict(dict=parameters), Dict(dict=settings))
+
+    def should_run_iteration(self):
+        if self.ctx.converged:
+            return False
+
+        if self.ctx.iteration >= self.ctx.settings["max_iterations"]:
+            self.report("reached the maximum number of iterations")
+            return False
+
+        return True
+
+    def run_iteration(self):
+        self.ctx.iteration += 1
+        parameters = dict(zip(self.ctx.state["parameters"], self.ctx.state["x"]))
+
+        training = self.ctx.training_indices
+        batch_size = self.ctx.settings["batch_size"]
+        if batch_size and batch_size < len(training):
+            rng = np.random.default_rng([self.ctx.settings["seed"], self.ctx.state["iteration"]])
+            training = sorted(rng.choice(training, batch_size, replace=False).tolist())
+
+        inputs = self._get_iteration_inputs(training)
+        inputs.metadata.call_link_label = f"iteration_{self.ctx.iteration:02d}"
+        running = self.submit(ParameterizationWorkChain, **inputs)
+        self.report(
+            f"launching ParameterizationWorkChain<{running.pk}> on {len(training)} solutes with {parameters}"
+        )
+        to_context = {"workchains": append_(running)}
+
+        self.ctx.validating = bool(self.ctx.validation_indices) and (
+            (self.ctx.iteration - 1) % self.ctx.settings["validation_interval"] == 0
+        )
+        if self.ctx.validating:
+            inputs = self._get_iteration_inputs(self.ctx.validation_indices)
+            inputs.alpha_derivative = Str("none")
+            inputs.metadata.call_link_label = f"validation_{self.ctx.iteration:02d}"
+            running = self.submit(ParameterizationWorkChain, **inputs)
+            self.report(
+                f"launching validation ParameterizationWorkChain<{running.pk}> on "
+                f"{len(self.ctx.validation_indices)} solutes"
+            )
+            self.ctx.validation_parameters.append(parameters)
+            to_context["validations"] = append_(running)
+
+        return ToContext(**to_context)
+
+    def inspect_iteration(self):
+        workchain = self.ctx.workchains[-1]
+        if not workchain.is_finished_ok:
+            self.report(f"ParameterizationWorkChain<{workchain.pk}> failed")
+            return self.exit_codes.ERROR_SUB_PROCESS_FAILED
+        self._update_calculations(workchain)
+
+        if self.ctx.validating:
+            validation = self.ctx.validations[-1]
+            if not validation.is_finished_ok:
+                self.report(f"validation ParameterizationWorkChain<{validation.pk}> failed")
+                return self.exit_codes.ERROR_SUB_PROCESS_FAILED
+            self._update_calculations(validation)
+            self.report(
+                f"iteration {self.ctx.iteration}: validation mse = {validation.outputs.partials['mse']:.6f}"
+            )
+
+        partials = workchain.outputs.partials
+        self.ctx.state = update_solvent_parameters(self.ctx.state, partials)
+
+        history = self.ctx.state["history"]
+        projected_gradient = self.ctx.state["projected_gradient"]
+        self.report(
+            f"iteration {self.ctx.iteration}: mse = {partials['mse']:.6f}, projected gradient = {projected_gradient:.2e}"
+        )
+
+        # the errors and gradients of different batches are not comparable, mini-batch fits run all iterations
+        if self.ctx.settings["batch_size"]:
+            return
+
+        if projected_gradient < self.ctx.settings["gradient_tolerance"]:
+            self.report("projected gradient converged")
+            self.ctx.converged = True
+        elif (
+            len(history) > 1
+            and abs(history[-1]["f"] - history[-2]["f"]) < self.ctx.settings["mse_tolerance"]
+        ):
+            self.report("mean squared error converged")
+            self.ctx.converged = True
+
+    def results(self):
+        self.report(f"best parameters: {self.ctx.state['best_parameters']}")
+        self.out("optimizer_state", self.ctx.state)
+        if "workchains" in self.ctx:
+            self.out("partials", self.ctx.workchains[-1].outputs.partials)
+
+        if "validations" in self.ctx:
+            kwargs = {}
+            for k, validation in enumerate(self.ctx.validations):
+                kwargs[f"parameters_{k}"] = Dict(dict=self.ctx.validation_parameters[k])
+                kwargs[f"partials_{k}"] = validation.outputs.partials
+            validation = collect_validation(**kwargs)
+            self.report(
+                f"best validation parameters: {validation['best_parameters']}, mse = {validation['best_mse']:.6f}"
+            )
+            self.out("validation", validation)
+
+    def _get_iteration_inputs(self, indices):
+        """Returns the `ParameterizationWorkChain` inputs for a subset of the solutes at the current parameters"""
+        inputs = AttributeDict(
+            self.exposed_inputs(ParameterizationWorkChain, namespace="parameterization")
+        )
+        structure_pks = [inputs.structure_pks[i] for i in indices]
+        inputs.structure_pks = List(list=structure_pks)
+        inputs.expt_energy = List(list=[inputs.expt_energy[i] for i in indices])
+
+        # the optimised parameters are solution overrides, the vacuum calculations are unaffected
+        solution = inputs.environ_solution.get_dict() if "environ_solution" in inputs else {}
+        solution.setdefault("ENVIRON", {})
+        for name, value in zip(self.ctx.state["parameters"], self.ctx.state["x"]):
+            section, key = PARAMETER_KEYS[name]
+            solution.setdefault(section, {})[key] = value
+        inputs.environ_solution = Dict(dict=solution)
+
+        # reuse the vacuum calculations and restart from the last solution of each solute
+        vacuum_calculations = {}
+        parent_calculations = {}
+        for i, structure_pk in enumerate(structure_pks):
+            if str(structure_pk) in self.ctx.vacuum_calculations:
+                vacuum_calculations[f"vacuum_{i}"] = self.ctx.vacuum_calculations[str(structure_pk)]
+            if str(structure_pk) in self.ctx.solution_calculations:
+                parent_calculations[f"solution_0_{i}"] = self.ctx.solution_calculations[
+                    str(structure_pk)
+                ]
+        if vacuum_calculations:
+            inputs.vacuum_calculations = Dict(dict=vacuum_calculations)
+        if parent_calculations:
+            inputs.parent_calculations = Dict(dict=parent_calculations)
+
+        return inputs
+
+    def _update_calculations(self, workchain):
+        """Records the successful vacuum and solution calculations of a `ParameterizationWorkChain` per solute"""
+        calculations = workchain.outputs.partials.creator.inputs.calculations.get_dict()
+        for i, structure_pk in enumerate(workchain.inputs.structure_pks):
+            for key, cache in (
+                (f"vacuum_{i}", self.ctx.vacuum_calculations),
+                (f"solution_0_{i}", self.ctx.solution_calculations),
+            ):
+                if key in calculations and load_node(calculations[key]).is_finished_ok:
+                    cache[str(structure_pk)] = calculations[key]
+
+    def _get_solution_parameters(self):
+        """Returns the Environ parameters of the solution calculations"""
+        inputs = self.inputs.parameterization
+        environ_parameters = inputs.base.pw.environ_parameters.get_dict()
+        if "environ_solution" in inputs:
+            environ_parameters = recursive_merge(
+                environ_parameters, inputs.environ_solution.get_dict()
+            )
+        return environ_parameters
@@ -2,14 +2,15 @@
 from copy import deepcopy
 
 from aiida.common import AttributeDict
-from aiida.engine import ToContext, WorkChain
-from aiida.orm import Dict, Float, Int, List, Str
+from aiida.engine import ToContext, WorkChain, if_
+from aiida.orm import Bool, Dict, Float, Int, List, Str
 from aiida.orm.nodes.data.upf import get_pseudos_from_structure
 from aiida.orm.utils import load_node
 from aiida_quantumespresso.utils.mapping import prepare_process_inputs
 from aiida_quantumespresso.workflows.protocols.utils import recursive_merge
 
 from aiida_environ.calculations.partial import calc_partial
+from aiida_environ.utils.cache import find_finished_process, get_lookup_inputs
 from aiida_environ.workflows.pw.base import EnvPwBaseWorkChain
 
 
@@ -21,6 +22,10 @@ class ParameterizationWorkChain(WorkChain):
     be computed.
 
     The workchain calculates the solvation energy for each input structure and computes the mean squared error.
+    The partials with respect to gamma and beta follow from the quantum surface and volume of the solutes, the partial
+    with respect to alpha is a finite difference. With `alpha_derivative='restart'` the solutions at `alpha + delta`
+    restart from the converged densities of the solutions at `alpha`, so they only take a few SCF steps, and with
+    `alpha_derivative='none'` they are skipped, e.g. to only evaluate the mean squared error of a validation set.
 
     # TODO implement a learning rate which can be given by the user
     # TODO implement a loop to fully automate the minimization algorithm
@@ -64,19 +69,65 @@ class ParameterizationWorkChain(WorkChain):
             required=False,
             help="The base parameter input for an environ simulation",
         )
+        spec.input(
+            "parent_calculations",
+            valid_type=Dict,
+            required=False,
+            help="The calculation PKs of a previous run, keyed as `solution_0_{i}`, whose converged densities are "
+            "the starting point of the solution calculations",
+        )
+        spec.input(
+            "alpha_derivative",
+            valid_type=Str,
+            default=lambda: Str("finite"),
+            help="How the solutions at `alpha + delta` are computed: 'finite' runs them from scratch alongside the "
+            "solutions at `alpha`, 'restart' runs them afterwards from the converged density of each solution at "
+            "`alpha`, which only takes a few SCF steps, and 'none' skips them (the alpha partial is then zero)",
+        )
+        spec.input(
+            "vacuum_calculations",
+            valid_type=Dict,
+            required=False,
+            help="The PKs of finished vacuum calculations of the solutes, keyed as `vacuum_{i}`, which are reused "
+            "instead of running them again since they do not depend on the solvent parameters",
+        )
+        spec.input(
+            "reuse_vacuum",
+            valid_type=Bool,
+            default=lambda: Bool(True),
+            help="Reuse a previous successful vacuum calculation with the same structure, code, pseudopotentials "
+            "and parameters, if any",
+        )
         spec.outline(
             cls.setup,
             cls.run_vacuum,
             cls.run_solution,
+            if_(cls.should_restart_alpha)(
+                cls.run_alpha_restart,
+            ),
             cls.post_processing,
             cls.produce_result,
         )
         spec.output("partials", valid_type=Dict)
+        spec.exit_code(
+            300,
+            "ERROR_INVALID_INPUT",
+            message="the `alpha_derivative` mode is not 'finite', 'restart' or 'none'",
+        )
+        spec.exit_code(
+            400,
+            "ERROR_SOLUTIONS_FAILED",
+            message="none of the solution calculations finished successfully",
+        )
         # spec.output('next_alpha', valid_type = Float)
         # spec.output('next_beta', valid_type = Float)
         # spec.output('next_gamma', valid_type = Float)
 
     def setup(self):
+        if self.inputs.alpha_derivative.value not in ("finite", "restart", "none"):
+            self.report(f"invalid `alpha_derivative`: {self.inputs.alpha_derivative.value}")
+            return self.exit_codes.ERROR_INVALID_INPUT
+
         self.ctx.nstruct = len(self.inputs.structure_pks)
         self.ctx.delta = 1e-6
         self.ctx.calculations = {}
@@ -111,8 +162,21 @@ class ParameterizationWorkChain(WorkChain):
     def run_vacuum(self):
         calculations = {}
 
+        if "vacuum_calculations" in self.inputs:
+            cached = self.inputs.vacuum_calculations.get_dict()
+        else:
+            cached = {}
+
         # Loop through and compute vacuum energy
         for i, structure_pk in enumerate(self.inputs.structure_pks):
+            key = f"vacuum_{i}"
+            if key in cached and load_node(cached[key]).is_finished_ok:
+                self.ctx.calculations[key] = cached[key]
+                self.report(
+                    f"reusing vacuum EnvPwBaseWorkChain<{cached[key]}> w/ Structure<{structure_pk}>"
+                )
+                continue
+
             struct = load_node(structure_pk)
             inputs = AttributeDict(
                 self.exposed_inputs(EnvPwBaseWorkChain, namespace="base")
@@ -123,8 +187,19 @@ class ParameterizationWorkChain(WorkChain):
             )
             inputs.pw.environ_parameters = self.ctx.vacuum_inputs
             inputs = prepare_process_inputs(EnvPwBaseWorkChain, inputs)
+
+            if self.inputs.reuse_vacuum:
+                node = find_finished_process(
+                    EnvPwBaseWorkChain, get_lookup_inputs(inputs)
+                )
+                if node is not None:
+                    self.ctx.calculations[key] = node.pk
+                    self.report(
+                        f"reusing vacuum EnvPwBaseWorkChain<{node.pk}> w/ Structure<{struct.pk}>"
+                    )
+                    continue
+
             future = self.submit(EnvPwBaseWorkChain, **inputs)
-            key = f"vacuum_{i}"
             self.ctx.calculations[key] = future.pk
 
             self.report(
@@ -148,6 +223,7 @@ class ParameterizationWorkChain(WorkChain):
                 struct, self.inputs.pseudo_label.value
             )
             inputs.pw.environ_parameters = self.ctx.solution_inputs_0
+            self._set_restart(inputs, i)
             inputs = prepare_process_inputs(EnvPwBaseWorkChain, inputs)
             future = self.submit(EnvPwBaseWorkChain, **inputs)
             key = f"solution_0_{i}"
@@ -158,6 +234,9 @@ class ParameterizationWorkChain(WorkChain):
             )
             calculations[key] = future
 
+        if self.inputs.alpha_derivative.value != "finite":
+            return ToContext(**calculations)
+
         # Loop through and compute solution energy for alpha = alpha_0 + d alpha
         for i, structure_pk in enumerate(self.inputs.structure_pks):
             struct = load_node(structure_pk)
@@ -169,6 +248,7 @@ class ParameterizationWorkChain(WorkChain):
                 struct, self.inputs.pseudo_label.value
             )
             inputs.pw.environ_parameters = self.ctx.solution_inputs_1
+            self._set_restart(inputs, i)
             inputs = prepare_process_inputs(EnvPwBaseWorkChain, inputs)
             future = self.submit(EnvPwBaseWorkChain, **inputs)
             key = f"solution_1_{i}"
@@ -181,7 +261,77 @@ class ParameterizationWorkChain(WorkChain):
 
         return ToContext(**calculations)
 
+    def should_restart_alpha(self):
+        return self.inputs.alpha_derivative.value == "restart"
+
+    def run_alpha_restart(self):
+        calculations = {}
+
+        # Restart each successful solution at alpha_0 with alpha = alpha_0 + d alpha
+        for i, structure_pk in enumerate(self.inputs.structure_pks):
+            parent = self.ctx[f"solution_0_{i}"]
+            if not parent.is_finished_ok:
+                self.report(
+                    f"solution_0 EnvPwBaseWorkChain<{parent.pk}> failed, skipping its restart"
+                )
+                continue
+
+            struct = load_node(structure_pk)
+            inputs = AttributeDict(
+                self.exposed_inputs(EnvPwBaseWorkChain, namespace="base")
+            )
+            inputs.pw.structure = struct
+            inputs.pw.pseudos = get_pseudos_from_structure(
+                struct, self.inputs.pseudo_label.value
+            )
+            inputs.pw.environ_parameters = self.ctx.solution_inputs_1
+            self._set_parent(inputs, parent, wavefunctions=True)
+            inputs = prepare_process_inputs(EnvPwBaseWorkChain, inputs)
+            future = self.submit(EnvPwBaseWorkChain, **inputs)
+            key = f"solution_1_{i}"
+            self.ctx.calculations[key] = future.pk
+
+            self.report(
+                f"launching solution_1 EnvPwBaseWorkChain<{future.pk}> w/ Structure<{struct.pk}> from "
+                f"EnvPwBaseWorkChain<{parent.pk}>"
+            )
+            calculations[key] = future
+
+        return ToContext(**calculations)
+
+    def _set_restart(self, inputs, i):
+        """Starts a solution calculation from the converged density of the previous run, if given"""
+        if "parent_calculations" not in self.inputs:
+            return
+
+        key = f"solution_0_{i}"
+        if key not in self.inputs.parent_calculations.get_dict():
+            return
+
+        parent = load_node(self.inputs.parent_calculations[key])
+        if not parent.is_finished_ok:
+            return
+
+        self._set_parent(inputs, parent)
+
+    @staticmethod
+    def _set_parent(inputs, parent, wavefunctions=False):
+        """Starts a calculation from the converged density (and wavefunctions) and Environ quantities of `parent`"""
+        parameters = inputs.pw.parameters.get_dict()
+        parameters.setdefault("ELECTRONS", {})["startingpot"] = "file"
+        if wavefunctions:
+            parameters["ELECTRONS"]["startingwfc"] = "file"
+        inputs.pw.parameters = parameters
+        inputs.pw.environ_parameters = deepcopy(inputs.pw.environ_parameters)
+        inputs.pw.environ_parameters["ENVIRON"]["environ_restart"] = True
+        inputs.pw.parent_folder = parent.outputs.remote_folder
+
     def post_processing(self):
+        if not any(
+            self.ctx[f"solution_0_{i}"].is_finished_ok for i in range(self.ctx.nstruct)
+        ):
+            return self.exit_codes.ERROR_SOLUTIONS_FAILED
+
         self.ctx.results = calc_partial(
             Int(self.ctx.nstruct),
             Float(self.ctx.delta),
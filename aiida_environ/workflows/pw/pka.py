@@ -7,22 +7,44 @@ from aiida import orm
 from aiida.common import AttributeDict, exceptions
 from aiida.common.lang import type_check
 from aiida.engine import ToContext, WorkChain, append_, if_, while_
-from aiida.plugins import WorkflowFactory, DataFactory, CalculationFactory
+from aiida.plugins import WorkflowFactory, CalculationFactory
 from aiida_quantumespresso.common.types import RelaxType
 from aiida_quantumespresso.workflows.protocols.utils import ProtocolMixin
 from aiida.orm import load_group, load_code, StructureData, ArrayData
-import numpy as np
+
+from aiida_environ.calculations.hessian import (
+    calc_partial_hessian,
+    calc_vibrational_free_energy_difference,
+    get_partial_displacements,
+)
+from aiida_environ.calculations.phonon import (
+    calc_thermal_properties,
+    collect_forces,
+    generate_phonopy_data_from_forces,
+)
+from aiida_environ.utils.hessian import find_removed_proton, get_active_atoms
+from aiida_environ.utils.phonon import get_preprocess_data, plan_displacements
 
 PwRelaxWorkChain = WorkflowFactory("environ.pw.relax")
+EnvPwBaseWorkChain = WorkflowFactory("environ.pw.base")
 
 def validate_inputs(inputs, _):
     """Validate the top level namespace."""
-    parameters = inputs["vacuum"]["base"]["pw"]["parameters"].get_dict()
+    if not inputs.get("solution_only", False) and "vacuum" not in inputs:
+        return "The `vacuum` inputs are required unless `solution_only` is True."
 
-    if "relaxation_scheme" not in inputs and "calculation" not in parameters.get(
-        "CONTROL", {}
-    ):
-        return "The parameters in `base.pw.parameters` do not specify the required key `CONTROL.calculation`."
+    for environment in ("vacuum", "solution"):
+        if environment not in inputs:
+            continue
+        parameters = inputs[environment]["base"]["pw"]["parameters"].get_dict()
+
+        if "relaxation_scheme" not in inputs and "calculation" not in parameters.get(
+            "CONTROL", {}
+        ):
+            return "The parameters in `base.pw.parameters` do not specify the required key `CONTROL.calculation`."
+
+    if not inputs.get("phonopy_in_process", False) and "phonopy_code" not in inputs:
+        return "The `phonopy_code` is required unless `phonopy_in_process` is True."
 
 
 class pKaWorkChain(ProtocolMixin, WorkChain):
@@ -38,16 +60,18 @@ class pKaWorkChain(ProtocolMixin, WorkChain):
         spec.expose_inputs(
             PwRelaxWorkChain, 
             namespace = 'vacuum',
-            exclude = ('clean_workdir', 'pw.structure', 'pw.parent_folder'),
+            exclude = ('clean_workdir', 'structure', 'pw.structure', 'pw.parent_folder'),
             namespace_options = {
+                'required': False,
+                'populate_defaults': False,
                 'help': ('Inputs for the `PwBaseWorkChain` for the main '
-                         'relax loop.')
+                         'relax loop, not required if `solution_only` is `True`.')
             }
         )
         spec.expose_inputs(
             PwRelaxWorkChain, 
             namespace = 'solution',
-            exclude = ('clean_workdir', 'pw.structure', 'pw.parent_folder'),
+            exclude = ('clean_workdir', 'structure', 'pw.structure', 'pw.parent_folder'),
             namespace_options = {
                 'help': ('Inputs for the `PwBaseWorkChain` for the main '
                          'relax loop.')
@@ -56,8 +80,31 @@ class pKaWorkChain(ProtocolMixin, WorkChain):
         spec.input(
             'phonopy_code',
             valid_type = orm.Code,
+            required = False,
             help = 'Phonopy code for performing vibration calculations.'
         )
+        spec.input(
+            'solution_only',
+            valid_type = orm.Bool,
+            default = lambda: orm.Bool(False),
+            help = ('If `True`, the structures are only relaxed and displaced in solution, and the `vacuum` '
+                    'inputs are ignored.')
+        )
+        spec.input(
+            'phonopy_in_process',
+            valid_type = orm.Bool,
+            default = lambda: orm.Bool(False),
+            help = ('If `True`, the force constants and thermal properties are calculated with the phonopy '
+                    'API in a calcfunction, instead of submitting a `PhonopyCalculation`.')
+        )
+        spec.input(
+            'thermal_parameters',
+            valid_type = orm.Dict,
+            default = lambda: orm.Dict(dict={'TMIN': 198.15, 'TMAX': 398.15, 'TSTEP': 25.0}),
+            help = ('Phonopy tags (`MESH`, `GAMMA_CENTER`, `TMIN`, `TMAX`, `TSTEP`, `CUTOFF_FREQUENCY`, '
+                    '`FC_SYMMETRY`) of the thermal properties calculated in process, on top of those of the '
+                    '`PhonopyCalculation`. The default temperatures are 298.15 K +/- 100 K in steps of 25 K.')
+        )
         spec.input_namespace(
             'structures', 
             valid_type = StructureData, 
@@ -70,6 +117,86 @@ class pKaWorkChain(ProtocolMixin, WorkChain):
             help = ('If `True`, work directories of all called calculation '
                     'will be cleaned at the end of execution.')
         )
+        spec.input_namespace(
+            'symmetry',
+            help = 'Namespace for the symmetry reduction of the phonon displacements.'
+        )
+        spec.input(
+            'symmetry.symprec',
+            valid_type = orm.Float,
+            default = lambda: orm.Float(1e-3),
+            help = ('Symmetry tolerance for the point group analysis of the relaxed structures, '
+                    'looser than usual since relaxed molecules are only approximately symmetric.')
+        )
+        spec.input(
+            'symmetry.is_symmetry',
+            valid_type = orm.Bool,
+            default = lambda: orm.Bool(True),
+            help = 'Whether to reduce the number of displacements with the point group symmetries.'
+        )
+        spec.input(
+            'displacement_generator',
+            valid_type = orm.Dict,
+            required = False,
+            help = 'Arguments of the phonopy displacement generation, e.g. `distance` or `is_plusminus`.'
+        )
+        spec.input_namespace(
+            'partial_hessian',
+            help = ('Namespace for the partial Hessian of the acid and the base, where only the atoms '
+                    'around the titratable site are displaced.')
+        )
+        spec.input(
+            'partial_hessian.acid',
+            valid_type = orm.Str,
+            required = False,
+            help = ('Label of the acid in `structures`, the partial Hessian is used for the acid and the '
+                    'base if both are given.')
+        )
+        spec.input(
+            'partial_hessian.base',
+            valid_type = orm.Str,
+            required = False,
+            help = 'Label of the conjugate base in `structures`.'
+        )
+        spec.input(
+            'partial_hessian.radius',
+            valid_type = orm.Float,
+            default = lambda: orm.Float(3.0),
+            help = ('Radius in angstrom of the active region around the atom bonded to the removed proton, '
+                    'and around the same atom in the base.')
+        )
+        spec.input(
+            'partial_hessian.active_atoms',
+            valid_type = orm.Dict,
+            required = False,
+            help = ('Indices of the active atoms of the acid and the base, under the keys `acid` and `base`, '
+                    'instead of the atoms within `radius`.')
+        )
+        spec.input(
+            'partial_hessian.distance',
+            valid_type = orm.Float,
+            default = lambda: orm.Float(0.01),
+            help = 'Length in angstrom of the central-difference displacements.'
+        )
+        spec.input(
+            'partial_hessian.shell',
+            valid_type = orm.Float,
+            default = lambda: orm.Float(1.0),
+            help = ('Width in angstrom of the outer shell of the active regions that is frozen to estimate '
+                    'the error of the partial Hessian.')
+        )
+        spec.input(
+            'partial_hessian.temperature',
+            valid_type = orm.Float,
+            default = lambda: orm.Float(298.15),
+            help = 'Temperature in K of the vibrational free energies.'
+        )
+        spec.input(
+            'partial_hessian.cutoff',
+            valid_type = orm.Float,
+            default = lambda: orm.Float(10.0),
+            help = 'Modes below this wavenumber in cm^-1 are left out of the vibrational free energies.'
+        )
         spec.input(
             'pseudo_family',
             valid_type = orm.Str,
@@ -82,13 +209,18 @@ class pKaWorkChain(ProtocolMixin, WorkChain):
         spec.outline(
             cls.setup,
             # Optimize structures in both vacuum and solution
-            cls.run_vacuum,
-            cls.check_vacuum,
+            if_(cls.should_run_vacuum)(
+                cls.run_vacuum,
+                cls.check_vacuum,
+            ),
             cls.run_solution,
             cls.check_solution,
             # Take optimized structures and run through phonopy
             cls.run_phonopy,
             cls.check_phonopy,
+            if_(cls.should_run_partial_hessian)(
+                cls.postprocess_partial_hessian,
+            ),
             cls.postprocess_phonopy,
             cls.results,
         )
@@ -107,6 +239,16 @@ class pKaWorkChain(ProtocolMixin, WorkChain):
             'PSEUDO_FAMILY_DOES_NOT_EXIST',
             message = 'pseudo family does not exist'
         )
+        spec.exit_code(
+            406,
+            'ERROR_PHONOPY_CALCULATION_FAILED',
+            message = 'the scf calculation of at least one displaced supercell failed'
+        )
+        spec.exit_code(
+            407,
+            'ERROR_INVALID_PARTIAL_HESSIAN',
+            message = 'the acid and base of the partial Hessian are not valid: {message}'
+        )
         spec.output_namespace(
             'output_structures',
             valid_type = StructureData,
@@ -121,6 +263,21 @@ class pKaWorkChain(ProtocolMixin, WorkChain):
             help = ('Dictionary of results for both vacuum and solution '
                     'calculations.')
         )
+        spec.output_namespace(
+            'thermal_properties',
+            valid_type = ArrayData,
+            dynamic = True,
+            required = False,
+            help = ('Force constants, frequencies and thermal properties of each structure in vacuum and '
+                    'solution, if calculated in process.')
+        )
+        spec.output_namespace(
+            'vibrational_free_energy',
+            valid_type = orm.Dict,
+            required = False,
+            help = ('Vibrational free energy of deprotonation in vacuum and solution from the partial '
+                    'Hessians, with its error estimates.')
+        )
         # yapf: enable
 
     @classmethod
@@ -164,10 +321,9 @@ class pKaWorkChain(ProtocolMixin, WorkChain):
             **kwargs
         )
 
-        vacuum["base"]["pw"].pop("structure", None)
-        vacuum.pop("clean_workdir", None)
-        solution["base"]["pw"].pop("structure", None)
-        solution.pop("clean_workdir", None)        
+        for relax in (vacuum, solution):
+            relax.pop("structure", None)
+            relax.pop("clean_workdir", None)        
 
         # Declare the environ.in file input
         environ_input = {
@@ -213,8 +369,13 @@ class pKaWorkChain(ProtocolMixin, WorkChain):
 
     def setup(self):
         """Input validation and context setup."""
-        self.ctx.vacuum_failed = True
+        self.ctx.vacuum_failed = not self.inputs.solution_only
         self.ctx.solution_failed = True
+        self.ctx.vacuum = AttributeDict()
+        if self.inputs.solution_only:
+            self.ctx.environments = ('solution',)
+        else:
+            self.ctx.environments = ('vacuum', 'solution')
 
         # Check if pseudo family exists
         family_name = self.inputs.pseudo_family.value
@@ -223,6 +384,12 @@ class pKaWorkChain(ProtocolMixin, WorkChain):
         except:
             self.report(f'failed to load pseudo family {family_name}')
             return self.exit_codes.PSEUDO_FAMILY_DOES_NOT_EXIST
+
+        # Resolve the pseudopotentials of each structure once, for all its calculations
+        self.ctx.pseudos = {
+            key: pseudo_family.get_pseudos(structure=structure)
+            for key, structure in self.inputs.structures.items()
+        }
         
         # Initialize results for both vacuum and solution calculations
         results = {
@@ -236,30 +403,70 @@ class pKaWorkChain(ProtocolMixin, WorkChain):
         self.ctx.results = results
         self.ctx.output_structures = output_structures
 
+        # Locate the titratable site of the acid and the base
+        self.ctx.partial_centers = {}
+        labels = [
+            self.inputs.partial_hessian[key].value
+            for key in ('acid', 'base') if key in self.inputs.partial_hessian
+        ]
+        if not labels:
+            return
+        if len(labels) != 2:
+            return self.exit_codes.ERROR_INVALID_PARTIAL_HESSIAN.format(
+                message='both the acid and the base are required'
+            )
+        for label in labels:
+            if label not in self.inputs.structures:
+                return self.exit_codes.ERROR_INVALID_PARTIAL_HESSIAN.format(
+                    message=f'`{label}` is not in `structures`'
+                )
+
+        acid, base = labels
+        try:
+            _, acid_center, base_center = find_removed_proton(
+                self.inputs.structures[acid], self.inputs.structures[base]
+            )
+        except ValueError as exception:
+            return self.exit_codes.ERROR_INVALID_PARTIAL_HESSIAN.format(message=str(exception))
+        self.ctx.partial_centers = {acid: acid_center, base: base_center}
+        self.ctx.partial_parameters = AttributeDict(dictionary={
+            'vacuum': {},
+            'solution': {}
+        })
+
         return
 
+    def _get_relax_inputs(self, environment, key):
+        """
+        Return the inputs of the relaxation of a structure in an environment.
+        """
+        inputs = AttributeDict(
+            self.exposed_inputs(
+                PwRelaxWorkChain,
+                namespace=environment
+            )
+        )
+        inputs.structure = self.inputs.structures[key]
+        inputs.base.pw.pseudos = self.ctx.pseudos[key]
+        inputs.base.pw.pseudo_family = self.inputs.pseudo_family
+        inputs.metadata.call_link_label = f'{environment}_{key}'
+
+        return inputs
+
+    def should_run_vacuum(self):
+        """
+        Return whether the structures are also relaxed and displaced in vacuum.
+        """
+        return 'vacuum' in self.ctx.environments
+
     def run_vacuum(self):
         """
         Run vacuum environment simulations for all structures.
         """
 
-        self.ctx.vacuum = AttributeDict()
         # Iterate over the list of structures and attach to the inputs.
-        for key, structure in self.inputs.structures.items():
-            inputs = AttributeDict(
-                self.exposed_inputs(
-                    PwRelaxWorkChain,
-                    namespace='vacuum'
-                )
-            )
-
-            inputs.base.pw.structure = structure
-            pseudo_family = load_group(self.inputs.pseudo_family.value)
-            inputs.base.pw.pseudos = pseudo_family.get_pseudos(
-                structure=structure
-            )
-            inputs.base.pw.pseudo_family = self.inputs.pseudo_family
-            inputs.metadata.call_link_label = f'vacuum_{key}'
+        for key in self.inputs.structures:
+            inputs = self._get_relax_inputs('vacuum', key)
 
             self.ctx.results['vacuum'][key] = {}
             self.ctx.output_structures['vacuum'][key] = {}
@@ -296,20 +503,8 @@ class pKaWorkChain(ProtocolMixin, WorkChain):
 
         self.ctx.solution = AttributeDict()
         # Iterate over the list of structures and attach to the inputs.
-        for key, structure in self.inputs.structures.items():
-            inputs = AttributeDict(
-                self.exposed_inputs(
-                    PwRelaxWorkChain,
-                    namespace='solution'
-                )
-            )
-            inputs.base.pw.structure = structure
-            pseudo_family = load_group(self.inputs.pseudo_family.value)
-            inputs.base.pw.pseudos = pseudo_family.get_pseudos(
-                structure=structure
-            )
-            inputs.base.pw.pseudo_family = self.inputs.pseudo_family
-            inputs.metadata.call_link_label = f'solution_{key}'
+        for key in self.inputs.structures:
+            inputs = self._get_relax_inputs('solution', key)
 
             self.ctx.results['solution'][key] = {}
             self.ctx.output_structures['solution'][key] = {}
@@ -346,10 +541,7 @@ class pKaWorkChain(ProtocolMixin, WorkChain):
         """
 
         self.report(f'Commencing phonopy calculations')
-        self.running = {}
 
-        PreProcessData = DataFactory("phonopy.preprocess")
-        supercell_matrix = [1,1,1]
         self.ctx.phonopy = AttributeDict(dictionary={
             'vacuum' : {},
             'solution' : {}
@@ -360,121 +552,204 @@ class pKaWorkChain(ProtocolMixin, WorkChain):
             'solution': {}
         })
 
-        for label, workchain in self.ctx.vacuum.items():
-            self.ctx.phonopy.vacuum[label] = {}
+        for environment in self.ctx.environments:
+            self._run_displacements(environment)
+
+        return
+
+    def _run_displacements(self, environment):
+        """
+        Plan the symmetry-reduced displacements of all the structures relaxed in
+        an environment, and submit one scf for each distinct displaced supercell.
+        """
+        symprec = self.inputs.symmetry.symprec.value
+        is_symmetry = self.inputs.symmetry.is_symmetry.value
+        if 'displacement_generator' in self.inputs:
+            displacement_generator = self.inputs.displacement_generator.get_dict()
+        else:
+            displacement_generator = None
+
+        supercells = {}
+        for label, workchain in self.ctx[environment].items():
             structure = workchain.outputs.output_structure
-            preprocess_data = PreProcessData(
-                structure = structure, 
-                supercell_matrix = supercell_matrix
+            if label in self.ctx.partial_centers:
+                parameters = self._get_partial_parameters(label, structure)
+                supercells[label] = get_partial_displacements(structure, parameters)
+                self.ctx.partial_parameters[environment][label] = parameters
+                continue
+
+            preprocess_data = get_preprocess_data(
+                structure, symprec, is_symmetry, displacement_generator
             )
-            supercells = preprocess_data.calcfunctions.get_supercells_with_displacements()
-            self.ctx.preprocess_data['vacuum'][label] = preprocess_data
-            pseudo_family = load_group(self.inputs.pseudo_family.value)
-            # Initialize inputs for each supercell and submit
-            for key, supercell in supercells.items():
-                inputs = AttributeDict(
-                self.exposed_inputs(
-                    PwRelaxWorkChain,
-                    namespace='vacuum'
-                    )
-                )
-                inputs.base.pw.parameters["CONTROL"]["calculation"] = 'scf'
-                inputs.base.pw.structure = supercell
-                inputs.base.pw.pseudos = pseudo_family.get_pseudos(
-                    structure=supercell
-                )
-                inputs.base.pw.pseudo_family = self.inputs.pseudo_family
-                inputs.metadata.call_link_label = f'vacuum_{label}_{key}'
+            supercells[label] = preprocess_data.calcfunctions.get_supercells_with_displacements()
+            self.ctx.preprocess_data[environment][label] = preprocess_data
+
+        unique, mapping = plan_displacements(supercells)
+        phonopy_labels = [label for label in supercells if label not in self.ctx.partial_centers]
+        partial_labels = [label for label in supercells if label in self.ctx.partial_centers]
+        phonopy_total = sum(len(supercells[label]) for label in phonopy_labels)
+        natoms = sum(len(self.ctx[environment][label].outputs.output_structure.sites) for label in phonopy_labels)
+        message = (
+            f'{environment}: planned {len(unique)} displaced scf calculations for {phonopy_total} phonopy '
+            f'displacements of {len(phonopy_labels)} structures ({6 * natoms} without symmetry)'
+        )
+        if partial_labels:
+            partial_total = sum(len(supercells[label]) for label in partial_labels)
+            message += f' and {partial_total} partial Hessian displacements of {len(partial_labels)} structures'
+        self.report(message)
+
+        # each supercell restarts from the density of the first relaxed structure it was generated from
+        owners = {}
+        for label, label_mapping in mapping.items():
+            for content_hash in label_mapping.values():
+                owners.setdefault(content_hash, label)
+
+        running = {}
+        for index, (content_hash, supercell) in enumerate(unique.items()):
+            inputs = self._get_force_inputs(environment, self.ctx[environment][owners[content_hash]])
+            inputs.pw.structure = supercell
+            # displaced supercells keep the kinds of the structure they were generated from
+            pseudos = self.ctx.pseudos[owners[content_hash]]
+            if set(supercell.get_kind_names()) != set(pseudos):
+                pseudos = load_group(self.inputs.pseudo_family.value).get_pseudos(structure=supercell)
+            inputs.pw.pseudos = pseudos
+            inputs.metadata.call_link_label = f'{environment}_displacement_{index}'
+
+            future = self.submit(EnvPwBaseWorkChain, **inputs)
+            running[content_hash] = future
+            self.report(f'submitting `EnvPwBaseWorkChain` <PK={future.pk}>.')
+            self.to_context(**{f'running.{environment}_{index}': future})
+
+        # supercells shared by several structures point to the same calculation
+        for label, label_mapping in mapping.items():
+            self.ctx.phonopy[environment][label] = {
+                key: running[content_hash] for key, content_hash in label_mapping.items()
+            }
 
-                future = self.submit(PwRelaxWorkChain, **inputs)
-                self.ctx.phonopy.vacuum[label][key] = future
-                self.report(f'submitting `PwRelaxWorkChain` <PK={future.pk}>.')
-                self.to_context(**{f'running.{"vacuum"+label+key}': future})
+    def _get_partial_parameters(self, label, structure):
+        """
+        Return the active atoms and displacement length of the partial Hessian of a relaxed structure.
+        """
+        center = self.ctx.partial_centers[label]
+        key = 'acid' if label == self.inputs.partial_hessian.acid.value else 'base'
+        if 'active_atoms' in self.inputs.partial_hessian:
+            active = self.inputs.partial_hessian.active_atoms[key]
+        else:
+            active, _ = get_active_atoms(structure, center, self.inputs.partial_hessian.radius.value)
+            active = active.tolist()
 
-        for label, workchain in self.ctx.solution.items():
-            self.ctx.phonopy.solution[label] = {}
-            structure = workchain.outputs.output_structure
-            preprocess_data = PreProcessData(
-                structure = structure, 
-                supercell_matrix = supercell_matrix
+        return orm.Dict(dict={
+            'active': active,
+            'center': center,
+            'distance': self.inputs.partial_hessian.distance.value,
+        })
+
+    def _get_force_inputs(self, environment, relax_workchain):
+        """
+        Return the inputs of a single force evaluation in an environment, restarted
+        from the converged density and Environ quantities of a relaxed structure.
+        """
+        inputs = AttributeDict(
+            self.exposed_inputs(
+                PwRelaxWorkChain,
+                namespace=environment
             )
-            supercells = preprocess_data.calcfunctions.get_supercells_with_displacements()
-            self.ctx.preprocess_data['solution'][label] = preprocess_data
-            pseudo_family = load_group(self.inputs.pseudo_family.value)
-
-            # Initialize inputs for each supercell and submit
-            for key, supercell in supercells.items():
-                inputs = AttributeDict(
-                self.exposed_inputs(
-                    PwRelaxWorkChain,
-                    namespace='solution'
-                    )
-                )
-                inputs.base.pw.parameters["CONTROL"]["calculation"] = 'scf'
-                inputs.base.pw.structure = supercell
-                inputs.base.pw.pseudos = pseudo_family.get_pseudos(
-                    structure=supercell
-                )
-                inputs.base.pw.pseudo_family = self.inputs.pseudo_family
-                inputs.metadata.call_link_label = f'solution_{label}_{key}'
+        ).base
 
-                future = self.submit(PwRelaxWorkChain, **inputs)
-                self.ctx.phonopy.solution[label][key] = future
-                self.report(f'submitting `PwRelaxWorkChain` <PK={future.pk}>.')
-                self.to_context(**{f'running.{"solution"+label+key}': future})
+        parameters = inputs.pw.parameters.get_dict()
+        parameters['CONTROL']['calculation'] = 'scf'
+        parameters['CONTROL']['tprnfor'] = True
+        parameters.pop('IONS', None)
+        parameters.pop('CELL', None)
+        parameters.setdefault('ELECTRONS', {})
+        parameters['ELECTRONS']['startingpot'] = 'file'
+        parameters['ELECTRONS']['startingwfc'] = 'file'
+        inputs.pw.parameters = orm.Dict(parameters)
+
+        environ_parameters = inputs.pw.environ_parameters.get_dict()
+        environ_parameters.setdefault('ENVIRON', {})['environ_restart'] = True
+        inputs.pw.environ_parameters = orm.Dict(environ_parameters)
+        inputs.pw.parent_folder = relax_workchain.outputs.remote_folder
+
+        return inputs
 
-        return
-    
     def check_phonopy(self):
         """
-        Check the results of all phonopy calculations. Gather the information
-        as needed to do the postprocess step.
+        Check the results of all phonopy calculations. Gather the forces of the
+        displaced supercells of each structure in a single array.
         """
-        dict_of_forces = AttributeDict()
-        dict_of_forces.vacuum = {}
-        dict_of_forces.solution = {}
-
         self.report(f'Checking phonopy simulations')
-        self.report(f'{self.ctx.phonopy.vacuum.items()}')
-
-        phonopy_pk = []
-        for label, supercells in self.ctx.phonopy.vacuum.items():
-            dict_of_forces['vacuum'][label] = {}
-            for key, supercell in supercells.items():
-                self.report(f'Supercell: {key}')
-                if supercell.is_failed:
-                    phonopy_pk.append(supercell.pk)
-                else:
-                    force_name = f'forces_{key.split("_")[-1]}'
-                    forces = supercell.outputs.output_trajectory.get_array('forces')
-                    self.report(f'Adding {force_name} to dict: {forces}')
-                    dict_of_forces['vacuum'][label][force_name] = forces
-
-        for label, supercells in self.ctx.phonopy.solution.items():
-            dict_of_forces['solution'][label] = {}
-            for key, supercell in supercells.items():
-                if supercell.is_failed:
-                    phonopy_pk.append(supercell.pk)
-                else:
-                    force_name = f'forces_{key.split("_")[-1]}'
-                    forces = supercell.outputs.output_trajectory.get_array('forces')
-                    dict_of_forces['solution'][label][force_name] = forces
-
-        if phonopy_pk:
-            self.report(f'`pKaWorkChain failed at phonopy calculations {" ".join(phonopy_pk)}')
-        else:
-            self.report('phonopy calculations finished')
+        self.ctx.forces = AttributeDict(dictionary={
+            'vacuum': {},
+            'solution': {}
+        })
+
+        failed = set()
+        for environment in self.ctx.environments:
+            for label, supercells in self.ctx.phonopy[environment].items():
+                trajectories = {}
+                for key, supercell in supercells.items():
+                    if not supercell.is_finished_ok:
+                        failed.add(supercell.pk)
+                        continue
+                    trajectories[f'forces_{key.split("_")[-1]}'] = supercell.outputs.output_trajectory
+
+                if len(trajectories) == len(supercells):
+                    self.ctx.forces[environment][label] = collect_forces(**trajectories)
 
-        self.report(f'Dict of forces: {dict_of_forces}')
+        if failed:
+            self.report(f'`pKaWorkChain failed at phonopy calculations {" ".join(map(str, sorted(failed)))}')
+            return self.exit_codes.ERROR_PHONOPY_CALCULATION_FAILED
 
-        self.ctx.forces = dict_of_forces
+        self.report('phonopy calculations finished')
+
+        return
+
+    def should_run_partial_hessian(self):
+        """
+        Return whether the acid and base are displaced for a partial Hessian.
+        """
+        return bool(self.ctx.partial_centers)
+
+    def postprocess_partial_hessian(self):
+        """
+        Compute the partial Hessians of the acid and the base in each environment,
+        and the vibrational free energy of deprotonation.
+        """
+        acid = self.inputs.partial_hessian.acid.value
+        base = self.inputs.partial_hessian.base.value
+        parameters = orm.Dict(dict={
+            'temperature': self.inputs.partial_hessian.temperature.value,
+            'cutoff': self.inputs.partial_hessian.cutoff.value,
+            'shell': self.inputs.partial_hessian.shell.value,
+        })
+
+        vibrational_free_energy = {}
+        for environment in self.ctx.environments:
+            hessians = {}
+            for label in (acid, base):
+                hessians[label] = calc_partial_hessian(
+                    self.ctx[environment][label].outputs.output_structure,
+                    self.ctx.forces[environment][label],
+                    self.ctx.partial_parameters[environment][label],
+                )
+            result = calc_vibrational_free_energy_difference(hessians[acid], hessians[base], parameters)
+            vibrational_free_energy[environment] = result
+            self.report(
+                f'{environment}: partial Hessian delta G_vib = {result["delta_g_vib"]:.4f} eV '
+                f'(region error {result["region_error"]:.4f} eV)'
+            )
+
+        self.out('vibrational_free_energy', vibrational_free_energy)
 
         return
-    
-    def postprocess_phonopy(self):
 
+    def postprocess_phonopy(self):
+        """
+        Calculate the force constants and thermal properties of all the structures,
+        in process or with a `PhonopyCalculation` each.
+        """
         PhonopyCalculation = CalculationFactory("phonopy.phonopy")
-        phonopy_code = self.inputs.phonopy_code
         phonopy_parameters = orm.Dict(dict={
             'EIGENVECTORS': True,
             'DIM': [1, 1, 1],
@@ -492,57 +767,53 @@ class pKaWorkChain(ProtocolMixin, WorkChain):
             'solution': {}
         })
 
-        options = self.inputs.vacuum.base.pw.metadata.options
+        if self.inputs.phonopy_in_process:
+            thermal_parameters = {
+                key: value for key, value in phonopy_parameters.get_dict().items()
+                if key in ('MESH', 'GAMMA_CENTER', 'CUTOFF_FREQUENCY', 'FC_SYMMETRY')
+            }
+            thermal_parameters.update(self.inputs.thermal_parameters.get_dict())
+            thermal_parameters = orm.Dict(dict=thermal_parameters)
+
+            thermal_properties = {environment: {} for environment in self.ctx.environments}
+            for environment in self.ctx.environments:
+                for label, preprocess_data in self.ctx.preprocess_data[environment].items():
+                    phonopy_data = generate_phonopy_data_from_forces(
+                        preprocess_data,
+                        self.ctx.forces[environment][label]
+                    )
+                    thermal_properties[environment][label] = calc_thermal_properties(
+                        phonopy_data, thermal_parameters
+                    )
+
+            self.out('thermal_properties', thermal_properties)
+            self.report('thermal properties calculated in process')
+            return
+
+        phonopy_code = self.inputs.phonopy_code
+        options = self.inputs.solution.base.pw.metadata.options
         phonopy_options = AttributeDict()
         options_list = ['account', 'resources', 'queue_name', 'max_wallclock_seconds']
         for option in options_list:
             phonopy_options[option] = options.get(option, '')
 
-        for label, preprocess_data in self.ctx.preprocess_data.vacuum.items():
-
-            preprocess_data = self.ctx.preprocess_data['vacuum'].get(label)
-
-            # Need to pass all the force information into an ArrayData object
-            forces = ArrayData()
-            dict_of_forces = self.ctx.forces.vacuum.get(label, {})
-            for force in dict_of_forces.keys():
-                forces.set_array("forces", np.array(dict_of_forces[force]) )
-                dict_of_forces[force] = forces
-            dict_of_forces = dict(dict_of_forces)
-            phonopy_data = preprocess_data.calcfunctions.generate_phonopy_data(**dict_of_forces)
-
-            builder = PhonopyCalculation.get_builder()
-            builder.code = phonopy_code
-            builder.phonopy_data = phonopy_data
-            builder.parameters = phonopy_parameters
-            builder.metadata.options = phonopy_options
-            builder.metadata.call_link_label = f'phonopy_vacuum_{label}'
-
-            future = self.submit(builder)
-            self.report(f'submitting `PhonopyCalculation` <PK={future.pk}>.')
-            self.to_context(**{f'phonopy_calcs.vacuum.{label}': future})  
-
-        for label, preprocess_data in self.ctx.preprocess_data.solution.items():
-
-            # Need to pass all the force information into an ArrayData object
-            forces = ArrayData()
-            dict_of_forces = self.ctx.forces.solution.get(label, {})
-            for force in dict_of_forces.keys():
-                forces.set_array("forces", np.array(dict_of_forces[force]) )
-                dict_of_forces[force] = forces
-            dict_of_forces = dict(dict_of_forces)
-            phonopy_data = preprocess_data.calcfunctions.generate_phonopy_data(**dict_of_forces)
-
-            builder = PhonopyCalculation.get_builder()
-            builder.code = phonopy_code
-            builder.phonopy_data = phonopy_data
-            builder.parameters = phonopy_parameters
-            builder.metadata.options = phonopy_options
-            builder.metadata.call_link_label = f'phonopy_solution_{label}'
-
-            future = self.submit(builder)
-            self.report(f'submitting `PhonopyCalculation` <PK={future.pk}>.')
-            self.to_context(**{f'phonopy_calcs.solution.{label}': future}) 
+        for environment in self.ctx.environments:
+            for label, preprocess_data in self.ctx.preprocess_data[environment].items():
+                phonopy_data = generate_phonopy_data_from_forces(
+                    preprocess_data,
+                    self.ctx.forces[environment][label]
+                )
+
+                builder = PhonopyCalculation.get_builder()
+                builder.code = phonopy_code
+                builder.phonopy_data = phonopy_data
+                builder.parameters = phonopy_parameters
+                builder.metadata.options = phonopy_options
+                builder.metadata.call_link_label = f'phonopy_{environment}_{label}'
+
+                future = self.submit(builder)
+                self.report(f'submitting `PhonopyCalculation` <PK={future.pk}>.')
+                self.to_context(**{f'phonopy_calcs.{environment}.{label}': future})
 
         return
 
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 """Workchain to relax a structure using Quantum ESPRESSO pw.x."""
+from copy import deepcopy
+
 from aiida import orm
 from aiida.common import AttributeDict, exceptions
 from aiida.common.lang import type_check
@@ -59,6 +61,14 @@ class EnvPwRelaxWorkChain(ProtocolMixin, WorkChain):
             valid_type = orm.StructureData, 
             help = 'The inputs structure.'
         )
+        spec.input(
+            'parent_folder',
+            valid_type = orm.RemoteData,
+            required = False,
+            help = ('Remote folder of a previous calculation of a similar structure, e.g. in another '
+                    'environment. The first relaxation restarts from its density, wavefunctions and '
+                    'Environ quantities.')
+        )
         spec.input(
             'meta_convergence', 
             valid_type = orm.Bool, 
@@ -351,6 +361,9 @@ class EnvPwRelaxWorkChain(ProtocolMixin, WorkChain):
                 "nbnd"
             ] = self.ctx.current_number_of_bands
 
+        if self.ctx.iteration == 1 and "parent_folder" in self.inputs:
+            inputs = self._get_restart_inputs(inputs)
+
         # Set the `CALL` link label
         inputs.metadata.call_link_label = f"iteration_{self.ctx.iteration:02d}"
 
@@ -361,6 +374,25 @@ class EnvPwRelaxWorkChain(ProtocolMixin, WorkChain):
 
         return ToContext(workchains=append_(running))
 
+    def _get_restart_inputs(self, inputs):
+        """Return a copy of the relaxation inputs that restarts from the `parent_folder`."""
+        inputs = AttributeDict(inputs)
+        inputs.pw = AttributeDict(inputs.pw)
+        inputs.pw.parent_folder = self.inputs.parent_folder
+
+        parameters = deepcopy(inputs.pw.parameters)
+        parameters.setdefault("ELECTRONS", {})
+        parameters["ELECTRONS"]["startingpot"] = "file"
+        parameters["ELECTRONS"]["startingwfc"] = "file"
+        inputs.pw.parameters = parameters
+
+        if "environ_parameters" in inputs.pw:
+            environ_parameters = inputs.pw.environ_parameters.get_dict()
+            environ_parameters.setdefault("ENVIRON", {})["environ_restart"] = True
+            inputs.pw.environ_parameters = orm.Dict(environ_parameters)
+
+        return inputs
+
     def inspect_relax(self):
         """Inspect the results of the last `PwBaseWorkChain`.
 
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from aiida_environ.calculations.adsorbate.post_supercell import _get_surface_energies
+
+
+def test_surface_energies():
+    charges = np.array([-0.5, 0.0, 0.5])
+    free_energies = np.array([[0.1, 0.0, 0.1], [0.5, 0.0, 0.5], [1.25, 1.0, 1.25]])
+    fermi_energies = np.array([[-1.0, 0.0, 1.0], [-0.5, 0.0, 0.5], [-1.0, 0.0, 1.0]])
+    results = _get_surface_energies(
+        charges, free_energies, fermi_energies, [0, 1, 2], -0.5, 0.5
+    )
+
+    assert np.allclose(results["potential"], [-1.0, -0.5, 0.0, 0.5])
+    assert results["grand_potential"].shape == (3, 4)
+    assert np.allclose(results["grand_potential"][0], [-0.4, -0.15, 0.0, -0.15])
+    assert np.allclose(results["active_charge"][0], [-0.5, -0.5, 0.0, 0.5])
+    assert np.array_equal(results["interpolated"][1], [False, True, True, True])
+    # only partial coverages are normalised per adsorbate
+    assert np.allclose(results["surface_energy"][[0, 2]], results["grand_potential"][[0, 2]])
+    assert not np.allclose(results["surface_energy"][1], results["grand_potential"][1])
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from aiida.orm import ArrayData, Dict, StructureData
+
+from aiida_environ.calculations.phonon import calc_thermal_properties, generate_phonopy_data_from_forces
+from aiida_environ.utils.phonon import get_preprocess_data
+
+
+def test_thermal_properties_in_process():
+    structure = StructureData(cell=[[10.0, 0.0, 0.0], [0.0, 10.0, 0.0], [0.0, 0.0, 10.0]])
+    structure.append_atom(position=[5.0, 5.0, 5.0], symbols="O")
+    structure.append_atom(position=[5.76, 5.59, 5.0], symbols="H")
+    structure.append_atom(position=[4.24, 5.59, 5.0], symbols="H")
+    preprocess_data = get_preprocess_data(structure, is_symmetry=False)
+
+    # forces of a harmonic model with a random positive definite Hessian
+    matrix = np.random.default_rng(0).normal(size=(9, 9))
+    hessian = 10 * matrix @ matrix.T
+    sets_of_forces = []
+    for atom, *displacement in preprocess_data.get_displacements():
+        vector = np.zeros(9)
+        vector[3 * atom:3 * atom + 3] = displacement
+        sets_of_forces.append(-(hessian @ vector).reshape(3, 3))
+    forces = ArrayData()
+    forces.set_array("forces", np.array(sets_of_forces))
+
+    phonopy_data = generate_phonopy_data_from_forces(preprocess_data, forces)
+    parameters = Dict({"TMIN": 0.0, "TMAX": 300.0, "TSTEP": 100.0, "CUTOFF_FREQUENCY": 0.1})
+    result = calc_thermal_properties(phonopy_data, parameters)
+
+    assert np.allclose(result.get_array("temperatures"), [0.0, 100.0, 200.0, 300.0])
+    assert result.get_array("force_constants").shape == (3, 3, 3, 3)
+    # the free energy at 0 K is the zero point energy, in kJ/mol from frequencies in THz
+    frequencies = result.get_array("frequencies").ravel()
+    zero_point_energy = 0.5 * np.sum(frequencies[frequencies > 0.1]) * 4.135667696e-3 * 96.485332
+    assert np.isclose(result.get_array("free_energy")[0], zero_point_energy, rtol=1e-4)
+    assert np.all(np.diff(result.get_array("free_energy")) < 0)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from aiida.common.links import LinkType
+from aiida.orm import Dict
+
+from aiida_environ.calculations.optimize import collect_validation, initialize_solvent_parameters
+from aiida_environ.workflows.pw.optimization import _get_default_optimizer_parameters
+
+
+def test_initial_state_provenance():
+    settings = _get_default_optimizer_parameters().get_dict()
+    settings["parameters"] = ["gamma", "alpha"]
+    parameters = Dict({"alpha": 1.12, "beta": 0.0, "gamma": 50.0})
+    state = initialize_solvent_parameters(parameters, Dict(settings))
+
+    # the state follows the order of the optimised parameters and is linked to its starting values
+    assert state["parameters"] == ["gamma", "alpha"]
+    assert state["x"] == [50.0, 1.12]
+    assert state.creator.base.links.get_incoming(link_type=LinkType.INPUT_CALC).get_node_by_label(
+        "parameters"
+    ).uuid == parameters.uuid
+
+
+def test_collect_validation():
+    validation = collect_validation(
+        parameters_0=Dict({"alpha": 1.1}),
+        partials_0=Dict({"mse": 0.2}),
+        parameters_1=Dict({"alpha": 1.2}),
+        partials_1=Dict({"mse": 0.1}),
+    )
+
+    assert [entry["mse"] for entry in validation["history"]] == [0.2, 0.1]
+    assert validation["best_parameters"] == {"alpha": 1.2}
+    assert validation["best_mse"] == 0.1
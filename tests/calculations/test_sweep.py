@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from aiida.common.links import LinkType
+from aiida.engine import ProcessState
+from aiida.orm import CalculationNode, Dict
+
+from aiida_environ.calculations.sweep import collect_parameter_results
+
+
+def _get_calculation(boundary, energy, exit_status=0):
+    node = CalculationNode()
+    node.base.links.add_incoming(
+        Dict({"ENVIRON": {"verbose": 1}, "BOUNDARY": boundary}).store(), LinkType.INPUT_CALC, "pw__environ_parameters"
+    )
+    node.set_process_state(ProcessState.FINISHED)
+    node.set_exit_status(exit_status)
+    node.store()
+    output = Dict({"energy": energy})
+    output.base.links.add_incoming(node, LinkType.CREATE, "output_parameters")
+    output.store()
+    return node
+
+
+def test_collect_parameter_results():
+    boundaries = [
+        {"alpha": 1.1, "field_factor": 0.1, "field_asymmetry": -0.2},
+        {"alpha": 1.2, "field_factor": 0.0, "field_asymmetry": 0.3},
+        {"alpha": 1.3},
+    ]
+    acid = [_get_calculation(boundary, -10.0 - k) for k, boundary in enumerate(boundaries)]
+    base = [
+        _get_calculation(boundaries[0], -9.0),
+        _get_calculation(boundaries[1], -9.5, exit_status=400),
+        _get_calculation(boundaries[2], -11.0),
+    ]
+
+    # the rows follow the given order of the calculations, not their PKs
+    order = [2, 0, 1]
+    table = collect_parameter_results(
+        Dict({"acid": [acid[k].pk for k in order], "base": [base[k].pk for k in order]})
+    )
+
+    np.testing.assert_array_equal(table.get_array("alpha"), [1.3, 1.1, 1.2])
+    np.testing.assert_array_equal(table.get_array("field_factor"), [np.nan, 0.1, 0.0])
+    np.testing.assert_array_equal(table.get_array("field_asymmetry"), [np.nan, -0.2, 0.3])
+    np.testing.assert_array_equal(table.get_array("acid_energy"), [-12.0, -10.0, -11.0])
+    np.testing.assert_array_equal(table.get_array("base_energy"), [-11.0, -9.0, np.nan])
+    np.testing.assert_allclose(table.get_array("energy_difference"), [1.0, 1.0, np.nan])
+    np.testing.assert_array_equal(table.get_array("base_exit_status"), [0, 0, 400])
@@ -581,7 +581,7 @@ def generate_inputs_pw_adsorbate(
         )
         inputs = {
             "code": fixture_code("environ.pw"),
-            "structure": generate_structure("molybenum sulfide"),
+            "structure": generate_structure("molybdenum sulfide"),
             "kpoints": generate_kpoints_mesh(1),
             "parameters": parameters,
             "pseudos": {"Mo": generate_upf_data("Mo"), "S": generate_upf_data("S")},
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from aiida.common.links import LinkType
+from aiida.engine import ProcessState
+from aiida.orm import Dict, Int, WorkflowNode
+
+from aiida_environ.utils.cache import (
+    find_finished_process,
+    find_finished_processes,
+    get_content_hash,
+    get_lookup_inputs,
+)
+from aiida_environ.workflows.pw.base import EnvPwBaseWorkChain
+
+
+def _get_finished_process(**inputs):
+    node = WorkflowNode(process_type=EnvPwBaseWorkChain.build_process_type())
+    for link_label, input_node in inputs.items():
+        node.base.links.add_incoming(input_node.store(), LinkType.INPUT_WORK, link_label)
+    node.set_process_state(ProcessState.FINISHED)
+    node.set_exit_status(0)
+    return node.store()
+
+
+def test_find_finished_process_requires_unset_inputs_absent():
+    parameters = Dict({"CONTROL": {"calculation": "scf", "tprnfor": True}}).store()
+    settings = Dict({"FIXED_COORDS": [[True, True, True]]}).store()
+    with_settings = _get_finished_process(pw__parameters=parameters, pw__settings=settings)
+
+    lookup = get_lookup_inputs({"pw": {"parameters": parameters}})
+    assert lookup["pw__settings"] is None
+    assert find_finished_process(EnvPwBaseWorkChain, lookup) is None
+
+    lookup = get_lookup_inputs({"pw": {"parameters": parameters, "settings": settings}})
+    assert find_finished_process(EnvPwBaseWorkChain, lookup).pk == with_settings.pk
+
+    distance = Int(1).store()
+    without_settings = _get_finished_process(pw__parameters=parameters, kpoints_distance=distance)
+    lookup = get_lookup_inputs({"pw": {"parameters": parameters}})
+    assert find_finished_process(EnvPwBaseWorkChain, lookup) is None
+
+    lookup = get_lookup_inputs({"pw": {"parameters": parameters}, "kpoints_distance": distance})
+    assert find_finished_process(EnvPwBaseWorkChain, lookup).pk == without_settings.pk
+
+
+def test_content_hash_of_unstored_node():
+    parameters = Dict({"SYSTEM": {"tot_charge": 0.2}})
+    content_hash = get_content_hash(parameters)
+
+    assert content_hash == get_content_hash(parameters.store())
+    assert content_hash == get_content_hash(Dict({"SYSTEM": {"tot_charge": 0.2}}))
+
+
+def test_find_finished_processes_limit_with_absent_inputs():
+    parameters = Dict({"CONTROL": {"calculation": "scf", "tstress": True}}).store()
+    settings = Dict({"FIXED_COORDS": [[False, False, True]]}).store()
+    without_settings = [_get_finished_process(pw__parameters=parameters) for _ in range(3)]
+    with_settings = []
+    # the most recent processes have an input that must be absent, they are skipped page by page
+    for _ in range(3):
+        with_settings.append(_get_finished_process(pw__parameters=parameters, pw__settings=settings))
+
+    lookup = get_lookup_inputs({"pw": {"parameters": parameters}})
+    processes = find_finished_processes(EnvPwBaseWorkChain, lookup, limit=2)
+    assert [process.pk for process in processes] == [node.pk for node in without_settings[:0:-1]]
+    pks = {process.pk for process in find_finished_processes(EnvPwBaseWorkChain, lookup)}
+    assert {node.pk for node in without_settings} <= pks
+    assert pks.isdisjoint(node.pk for node in with_settings)
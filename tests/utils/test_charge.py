@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from aiida_environ.utils.charge import (
+    get_charge_range,
+    get_lower_envelope,
+    get_refined_charges,
+)
+
+
+def test_lower_envelope():
+    charges = [-1.0, 0.0, 1.0]
+    free_energies = np.array([[0.5, 0.0, 0.5]])
+    envelope, active = get_lower_envelope(charges, free_energies, [-1.0, 0.0, 1.0])
+
+    assert np.allclose(envelope, [[-0.5, 0.0, -0.5]])
+    assert np.array_equal(active, [[0, 1, 2]])
+
+
+def test_refined_charges():
+    charges = get_charge_range(1.0, 0.5)
+    fermi_energies = np.tile(np.linspace(-1.0, 1.0, len(charges)), (2, 1))
+    # the two structures cross at U = 0.1, where the charge 0.0 is active
+    free_energies = np.array([0.5 * np.square(charges), 0.5 * np.square(charges)])
+    new_charges = get_refined_charges(
+        charges, free_energies, fermi_energies, [0, 1], 0.1, 0.1
+    )
+
+    assert new_charges == [-0.2, 0.2]
+    assert get_refined_charges(
+        charges, free_energies, fermi_energies, [0, 1], 0.1, 0.5
+    ) == []
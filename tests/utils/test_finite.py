@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from aiida_environ.calculations.finite import _calculate_differences
+from aiida_environ.utils.finite import (
+    finite_difference,
+    get_default_accuracy,
+    get_stencil,
+    richardson_extrapolation,
+)
+
+
+@pytest.mark.parametrize(
+    "derivative, diff_type, accuracy, offsets, weights",
+    [
+        (1, "forward", 1, [0, 1], [-1.0, 1.0]),
+        (1, "backward", 1, [-1, 0], [-1.0, 1.0]),
+        (1, "central", 2, [-1, 0, 1], [-0.5, 0.0, 0.5]),
+        (2, "central", 2, [-1, 0, 1], [1.0, -2.0, 1.0]),
+        (1, "central", 4, [-2, -1, 0, 1, 2], [1 / 12, -2 / 3, 0.0, 2 / 3, -1 / 12]),
+    ],
+)
+def test_stencil(derivative, diff_type, accuracy, offsets, weights):
+    result = get_stencil(derivative, diff_type, accuracy)
+
+    assert np.array_equal(result[0], offsets)
+    assert np.allclose(result[1], weights)
+
+
+def test_finite_difference_components():
+    step = 0.1
+    x = np.arange(7) * step
+    # two independent components
+    values = np.stack([x**3, np.sin(x)], axis=1)
+    indices, derivatives = finite_difference(values, step, 1, "central", 4)
+
+    assert np.array_equal(indices, [2, 3, 4])
+    assert derivatives.shape == (3, 2)
+    assert np.allclose(derivatives[:, 0], 3 * x[indices] ** 2)
+    assert np.allclose(derivatives[:, 1], np.cos(x[indices]), atol=1e-6)
+
+
+def test_finite_difference_too_few_points():
+    with pytest.raises(ValueError):
+        finite_difference(np.zeros(2), 0.1, 2, "forward")
+
+
+def test_richardson_extrapolation():
+    x = 0.3
+    steps = 0.2 / 2 ** np.arange(3)
+    central = (np.sin(x + steps) - np.sin(x - steps)) / (2 * steps)
+    best, error = richardson_extrapolation(central)
+
+    assert abs(best - np.cos(x)) < 1e-8
+    assert abs(best - np.cos(x)) < error < abs(central[-1] - np.cos(x))
+
+    _, error = richardson_extrapolation(central[:1])
+    assert np.isinf(error)
+
+
+@pytest.mark.parametrize(
+    "diff_type, indices, offset",
+    [("central", [1, 2, 3, 4, 5], 0.0), ("forward", [0, 1, 2, 3, 4], 1.0), ("backward", [2, 3, 4, 5, 6], -1.0)],
+)
+def test_second_order_differences(diff_type, indices, offset):
+    step = 0.1
+    x = np.arange(7) * step
+    # E = x^3 with the exact derivative dE/dx = 3x^2, so d2E/dx2 = dF/dx = 6x
+    indices_, finite_differences, force_differences = _calculate_differences(
+        x**3, 3 * x**2, step, diff_type, "second", get_default_accuracy(diff_type)
+    )
+
+    assert np.array_equal(indices_, indices)
+    # the 3-point one-sided second difference is 6x + 6h (forward) and the 2-point force difference 6x + 3h
+    assert np.allclose(finite_differences, 6 * x[indices] + 6 * offset * step)
+    assert np.allclose(force_differences, 6 * x[indices] + 3 * offset * step)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from aiida.orm import StructureData
+
+from aiida_environ.utils.hessian import (
+    find_removed_proton,
+    get_active_atoms,
+    get_displacements,
+    get_partial_hessian,
+    get_wavenumbers,
+)
+
+
+def _get_molecule(sites):
+    structure = StructureData(cell=[[10.0, 0.0, 0.0], [0.0, 10.0, 0.0], [0.0, 0.0, 10.0]])
+    for symbol, position in sites:
+        structure.append_atom(position=position, symbols=symbol)
+    return structure
+
+
+def test_find_removed_proton():
+    methanol = [
+        ("C", [5.0, 5.0, 5.0]),
+        ("O", [6.4, 5.0, 5.0]),
+        ("H", [4.6, 6.0, 5.0]),
+        ("H", [6.7, 5.9, 5.0]),
+        ("H", [4.6, 4.5, 5.9]),
+    ]
+    acid = _get_molecule(methanol)
+    base = _get_molecule(methanol[:3] + methanol[4:])
+
+    assert find_removed_proton(acid, base) == (3, 1, 1)
+
+    active, distances = get_active_atoms(acid, 1, 1.2)
+    assert active.tolist() == [1, 3]
+    assert np.isclose(distances[0], 0.0)
+
+
+def test_partial_hessian_of_harmonic_model():
+    rng = np.random.default_rng(0)
+    nat = 4
+    active = [1, 3]
+    matrix = rng.normal(size=(3 * nat, 3 * nat))
+    hessian = matrix @ matrix.T
+
+    distance = 0.01
+    forces = []
+    for atom, displacement in get_displacements(active, distance):
+        vector = np.zeros(3 * nat)
+        vector[3 * atom:3 * atom + 3] = displacement
+        forces.append(-(hessian @ vector).reshape(nat, 3))
+
+    coordinates = np.concatenate([np.arange(3 * atom, 3 * atom + 3) for atom in active])
+    expected = hessian[np.ix_(coordinates, coordinates)]
+
+    assert np.allclose(get_partial_hessian(forces, active, distance), expected)
+    # a single unit mass oscillator with a unit force constant
+    assert np.allclose(get_wavenumbers(np.eye(3), [1.0]), 521.4709)
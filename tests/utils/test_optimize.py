@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import json
+
+import numpy as np
+import pytest
+
+from aiida_environ.utils.optimize import (
+    get_best_point,
+    get_initial_state,
+    optimizer_step,
+)
+
+
+def _minimize(method, learning_rate, iterations):
+    curvature = np.diag([1.0, 100.0, 10.0])
+    center = np.array([1.2, -0.3, 60.0])
+    state = get_initial_state(
+        [1.0, 0.0, 50.0],
+        [0.9, -1.0, 0.0],
+        [1.1, 1.0, 100.0],
+        method,
+        scales=[0.1, 0.1, 5.0],
+        learning_rate=learning_rate,
+    )
+    for _ in range(iterations):
+        x = np.array(state["x"])
+        f = float((x - center) @ curvature @ (x - center))
+        state = optimizer_step(state, f, 2 * curvature @ (x - center))
+        # the state must survive a round trip through the database
+        state = json.loads(json.dumps(state))
+
+    return state
+
+
+def test_lbfgsb_bounds():
+    state = _minimize("lbfgsb", 0.5, 30)
+
+    assert np.allclose(get_best_point(state), [1.1, -0.3, 60.0])
+    assert state["projected_gradient"] < 1e-6
+
+
+def test_adam_decreases():
+    state = _minimize("adam", 0.1, 30)
+
+    assert state["best_f"] < state["history"][0]["f"]
+    assert np.all(np.array(state["x"]) <= [1.1, 1.0, 100.0])
+
+
+def test_invalid_method():
+    with pytest.raises(ValueError):
+        get_initial_state([1.0], [0.0], [2.0], "newton")
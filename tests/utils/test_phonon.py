@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from aiida.orm import StructureData
+
+from aiida_environ.utils.phonon import get_preprocess_data, plan_displacements
+
+
+def _get_water(noise=1e-4):
+    structure = StructureData(cell=[[10.0, 0.0, 0.0], [0.0, 10.0, 0.0], [0.0, 0.0, 10.0]])
+    structure.append_atom(position=[5.0, 5.0, 5.0], symbols="O")
+    structure.append_atom(position=[5.76, 5.59, 5.0 + noise], symbols="H")
+    structure.append_atom(position=[4.24, 5.59, 5.0], symbols="H")
+    return structure
+
+
+def test_symmetry_reduces_displacements():
+    structure = _get_water()
+    reduced = get_preprocess_data(structure, symprec=1e-3).get_supercells_with_displacements()
+    full = get_preprocess_data(structure, is_symmetry=False).get_supercells_with_displacements()
+
+    assert len(full) == 18
+    assert len(reduced) == 6
+
+
+def test_plan_displacements_deduplicates():
+    supercells = {}
+    for label in ("first", "second"):
+        preprocess_data = get_preprocess_data(_get_water())
+        supercells[label] = preprocess_data.calcfunctions.get_supercells_with_displacements()
+    supercells["other"] = get_preprocess_data(
+        _get_water(noise=0.0)
+    ).calcfunctions.get_supercells_with_displacements()
+
+    unique, mapping = plan_displacements(supercells)
+
+    assert mapping["first"] == mapping["second"]
+    assert set(mapping["other"].values()).isdisjoint(mapping["first"].values())
+    assert len(unique) == len(supercells["first"]) + len(supercells["other"])
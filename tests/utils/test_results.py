@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from aiida.common.links import LinkType
+from aiida.engine import ProcessState
+from aiida.orm import ArrayData, CalculationNode, Dict
+
+from aiida_environ.utils.results import load_output_arrays, load_output_parameters
+
+
+def _get_process(exit_status=0, **outputs):
+    node = CalculationNode()
+    if exit_status is None:
+        node.set_process_state(ProcessState.RUNNING)
+    else:
+        node.set_process_state(ProcessState.FINISHED)
+        node.set_exit_status(exit_status)
+    node.store()
+    for link_label, output in outputs.items():
+        output.base.links.add_incoming(node, LinkType.CREATE, link_label)
+        output.store()
+    return node
+
+
+def _get_forces(value):
+    forces = ArrayData()
+    forces.set_array("forces", np.full((2, 3, 3), value))
+    return forces
+
+
+def test_load_output_parameters():
+    first = _get_process(output_parameters=Dict({"energy": -1.0, "qm_surface": [10.0, 12.0]}))
+    second = _get_process(output_parameters=Dict({"energy": -2.0}))
+    failed = _get_process(exit_status=410, output_parameters=Dict({"energy": -3.0}))
+    running = _get_process(exit_status=None)
+
+    # the results follow the order of the identifiers, which may mix PKs and UUIDs and contain duplicates
+    identifiers = [second.pk, first.uuid, failed.pk, running.pk, second.pk]
+    results = load_output_parameters(identifiers, ["energy", "qm_surface"])
+
+    np.testing.assert_array_equal(results["energy"], [-2.0, -1.0, -3.0, np.nan, -2.0])
+    # lists are reduced to their last value, missing keys and outputs are NaN
+    np.testing.assert_array_equal(results["qm_surface"], [np.nan, 12.0, np.nan, np.nan, np.nan])
+    np.testing.assert_array_equal(results["exit_status"], [0, 0, 410, np.nan, 0])
+
+
+def test_load_output_parameters_missing_process():
+    process = _get_process(output_parameters=Dict({"energy": -1.0}))
+
+    assert load_output_parameters([], ["energy"])["energy"].shape == (0,)
+    with pytest.raises(ValueError):
+        load_output_parameters([process.pk, "00000000-0000-0000-0000-000000000000"], ["energy"])
+
+
+def test_load_output_arrays():
+    first = _get_process(output_trajectory=_get_forces(1.0))
+    second = _get_process(output_trajectory=_get_forces(2.0))
+
+    arrays = load_output_arrays([second.uuid, first.pk, second.pk], "forces")
+    assert [array.shape for array in arrays] == [(3, 3)] * 3
+    assert [array[0, 0] for array in arrays] == [2.0, 1.0, 2.0]
+
+    (array,) = load_output_arrays([first.pk], "forces", frame=None)
+    assert array.shape == (2, 3, 3)
+
+    with pytest.raises(ValueError):
+        load_output_arrays([first.pk, _get_process().pk], "forces")
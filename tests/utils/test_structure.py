@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from aiida_environ.utils.structure import StructureFactory, structures_match
+
+
+def test_build_appends_sites(generate_structure):
+    structure = generate_structure("molybdenum sulfide")
+    factory = StructureFactory(structure)
+    positions = np.array([[0.0, 0.0, 14.0], [1.0, 0.0, 14.0], [0.0, 1.0, 14.0]])
+    new_structure = factory.build(positions, ["H", "S", "H"])
+
+    assert len(new_structure.sites) == 6
+    assert sorted(new_structure.get_kind_names()) == ["H", "Mo", "S"]
+    assert [site.kind_name for site in new_structure.sites[3:]] == ["H", "S", "H"]
+    assert np.allclose([site.position for site in new_structure.sites[3:]], positions)
+    # the host structure is left untouched
+    assert len(structure.sites) == 3
+
+
+def test_axis_mean(generate_structure):
+    structure = generate_structure("molybdenum sulfide")
+    factory = StructureFactory(structure)
+    expected = np.mean([site.position[2] for site in structure.sites])
+
+    assert np.isclose(factory.get_axis_mean(3), expected)
+
+
+def test_displace(generate_structure):
+    structure = generate_structure("molybdenum sulfide")
+    factory = StructureFactory(structure)
+    new_structure = factory.displace(1, [0.0, 0.0, 0.1])
+    expected = np.array(structure.sites[1].position) + [0.0, 0.0, 0.1]
+
+    assert np.allclose(new_structure.sites[1].position, expected)
+    assert np.allclose(new_structure.sites[0].position, structure.sites[0].position)
+    assert new_structure.get_kind_names() == structure.get_kind_names()
+
+
+def test_structures_match(generate_structure):
+    structure = generate_structure("molybdenum sulfide")
+    factory = StructureFactory(structure)
+
+    assert structures_match(structure, factory.displace(1, [0.0, 0.0, 1e-5]))
+    assert not structures_match(structure, factory.displace(1, [0.0, 0.0, 1e-2]))
+    assert structures_match(structure, factory.displace(1, [0.0, 0.0, 1e-2]), tolerance=2e-2)
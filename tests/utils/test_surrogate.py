@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from aiida_environ.utils.surrogate import (
+    GaussianProcess,
+    expected_improvement,
+    latin_hypercube,
+    propose_batch,
+)
+
+
+def test_latin_hypercube():
+    rng = np.random.default_rng(0)
+    points = latin_hypercube(8, [0.0, 1.0], [1.0, 3.0], rng)
+    unit = (points - [0.0, 1.0]) / [1.0, 2.0]
+
+    # one point in each of the 8 intervals of each dimension
+    for column in unit.T:
+        assert sorted(np.floor(column * 8).astype(int)) == list(range(8))
+
+
+def test_gaussian_process_interpolates():
+    x = np.linspace(0.0, 1.0, 6)[:, None]
+    y = np.sin(3 * x[:, 0])
+    mean, std = GaussianProcess().fit(x, y).predict(x)
+
+    assert np.allclose(mean, y, atol=1e-3)
+    assert np.all(std < 1e-2)
+
+
+def test_expected_improvement():
+    ei = expected_improvement([0.0, 1.0, 1.0], [0.0, 0.0, 1.0], 0.5)
+
+    assert np.allclose(ei[:2], [0.5, 0.0])
+    assert ei[2] > 0.0
+
+
+def test_propose_batch_minimises():
+    rng = np.random.default_rng(0)
+
+    def objective(x):
+        return np.sum((x - [0.3, 1.2]) ** 2, axis=-1)
+
+    x = latin_hypercube(5, [0.0, 1.0], [1.0, 2.0], rng)
+    y = objective(x)
+    for _ in range(4):
+        points, improvement = propose_batch(x, y, [0.0, 1.0], [1.0, 2.0], 3, rng)
+        assert points.shape == (3, 2)
+        assert len(improvement) == 3
+        x = np.vstack([x, points])
+        y = np.append(y, objective(points))
+
+    assert y.min() < 1e-3
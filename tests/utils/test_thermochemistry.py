@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from aiida.orm import List
+
+from aiida_environ.utils.hessian import get_vibrational_free_energy
+from aiida_environ.utils.thermochemistry import get_pka, get_thermochemistry, get_vibrational_modes
+from aiida_environ.workflows.pka.acid_base import validate_temperatures
+
+
+def test_harmonic_limit():
+    wavenumbers = [50.0, 400.0, 1600.0, 3700.0]
+    temperatures = [100.0, 298.15, 500.0]
+    result = get_thermochemistry(wavenumbers, temperatures, quasi_rrho_cutoff=0.0)
+
+    expected = [get_vibrational_free_energy(wavenumbers, temperature, cutoff=0.0) for temperature in temperatures]
+    assert np.allclose(result["free_energy"], expected)
+    assert np.isclose(result["zero_point_energy"], 0.5 * 1.239841984e-4 * np.sum(wavenumbers))
+
+
+def test_quasi_rrho_damps_soft_modes():
+    harmonic = get_thermochemistry([10.0, 3000.0], [298.15], quasi_rrho_cutoff=0.0)
+    corrected = get_thermochemistry([10.0, 3000.0], [298.15], quasi_rrho_cutoff=100.0)
+
+    # the entropy of a 10 cm^-1 mode diverges in the harmonic approximation
+    assert corrected["entropy"][0] < harmonic["entropy"][0]
+    # stiff modes are unchanged
+    stiff = get_thermochemistry([3000.0], [298.15], quasi_rrho_cutoff=100.0)
+    assert np.isclose(stiff["entropy"][0], get_thermochemistry([3000.0], [298.15], 0.0)["entropy"][0], rtol=1e-6)
+
+
+def test_vibrational_modes_and_pka():
+    wavenumbers = [-3.0, 1.0, 0.5, -0.2, 2.0, 4.0, -80.0, 1600.0]
+    assert np.allclose(get_vibrational_modes(wavenumbers), [-80.0, 1600.0])
+    # 1 pKa unit is RT ln(10), 0.0592 eV at room temperature
+    assert np.isclose(get_pka(0.0592, 298.15), 1.0, atol=1e-3)
+
+
+def test_validate_temperatures():
+    assert validate_temperatures(List(list=[273.15, 298.15]), None) is None
+    assert validate_temperatures(List(list=[]), None) is not None
+    assert validate_temperatures(List(list=[0.0, 298.15]), None) is not None
+    assert validate_temperatures(List(list=[-10.0]), None) is not None
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import pytest
+from aiida.orm import Dict, Int, Str
+from aiida.plugins import WorkflowFactory
+
+PwRelaxWorkChain = WorkflowFactory("environ.pw.relax")
+
+
+@pytest.fixture
+def generate_inputs_relax_phonon(generate_inputs_pw):
+    """Generate inputs for an ``EnvRelaxPhononWorkChain``."""
+
+    def _generate_inputs_relax_phonon(relax_mode="auto", parallel_relax_max_atoms=20):
+        pw = generate_inputs_pw()
+        kpoints = pw.pop("kpoints")
+        parameters = pw["parameters"].get_dict()
+        parameters["CONTROL"]["calculation"] = "relax"
+        pw["parameters"] = Dict(parameters)
+
+        inputs = {
+            "structure": pw.pop("structure"),
+            "relax_mode": Str(relax_mode),
+            "parallel_relax_max_atoms": Int(parallel_relax_max_atoms),
+        }
+        for environment, permittivity in (("vacuum", 1.0), ("solution", 78.3)):
+            environ_parameters = Dict({"ENVIRON": {"env_static_permittivity": permittivity}})
+            inputs[environment] = {"base": {"pw": {**pw, "environ_parameters": environ_parameters}, "kpoints": kpoints}}
+        return inputs
+
+    return _generate_inputs_relax_phonon
+
+
+def _validate_relax_inputs(relax_inputs, structure, permittivity):
+    assert PwRelaxWorkChain.spec().inputs.validate(relax_inputs) is None
+    assert relax_inputs.structure.uuid == structure.uuid
+    environ_parameters = relax_inputs.base.pw.environ_parameters.get_dict()
+    assert environ_parameters["ENVIRON"]["env_static_permittivity"] == permittivity
+
+
+@pytest.mark.parametrize("relax_mode, parallel_relax_max_atoms", [("parallel", 20), ("auto", 2)])
+def test_parallel_relax_inputs(generate_workchain, generate_inputs_relax_phonon, relax_mode, parallel_relax_max_atoms):
+    inputs = generate_inputs_relax_phonon(relax_mode, parallel_relax_max_atoms)
+    process = generate_workchain("environ.pka.env_relax_phonon", inputs)
+
+    assert process.setup() is None
+    assert process.should_relax_in_parallel()
+    for environment, permittivity in (("vacuum", 1.0), ("solution", 78.3)):
+        relax_inputs = process._get_relax_inputs(environment)
+        _validate_relax_inputs(relax_inputs, inputs["structure"], permittivity)
+        assert "parent_folder" not in relax_inputs
+
+
+@pytest.mark.parametrize("relax_mode, parallel_relax_max_atoms", [("restart", 20), ("auto", 1)])
+def test_restart_relax_inputs(
+    generate_workchain,
+    generate_inputs_relax_phonon,
+    generate_remote_data,
+    fixture_localhost,
+    relax_mode,
+    parallel_relax_max_atoms,
+):
+    inputs = generate_inputs_relax_phonon(relax_mode, parallel_relax_max_atoms)
+    process = generate_workchain("environ.pka.env_relax_phonon", inputs)
+    remote_folder = generate_remote_data(fixture_localhost, "/tmp").store()
+
+    assert process.setup() is None
+    assert not process.should_relax_in_parallel()
+    relax_inputs = process._get_relax_inputs("solution", remote_folder)
+    _validate_relax_inputs(relax_inputs, inputs["structure"], 78.3)
+    assert relax_inputs.parent_folder.uuid == remote_folder.uuid
+
+
+def test_invalid_relax_mode(generate_workchain, generate_inputs_relax_phonon):
+    process = generate_workchain("environ.pka.env_relax_phonon", generate_inputs_relax_phonon("concurrent"))
+
+    assert process.setup() == process.exit_codes.ERROR_INVALID_RELAX_MODE
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import pytest
+from aiida.common.links import LinkType
+from aiida.engine import ProcessState
+from aiida.engine.utils import instantiate_process
+from aiida.manage.manager import get_manager
+from aiida.orm import Dict, List, WorkflowNode
+
+from aiida_environ.calculations.adsorbate.gen_supercell import gen_hydrogen
+from aiida_environ.utils.cache import get_lookup_inputs
+from aiida_environ.workflows.pw.grandcanonical import AdsorbateGrandCanonical, _make_run
+
+
+@pytest.fixture
+def generate_grandcanonical(generate_inputs_pw_adsorbate, generate_upf_data):
+    """Generate an ``AdsorbateGrandCanonical`` with the charges -0.2, 0.0 and 0.2 and no adsorbate structures."""
+
+    def _generate_grandcanonical(**kwargs):
+        pw = generate_inputs_pw_adsorbate()
+        structure = pw.pop("structure")
+        kpoints = pw.pop("kpoints")
+        calculation_parameters = {"charge_max": 0.2, "charge_increment": 0.2, **kwargs}
+        inputs = {
+            "base": {"pw": {**pw, "environ_parameters": Dict({"ENVIRON": {"verbose": 0}})}, "kpoints": kpoints},
+            "vacancies": List(list=[]),
+            "bulk_structure": structure,
+            "mono_structure": structure,
+            "calculation_parameters": Dict(calculation_parameters),
+        }
+        process = instantiate_process(get_manager().get_runner(), AdsorbateGrandCanonical, **inputs)
+        # the pseudopotentials are created for each calculation, like the charge dependent inputs
+        process._get_pseudos = lambda structure: {kind.name: generate_upf_data(kind.symbol) for kind in structure.kinds}
+
+        assert process.setup() is None
+        process.ctx.struct_list = []
+        process.ctx.num_adsorbate = []
+        process.ctx.adsorbate_structure = gen_hydrogen()
+        return process
+
+    return _generate_grandcanonical
+
+
+def _get_finished_process(process_class, inputs):
+    node = WorkflowNode(process_type=process_class.build_process_type())
+    for link_label, input_node in get_lookup_inputs(inputs).items():
+        if input_node is not None:
+            node.base.links.add_incoming(input_node.store(), LinkType.INPUT_WORK, link_label)
+    node.set_process_state(ProcessState.FINISHED)
+    node.set_exit_status(0)
+    return node.store()
+
+
+def test_plan_reuses_finished_calculations(generate_grandcanonical):
+    process = generate_grandcanonical()
+
+    assert process.plan() is None
+    labels = [run["label"] for run in process.ctx.runs]
+    assert set(labels) <= {"smono_c0", "smono_c1", "smono_c2", "sbulk", "sads_neutral"}
+
+    # a calculation with the same content, whose charges, parameters and pseudopotentials were created independently
+    run = _make_run("smono_c2", [0.2, "mono"], process.inputs.mono_structure.pk, 2)
+    node = _get_finished_process(*process._get_run_inputs(run))
+
+    process.ctx.charge_range = []
+    process.ctx.calculation_details = {}
+    assert process.plan() is None
+    assert [run["label"] for run in process.ctx.runs] == [label for label in labels if label != "smono_c2"]
+    assert process.ctx.calculation_details[0.2]["mono"] == node.pk
+
+
+def test_plan_cost_budget(generate_grandcanonical):
+    # the three monolayer and the bulk calculations cost one monolayer calculation each, the hydrogen molecule 8/27
+    assert generate_grandcanonical(cost_budget=4.5, reuse_calculations=False).plan() is None
+
+    process = generate_grandcanonical(cost_budget=4.0, reuse_calculations=False)
+    assert process.plan() == process.exit_codes.ERROR_COST_BUDGET_EXCEEDED
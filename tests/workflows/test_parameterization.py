@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from types import SimpleNamespace
+
+import pytest
+from aiida.common.links import LinkType
+from aiida.engine import ProcessState
+from aiida.engine.utils import instantiate_process
+from aiida.manage.manager import get_manager
+from aiida.orm import Bool, Dict, List, Str, WorkflowNode
+
+from aiida_environ.utils.cache import get_lookup_inputs
+from aiida_environ.workflows.pw import parameterization
+from aiida_environ.workflows.pw.base import EnvPwBaseWorkChain
+from aiida_environ.workflows.pw.parameterization import ParameterizationWorkChain
+
+
+@pytest.fixture
+def generate_parameterization(monkeypatch, generate_inputs_pw, generate_upf_data):
+    """Generate a ``ParameterizationWorkChain`` of a single silicon solute, whose calls are recorded."""
+    monkeypatch.setattr(
+        parameterization,
+        "get_pseudos_from_structure",
+        lambda structure, label: {kind.name: generate_upf_data(kind.symbol) for kind in structure.kinds},
+    )
+
+    def _generate_parameterization(**kwargs):
+        pw = generate_inputs_pw()
+        structure = pw.pop("structure").store()
+        pw.pop("pseudos")
+        kpoints = pw.pop("kpoints")
+        environ_parameters = Dict({"ENVIRON": {"env_static_permittivity": 78.3}, "BOUNDARY": {"alpha": 1.12}})
+        inputs = {
+            "base": {"pw": {**pw, "environ_parameters": environ_parameters}, "kpoints": kpoints},
+            "structure_pks": List(list=[structure.pk]),
+            "expt_energy": List(list=[-0.1]),
+            "pseudo_label": Str("SSSPe"),
+            "environ_vacuum": Dict({"ENVIRON": {"env_static_permittivity": 1.0}}),
+            "environ_solution": Dict({"ENVIRON": {}}),
+            **kwargs,
+        }
+        process = instantiate_process(get_manager().get_runner(), ParameterizationWorkChain, **inputs)
+        process.submitted = []
+
+        def submit(process_class, **inputs):
+            process.submitted.append(inputs)
+            return SimpleNamespace(pk=-len(process.submitted))
+
+        process.submit = submit
+        return process
+
+    return _generate_parameterization
+
+
+def _get_finished_process(inputs):
+    node = WorkflowNode(process_type=EnvPwBaseWorkChain.build_process_type())
+    for link_label, input_node in get_lookup_inputs(inputs).items():
+        if input_node is not None:
+            node.base.links.add_incoming(input_node.store(), LinkType.INPUT_WORK, link_label)
+    node.set_process_state(ProcessState.FINISHED)
+    node.set_exit_status(0)
+    return node.store()
+
+
+def test_reuse_vacuum(generate_parameterization):
+    process = generate_parameterization(reuse_vacuum=Bool(False))
+    assert process.setup() is None
+    process.run_vacuum()
+    assert len(process.submitted) == 1
+
+    # the vacuum parameters are only stored by the submission, the lookup compares their content
+    (vacuum_inputs,) = process.submitted
+    assert not vacuum_inputs["pw"]["environ_parameters"].is_stored
+    node = _get_finished_process(vacuum_inputs)
+
+    process = generate_parameterization()
+    assert process.setup() is None
+    process.run_vacuum()
+    assert not process.submitted
+    assert process.ctx.calculations["vacuum_0"] == node.pk
+
+
+def test_invalid_alpha_derivative(generate_parameterization):
+    process = generate_parameterization(alpha_derivative=Str("analytic"))
+
+    assert process.setup() == process.exit_codes.ERROR_INVALID_INPUT
+
+
+def test_alpha_restart(generate_parameterization, generate_remote_data, fixture_localhost):
+    process = generate_parameterization(alpha_derivative=Str("restart"))
+    assert process.setup() is None
+    assert process.should_restart_alpha()
+
+    remote_folder = generate_remote_data(fixture_localhost, "/tmp").store()
+    outputs = SimpleNamespace(remote_folder=remote_folder)
+    process.ctx.solution_0_0 = SimpleNamespace(pk=remote_folder.pk, is_finished_ok=True, outputs=outputs)
+    process.run_alpha_restart()
+
+    (inputs,) = process.submitted
+    parameters = inputs["pw"]["parameters"].get_dict()
+    environ_parameters = inputs["pw"]["environ_parameters"].get_dict()
+    assert parameters["ELECTRONS"]["startingpot"] == "file"
+    assert parameters["ELECTRONS"]["startingwfc"] == "file"
+    assert environ_parameters["BOUNDARY"]["alpha"] == pytest.approx(1.12 + process.ctx.delta)
+    assert environ_parameters["ENVIRON"]["environ_restart"]
+    assert inputs["pw"]["parent_folder"].uuid == remote_folder.uuid
+    # the restart does not change the parameters shared by all the solutes
+    assert "environ_restart" not in process.ctx.solution_inputs_1["ENVIRON"]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import pytest
+from aiida.engine.utils import instantiate_process
+from aiida.manage.manager import get_manager
+from aiida.orm import Bool, Dict, Float, Str, StructureData
+from aiida.plugins import WorkflowFactory
+
+from aiida_environ.calculations.hessian import get_partial_displacements
+from aiida_environ.workflows.pw.pka import pKaWorkChain
+
+PwRelaxWorkChain = WorkflowFactory("environ.pw.relax")
+
+METHANOL = [
+    ("C", [5.0, 5.0, 5.0]),
+    ("O", [6.4, 5.0, 5.0]),
+    ("H", [4.6, 6.0, 5.0]),
+    ("H", [6.7, 5.9, 5.0]),
+    ("H", [4.6, 4.5, 5.9]),
+]
+
+
+def _get_molecule(sites):
+    structure = StructureData(cell=[[10.0, 0.0, 0.0], [0.0, 10.0, 0.0], [0.0, 0.0, 10.0]])
+    for symbol, position in sites:
+        structure.append_atom(position=position, symbols=symbol)
+    return structure
+
+
+@pytest.fixture
+def generate_inputs_pka(generate_inputs_pw):
+    """Generate inputs for a ``pKaWorkChain`` of methanol and methoxide."""
+
+    def _generate_inputs_pka(**kwargs):
+        pw = generate_inputs_pw()
+        pw.pop("structure")
+        pw.pop("pseudos")
+        kpoints = pw.pop("kpoints")
+        parameters = pw["parameters"].get_dict()
+        parameters["CONTROL"]["calculation"] = "relax"
+        pw["parameters"] = Dict(parameters)
+
+        inputs = {
+            "structures": {"acid": _get_molecule(METHANOL), "base": _get_molecule(METHANOL[:3] + METHANOL[4:])},
+            "pseudo_family": Str("SSSP/1.1/PBE/efficiency"),
+            "phonopy_in_process": Bool(True),
+            **kwargs,
+        }
+        for environment, permittivity in (("vacuum", 1.0), ("solution", 78.3)):
+            environ_parameters = Dict({"ENVIRON": {"env_static_permittivity": permittivity}})
+            inputs[environment] = {"base": {"pw": {**pw, "environ_parameters": environ_parameters}, "kpoints": kpoints}}
+        return inputs
+
+    return _generate_inputs_pka
+
+
+@pytest.fixture
+def generate_pka_workchain(generate_inputs_pka):
+    """Generate an instance of a ``pKaWorkChain``, which has no entry point."""
+
+    def _generate_pka_workchain(**kwargs):
+        inputs = generate_inputs_pka(**kwargs)
+        return instantiate_process(get_manager().get_runner(), pKaWorkChain, **inputs), inputs
+
+    return _generate_pka_workchain
+
+
+def test_relax_inputs_per_structure(generate_pka_workchain):
+    process, inputs = generate_pka_workchain()
+
+    assert process.setup() is None
+    for environment in ("vacuum", "solution"):
+        for label, structure in inputs["structures"].items():
+            relax_inputs = process._get_relax_inputs(environment, label)
+
+            assert PwRelaxWorkChain.spec().inputs.validate(relax_inputs) is None
+            assert relax_inputs.structure.uuid == structure.uuid
+            assert set(relax_inputs.base.pw.pseudos) == set(structure.get_kind_names())
+
+
+def test_partial_hessian_inputs(generate_pka_workchain):
+    partial_hessian = {"acid": Str("acid"), "base": Str("base"), "radius": Float(1.2)}
+    process, inputs = generate_pka_workchain(partial_hessian=partial_hessian)
+
+    assert process.setup() is None
+    # the oxygen loses the hydroxyl proton, which is the only other atom within the radius in the acid
+    assert process.ctx.partial_centers == {"acid": 1, "base": 1}
+    for label, active in (("acid", [1, 3]), ("base", [1])):
+        # the relaxed structure keeps the order of the sites of the structure that was relaxed
+        structure = process._get_relax_inputs("solution", label).structure
+        parameters = process._get_partial_parameters(label, structure)
+
+        assert structure.uuid == inputs["structures"][label].uuid
+        assert parameters["active"] == active
+        assert structure.sites[parameters["center"]].kind_name == "O"
+        assert len(get_partial_displacements(structure, parameters)) == 6 * len(active)
+
+
+def test_solution_only(generate_inputs_pka):
+    inputs = generate_inputs_pka(solution_only=Bool(True))
+    inputs.pop("vacuum")
+    process = instantiate_process(get_manager().get_runner(), pKaWorkChain, **inputs)
+
+    assert process.setup() is None
+    assert not process.should_run_vacuum()
+    assert process.ctx.environments == ("solution",)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from aiida.orm import Bool, Dict, List, Str
+
+from aiida_environ.workflows.pka.screening import pKaScreeningWorkChain
+from aiida_environ.workflows.pw.pka import pKaWorkChain
+
+
+def test_pka_inputs_without_phonopy_code(generate_inputs_pw):
+    pw = generate_inputs_pw()
+    structure = pw.pop("structure")
+    kpoints = pw.pop("kpoints")
+    parameters = pw["parameters"].get_dict()
+    parameters["CONTROL"]["calculation"] = "relax"
+    pw["parameters"] = Dict(parameters)
+
+    # the `pka` namespace as filled by `get_builder_from_protocol`, which leaves out the `vacuum` and `phonopy_code`
+    pka = {
+        "solution": {"base": {"pw": {**pw, "environ_parameters": Dict()}, "kpoints": kpoints}},
+        "pseudo_family": Str("SSSP/1.1/PBE/efficiency"),
+    }
+    inputs = {
+        "pka": pka,
+        "structures": {"acid": structure, "base": structure},
+        "pairs": List(list=[["acid", "base"]]),
+        "clean_workdir": Bool(False),
+    }
+
+    assert pKaScreeningWorkChain.spec().inputs.validate(inputs) is None
+    # the species are run with `solution_only` and `phonopy_in_process`, without them the `vacuum` inputs and the
+    # `phonopy_code` are required
+    species = {**pka, "structures": inputs["structures"]}
+    assert pKaWorkChain.spec().inputs.validate(species) is not None
+    assert pKaWorkChain.spec().inputs.validate({**species, "solution_only": Bool(True)}) is not None
+    species.update(solution_only=Bool(True), phonopy_in_process=Bool(True))
+    assert pKaWorkChain.spec().inputs.validate(species) is None